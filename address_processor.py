@@ -4,50 +4,129 @@ import unicodedata
 import re
 from typing import List, Dict, Optional, Tuple
 from config import config
+from metrics import metrics
+
+def normalize_address(s) -> str:
+    #Vereinheitlicht Schreibweisen (Umlaute, "straße"/"str."/"str", Leerzeichen) für den Adressvergleich
+    if not isinstance(s, str):
+        return ""
+    s = unicodedata.normalize('NFKD', s).encode('ASCII', 'ignore').decode('ASCII').lower().strip()
+    # Vereinheitliche "straße" und "str." und "str"
+    s = re.sub(r'\bstrasse\b', 'str', s)
+    s = re.sub(r'\bstr\.\b', 'str', s)
+    s = re.sub(r'\bstr\b', 'str', s)
+    s = s.replace(" ", "")
+    return s
+# Info: Hier werden verschiedenste Arten wie eine Adresse geschrieben werden kann vereinheitlicht
+# ... damit auch jede mögliche Eingabe gefunden wird
+
+
+def _split_house_number(key: str) -> Tuple[str, int, str]:
+    #"kaiserstr10a" -> ("kaiserstr", 10, "a"); ohne Hausnummer -> (key, -1, "")
+    match = re.search(r'\d+', key)
+    if match is None:
+        return key, -1, ""
+    return key[:match.start()], int(match.group()), key[match.end():]
+
+
+class AddressSearchIndex:
+    #Suchindex über die normalisierten Straßenanteile aller Adressen (wird einmalig beim Laden erstellt)
+    #PROBLEM: Bisher wurde bei jeder Suche jede Adresse normalisiert und per Teilstring verglichen
+    #Lösung: Trigramm-Index (3 aufeinanderfolgende Zeichen -> Schlüssel, die sie enthalten)
+    #Ein Schlüssel enthält die Anfrage nur, wenn er jedes ihrer Trigramme enthält -> es genügt, die Schlüssel
+    #des seltensten Trigramms mit einem echten Teilstring-Vergleich zu prüfen
+    #Gleiche "contains"-Semantik wie bisher, Ergebnisse aber deterministisch sortiert:
+    #exakter Treffer, dann Präfix, dann Teilstring; jeweils nach Straßenname, Hausnummer und Zeile
+
+    def __init__(self, addresses: pd.Series):
+        self.keys = []       #Eindeutige normalisierte Straßenanteile (z.B. "kaiserstr10")
+        self.key_rows = []   #Schlüssel -> Zeilen im Adress-DataFrame (in Dateireihenfolge)
+        key_ids = {}
+        for row, address in enumerate(addresses.tolist()):
+            key = normalize_address(address.split(',')[0]) if isinstance(address, str) else "" # Nur der Teil vor dem ersten Komma
+            key_id = key_ids.get(key)
+            if key_id is None:
+                key_id = key_ids[key] = len(self.keys)
+                self.keys.append(key)
+                self.key_rows.append([])
+            self.key_rows[key_id].append(row)
+        self.house_numbers = [_split_house_number(key) for key in self.keys]
+
+        self.trigrams = {}   #Trigramm -> Schlüssel-IDs (aufsteigend)
+        for key_id, key in enumerate(self.keys):
+            for trigram in {key[i:i + 3] for i in range(len(key) - 2)}:
+                self.trigrams.setdefault(trigram, []).append(key_id)
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[int]:
+        #Liefert die Zeilen aller Adressen, deren Straßenanteil die Anfrage enthält (sortiert, s.o.)
+        query_norm = normalize_address(query.split(',')[0]) # Nur der Teil vor dem ersten Komma
+        if len(query_norm) < 3:
+            candidates = range(len(self.keys)) #Zu kurz für Trigramme -> alle Schlüssel prüfen
+        else:
+            postings = []
+            for i in range(len(query_norm) - 2):
+                posting = self.trigrams.get(query_norm[i:i + 3])
+                if posting is None:
+                    return [] #Trigramm kommt in keiner Adresse vor
+                postings.append(posting)
+            candidates = min(postings, key=len)
+
+        keys = self.keys
+        matches = [key_id for key_id in candidates if query_norm in keys[key_id]]
+
+        _, query_number, _ = _split_house_number(query_norm)
+        def rank(key_id):
+            key = keys[key_id]
+            street, number, suffix = self.house_numbers[key_id]
+            match_class = 0 if key == query_norm else (1 if key.startswith(query_norm) else 2)
+            #Mit Hausnummer in der Anfrage: gleiche Nummer zuerst (z.B. "2" vor "21")
+            number_distance = abs(number - query_number) if query_number >= 0 and number >= 0 else 0
+            return (match_class, len(street), street, number_distance, number, suffix, key_id)
+        matches.sort(key=rank)
+
+        rows = []
+        for key_id in matches:
+            rows.extend(self.key_rows[key_id])
+            if limit is not None and len(rows) >= limit:
+                return rows[:limit]
+        return rows
+
 
 class AddressProcessor:
     def __init__(self):
         self.addresses_df = None
+        self.search_index = None #Normalisierter Suchindex über alle Adressen (AddressSearchIndex)
+        self._address_columns = ([], []) #Spaltennamen und Spaltenwerte als Listen (für find_address)
         self.load_addresses()
 
     def load_addresses(self) -> bool:
         #Lädt die Adressendatenbank
         try:
-            self.addresses_df = pd.read_csv(config.ADDRESSES_CSV_PATH)
-            print("Adressdatensatz wird geladen...")
-            print(f"{len(self.addresses_df)} Adressen geladen")
+            with metrics.timer('address_load_seconds'):
+                self.addresses_df = pd.read_csv(config.ADDRESSES_CSV_PATH)
+                print("Adressdatensatz wird geladen...")
+                print(f"{len(self.addresses_df)} Adressen geladen")
+                self.search_index = AddressSearchIndex(self.addresses_df['full_address'])
+            metrics.set_gauge('address_count', len(self.addresses_df))
+            self._address_columns = (list(self.addresses_df.columns),
+                                     [self.addresses_df[col].tolist() for col in self.addresses_df.columns])
+            print(f"Adress-Suchindex erstellt: {len(self.search_index.keys)} Schlüssel, {len(self.search_index.trigrams)} Trigramme")
             return True
         except Exception as e:
             print(f"Fehler beim Laden der Adressen: {e}")
             return False
         
-    def find_address(self, query: str) -> List[Dict]:
+    def find_address(self, query: str, limit: Optional[int] = None) -> List[Dict]:
         # Sucht Adressen basierend auf Eingaben, mit unicodedata auch geeignet für Umlaut und Sonderzeichen
-        if self.addresses_df is None:
+        # Teilt Query und Adressen an Kommas auf und vergleicht nur den Straßenanteil (siehe AddressSearchIndex)
+        # limit: maximale Anzahl Treffer (None = alle), beste Treffer zuerst
+        if self.addresses_df is None or self.search_index is None:
             return []
-        
-        def normalize(s):
-            if not isinstance(s, str):
-                return ""
-            s = unicodedata.normalize('NFKD', s).encode('ASCII', 'ignore').decode('ASCII').lower().strip()
-            # Vereinheitliche "straße" und "str." und "str"
-            s = re.sub(r'\bstrasse\b', 'str', s)
-            s = re.sub(r'\bstr\.\b', 'str', s)
-            s = re.sub(r'\bstr\b', 'str', s)
-            s = s.replace(" ", "")
-            return s
-        
-        # Teilt Query und Adressen an Kommas auf und vergleicht nur den Straßenanteil
-        query_norm = normalize(query.split(',')[0]) # Nur der Teil vor dem ersten Komma
-
-        def address_street_part(addr):
-            return normalize(addr.split(',')[0]) # Nur der Teil vor dem ersten Komma
-        
-        matches = self.addresses_df[self.addresses_df['full_address'].apply(address_street_part).str.contains(query_norm, na=False)]
 
-        return matches.to_dict('records')
-    # Info: Hier werden verschiedenste Arten wie eine Adresse geschrieben werden kann vereinheitlicht
-    # ... damit auch jede mögliche Eingabe gefunden wird
+        rows = self.search_index.search(query, limit)
+        #Dictionaries direkt aus den Spaltenlisten (schneller als DataFrame.iloc[...].to_dict für wenige Zeilen)
+        columns, values = self._address_columns
+        return [{col: column_values[row] for col, column_values in zip(columns, values)} for row in rows]
 
     def get_nearest_stops(self, lat: float, lon: float, gtfs_loader, max_distance: int = None, max_result: int = 3) -> List[Dict]:
         #Findet nächstgelegene Haltestelle zu Koordinate
@@ -56,32 +135,24 @@ class AddressProcessor:
 
         if gtfs_loader.stops is None:
             return []
-        
-        stops_with_distance = []
 
-        for _, stop in gtfs_loader.stops.iterrows():
-            if pd.isna(stop.get('stop_lat')) or pd.isna(stop.get('stop_lon')):
-                continue
-
-            distance = self._haversine_distance(
-                lat, lon,
-                float(stop['stop_lat']),
-                float(stop['stop_lon'])
-            )
-
-            if distance <= max_distance:
-                stop_dict = stop.to_dict()
-                stop_dict['walking_distance'] = distance
-                stop_dict['walking_time'] = distance / config.WALKING_SPEED_MS
-                stops_with_distance.append(stop_dict)
-        
-        #Sortiere nach Entfernung
-        stops_with_distance.sort(key=lambda x: x['walking_distance'])
+        #Räumlicher Index statt Schleife über alle Haltestellen (wird beim Laden einmalig erstellt)
+        if gtfs_loader.stop_index is None:
+            gtfs_loader.build_stop_index()
+        rows, distances = gtfs_loader.stop_index.nearest(lat, lon, max_result, max_distance)
 
-        if stops_with_distance is None:
+        if len(rows) == 0 and config.DEBUG_OUTPUT:
             print(f"Keine Haltestellen im Umkreis von {max_distance} gefunden")
 
-        return stops_with_distance[:max_result]
+        #Nur für die Treffer werden Dictionaries erzeugt
+        stops_with_distance = []
+        for row, distance in zip(rows.tolist(), distances.tolist()):
+            stop_dict = gtfs_loader.get_stop_by_row(row)
+            stop_dict['walking_distance'] = distance
+            stop_dict['walking_time'] = distance / config.WALKING_SPEED_MS
+            stops_with_distance.append(stop_dict)
+
+        return stops_with_distance
     
     def _haversine_distance(self, lat1:float, lon1:float, lat2:float, lon2:float) -> float:
         #Berechnet Luftlinienentfernung zwischen zwei Koordinaten
@@ -0,0 +1,227 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, asdict, replace
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional
+from config import config
+from metrics import metrics
+from service_calendar import ALL_DAYS_BIT
+from synthetic_gtfs import SIZES, generate_feed, generate_trip_updates
+
+try:
+    import resource #Nur Unix; unter Windows wird kein Speicher gemessen
+except ImportError:
+    resource = None
+
+#Benchmark der einzelnen Phasen auf einem synthetischen Feed (läuft offline, ohne KVV-Daten)
+#Gemessen werden Laden, Verbindungsgraph, Fußwege, Ortsauflösung, Routing je Engine und Echtzeit getrennt,
+#jeweils mit Laufzeit, Durchsatz und Spitzen-Speicher (maximale RSS des Prozesses nach der Phase)
+#Mit --baseline wird gegen eine frühere Messung (--output) verglichen -> Exit-Code 1 bei Regression
+#
+#Aufruf: python benchmark.py --size medium --queries 50 --output bench.json [--baseline alt.json]
+
+
+@dataclass
+class PhaseResult:
+    name: str
+    seconds: float
+    items: int #Verarbeitete Einheiten (Zeilen, Verbindungen, Anfragen, ...)
+    unit: str
+    peak_rss_mb: Optional[float]
+
+    @property
+    def throughput(self) -> float:
+        return self.items / self.seconds if self.seconds > 0 else float('inf')
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024 #macOS: Bytes, Linux: KiB
+
+
+def _measure(name: str, unit: str, func: Callable[[], int], verbose: bool = False) -> PhaseResult:
+    #Führt func aus (Rückgabe = Anzahl verarbeiteter Einheiten); die print-Ausgaben der Module werden verschluckt
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        start = time.perf_counter()
+        items = func()
+        seconds = time.perf_counter() - start
+    return PhaseResult(name, seconds, items, unit, _peak_rss_mb())
+
+
+def _first_weekday(start: date) -> datetime:
+    #Erster Werktag (Mo-Fr) ab start -> Werktags-Fahrten sind aktiv
+    day = start
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    return datetime.combine(day, datetime.min.time())
+
+
+def run_benchmark(size: str = 'medium', queries: int = 50, seed: int = 1, engines: Optional[List[str]] = None,
+                  feed_path: Optional[str] = None, verbose: bool = False) -> List[PhaseResult]:
+    #Erzeugt (falls nötig) den Feed und misst alle Phasen nacheinander
+    from gtfs_loader import GTFSLoader
+    from gtfs_processing import GTFSProcessor
+    from address_processor import AddressProcessor
+    from routing import PublicTransportRouter
+    from realtime import RealtimeOverlay
+
+    engines = engines or list(PublicTransportRouter.ENGINES)
+    feed = replace(SIZES[size], seed=seed)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = feed_path or os.path.join(tmp, 'gtfs')
+        results.append(_measure('Feed erzeugen', 'Zeilen', lambda: sum(generate_feed(path, feed).values())))
+
+        config.GTFS_PATH = path
+        config.ADDRESSES_CSV_PATH = os.path.join(path, 'addresses.csv')
+        config.GTFS_CACHE_PATH = os.path.join(tmp, 'cache')
+
+        #Laden aus CSV und aus dem Binär-Cache (erster Lauf füllt den Cache)
+        loader = GTFSLoader()
+        config.USE_GTFS_CACHE = False
+        results.append(_measure('Laden (CSV)', 'Trips',
+                                lambda: loader.load_gtfs_data() and len(loader.trips), verbose))
+        config.USE_GTFS_CACHE = True
+        with contextlib.redirect_stdout(io.StringIO()):
+            GTFSLoader().load_gtfs_data()
+        loader = GTFSLoader()
+        results.append(_measure('Laden (Cache)', 'Trips',
+                                lambda: loader.load_gtfs_data() and len(loader.trips), verbose))
+
+        #Verbindungsgraph (inkl. Fußwege), danach die Fußwege allein
+        processor = GTFSProcessor(loader)
+        build_date = _first_weekday(feed.start_date)
+        results.append(_measure('Verbindungsgraph', 'Verbindungen',
+                                lambda: processor.build_connection_graph(build_date) and len(processor.connections),
+                                verbose))
+        results.append(_measure('Fußwege', 'Fußwege', lambda: len(processor._build_footpaths()), verbose))
+
+        #Ortsauflösung: Haltestellennamen und Adressen (Straßenanteil bekannter Adressen)
+        with contextlib.redirect_stdout(io.StringIO()):
+            addresses = AddressProcessor()
+        router = PublicTransportRouter(loader, processor, addresses)
+        rnd = random.Random(seed)
+        stop_names = loader.stops['stop_name'].drop_duplicates().tolist()
+        names = [rnd.choice(stop_names) for _ in range(queries)]
+        results.append(_measure('Ortsauflösung (Namen)', 'Anfragen',
+                                lambda: len([router._resolve_location(name) for name in names]), verbose))
+        if addresses.addresses_df is not None and len(addresses.addresses_df):
+            known = addresses.addresses_df['full_address'].tolist()
+            address_queries = [rnd.choice(known).split(',')[0] for _ in range(queries)]
+            results.append(_measure('Ortsauflösung (Adressen)', 'Anfragen',
+                                    lambda: len([router._resolve_location(q) for q in address_queries]), verbose))
+
+        #Routing je Engine: erste Anfrage (Fahrplan-Aufbau) getrennt von den eigentlichen Anfragen
+        pairs = [(rnd.choice(stop_names), rnd.choice(stop_names), timedelta(seconds=rnd.randint(6 * 3600, 20 * 3600)))
+                 for _ in range(queries)]
+        service_date = build_date.date()
+        if processor.service_day(service_date) == ALL_DAYS_BIT:
+            print(f"WARNUNG: {service_date} wird ohne Tagesfilter geroutet, die Messung ist nicht repräsentativ")
+        for engine in engines:
+            start, end, departure = pairs[0]
+            results.append(_measure(f'Routing {engine} (Aufbau)', 'Anfragen', lambda: len([
+                router.find_routes(start, end, departure, engine=engine, service_date=service_date)
+            ]), verbose))
+            results.append(_measure(f'Routing {engine}', 'Anfragen', lambda: len([
+                router.find_routes(start, end, departure, engine=engine, service_date=service_date)
+                for start, end, departure in pairs
+            ]), verbose))
+
+        #Echtzeit: Meldungen für 10% der Trips übernehmen (ohne Neuaufbau des Graphen),
+        #danach die erste Anfrage je Engine (enthält den Neuaufbau des Tagesfahrplans aus dem neuen Stand)
+        realtime_path = os.path.join(tmp, 'trip_updates.json')
+        generate_trip_updates(path, realtime_path, service_date, seed=seed)
+        overlay = RealtimeOverlay(processor, service_date)
+        results.append(_measure('Echtzeit übernehmen', 'Meldungen',
+                                lambda: overlay.load_file(realtime_path) and len(overlay.updates), verbose))
+        for engine in engines:
+            start, end, departure = pairs[0]
+            results.append(_measure(f'Routing {engine} (Echtzeit)', 'Anfragen', lambda: len([
+                router.find_routes(start, end, departure, engine=engine, service_date=service_date)
+            ]), verbose))
+    return results
+
+
+def print_results(results: List[PhaseResult], baseline: Optional[Dict[str, Dict]] = None):
+    print(f"\n{'Phase':<30} {'Zeit [s]':>10} {'Durchsatz':>22} {'Peak RSS [MB]':>14} {'Vergleich':>10}")
+    print("-" * 90)
+    for result in results:
+        throughput = f"{result.throughput:,.0f} {result.unit}/s"
+        rss = f"{result.peak_rss_mb:.0f}" if result.peak_rss_mb is not None else "-"
+        change = ""
+        if baseline and result.name in baseline and baseline[result.name]['seconds'] > 0:
+            change = f"{(result.seconds / baseline[result.name]['seconds'] - 1) * 100:+.0f}%"
+        print(f"{result.name:<30} {result.seconds:>10.3f} {throughput:>22} {rss:>14} {change:>10}")
+
+
+def find_regressions(results: List[PhaseResult], baseline: Dict[str, Dict], tolerance: float,
+                     min_seconds: float = 0.1) -> List[str]:
+    #Phasen, die um mehr als tolerance (Anteil) langsamer sind als in der Baseline
+    #Sehr kurze Phasen (< min_seconds) schwanken zu stark und werden nicht bewertet
+    regressions = []
+    for result in results:
+        old = baseline.get(result.name)
+        if old is None or max(old['seconds'], result.seconds) < min_seconds:
+            continue
+        if result.seconds > old['seconds'] * (1 + tolerance):
+            regressions.append(f"{result.name}: {old['seconds']:.3f}s -> {result.seconds:.3f}s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Phasen-Benchmark auf einem synthetischen GTFS-Feed")
+    parser.add_argument('--size', choices=sorted(SIZES), default='medium')
+    parser.add_argument('--queries', type=int, default=50, help="Anfragen pro Engine bzw. Ortsauflösung")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--engines', nargs='*', default=None, help="Standard: alle Engines")
+    parser.add_argument('--feed', default=None, help="Feed in diesem Ordner erzeugen und behalten")
+    parser.add_argument('--output', default=None, help="Ergebnis als JSON speichern")
+    parser.add_argument('--baseline', default=None, help="JSON einer früheren Messung zum Vergleich")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Erlaubte Verlangsamung (0.25 = 25%%)")
+    parser.add_argument('--verbose', action='store_true', help="Ausgaben der Module anzeigen")
+    parser.add_argument('--metrics', action='store_true', help="Messwerte sammeln und am Ende ausgeben (metrics.py)")
+    args = parser.parse_args()
+
+    print(f"Benchmark: Größe {args.size}, {args.queries} Anfragen, seed {args.seed}")
+    metrics.enabled = args.metrics
+    results = run_benchmark(args.size, args.queries, args.seed, args.engines, args.feed, args.verbose)
+    if args.metrics:
+        print("\n" + metrics.snapshot())
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            data = json.load(f)
+        if (data.get('size'), data.get('queries'), data.get('seed')) != (args.size, args.queries, args.seed):
+            print("⚠ Baseline wurde mit anderer Größe/Anzahl/seed gemessen - Vergleich nur eingeschränkt aussagekräftig")
+        baseline = {entry['name']: entry for entry in data['phases']}
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'size': args.size, 'queries': args.queries, 'seed': args.seed,
+                       'phases': [asdict(result) for result in results]}, f, ensure_ascii=False, indent=2)
+        print(f"\nErgebnis gespeichert: {args.output}")
+
+    if baseline:
+        regressions = find_regressions(results, baseline, args.tolerance)
+        if regressions:
+            print("\nREGRESSIONEN:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\n✓ Keine Regressionen")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 import os
 from dataclasses import dataclass, field
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 
 @dataclass
 class Config:
@@ -8,11 +8,35 @@ class Config:
     GTFS_PATH: str = "google_transit" # Pfad zu den Kvv GTFS Daten
     OSM_PBF_PATH: str = "ka_bbbike.osm.pbf" #Pfad zu der OSM-Datei
     ADDRESSES_CSV_PATH: str = "karlsruhe_addresses.csv" #Pfad zu der Adress-CSV
+    GTFS_CACHE_PATH: str = "gtfs_cache" #Ordner für den binären GTFS-Cache (wird automatisch erstellt)
+    USE_GTFS_CACHE: bool = True #False -> GTFS-Dateien werden bei jedem Start neu aus CSV gelesen
+    STOP_TIMES_CHUNK_ROWS: int = 500000 #Zeilen pro Block beim Einlesen von stop_times.txt (kleiner = weniger Speicher)
 
     #Routing-Einstellungen
     MAX_WALKING_DISTANCE_M: int = 800 #Maximale Fußwegdistanz in Metern
     WALKING_SPEED_MS: float = 1.5 #Gehgeschwindigkeit in m/s
     TRANSFER_TIME_SECONDS: int = 30 #Mindest-Umstiegzeit in Sekunden
+    ROUTING_ENGINE: str = "dijkstra" #Standard-Engine für find_routes: "dijkstra", "csa" oder "raptor"
+    MAX_TRANSFERS: int = 3 #Maximale Anzahl Umstiege pro Route
+    MAX_STATIONS_PER_LOCATION: int = 3 #Gefundene Stationen pro Namenssuche (jeweils mit allen Gleisen)
+    PROFILE_WINDOW_MINUTES: int = 60 #Zeitfenster für Profil-Anfragen (alle Verbindungen der nächsten X Minuten)
+    MAX_WAIT_SECONDS: int = 7200 #Dijkstra: maximale Wartezeit auf eine Abfahrt an einer Haltestelle
+    SERVICE_WINDOW_DAYS: int = 7 #Anzahl Betriebstage ab Programmstart, für die Anfragen beantwortet werden (max. 62)
+    MIN_ACTIVE_ROUTE_SHARE: float = 0.1 #Anteil der Linien des Feeds, der an einem Tag mindestens fahren muss, sonst Routing ohne Tagesfilter (0 = nur bei 0 Linien)
+
+    #Routing-Dienst (routing_service.py)
+    SERVICE_HOST: str = "127.0.0.1" #Adresse, auf der der HTTP-Dienst lauscht
+    SERVICE_PORT: int = 8080 #Port des HTTP-Dienstes
+    SERVICE_WORKERS: int = 4 #Threads für Routing-Berechnungen (die Event-Loop blockiert nie)
+    REALTIME_FEED_PATH: Optional[str] = None #GTFS-Realtime TripUpdates (.json oder .pb), None = nur Sollfahrplan
+    REALTIME_POLL_SECONDS: int = 30 #Abstand, in dem die Echtzeit-Datei auf Änderungen geprüft wird
+
+    #OD-Matrizen (od_matrix.py)
+    OD_WORKERS: int = 0 #Prozesse für die Matrix-Berechnung (0 = Anzahl CPU-Kerne)
+
+    #Diagnose (metrics.py)
+    METRICS_ENABLED: bool = False #True -> Zähler und Laufzeit-Histogramme sammeln (Ausgabe: metrics.snapshot())
+    DEBUG_OUTPUT: bool = False #True -> ausführliche Diagnose-Ausgaben (Statistiken, Suchverlauf) auf der Konsole
 
     #Verkehrsmittel-Prioritäten
     TRANSPORT_PRIORITIES: Dict[str, int] = field(default_factory=lambda: 
@@ -23,6 +47,12 @@ class Config:
         'bus': 3 #Niedrigste Prorität für Busse
     })
 
+    #Verkehrsmittel je Modus (None = alle Verkehrsmittel erlaubt)
+    TRANSPORT_MODE_TYPES: Dict[int, Optional[List[str]]] = field(default_factory=lambda: {
+        1: ['rail', 'subway', 'tram'], # Nur Bahn (S-Bahn, Straßenbahn)
+        2: None                        # Bus und Bahn
+    })
+
     #GTFS Route-Typen Mapping
     GTFS_ROUTE_TYPES: Dict[int, str] = field(default_factory=lambda: {
         0: 'tram',      # Straßenbahn
@@ -0,0 +1,222 @@
+import copy
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+from typing import Dict, List, Optional
+from config import config
+from service_calendar import active_on_day
+
+#Kompakte Darstellung aller Verbindungen und Fußwege
+#PROBLEM: Jede Verbindung war ein Dictionary mit 11+ Einträgen (Text-IDs, zwei timedelta-Objekte),
+#jeder Fußweg ein weiteres Dictionary -> auf dem ganzen KVV-Feed Millionen kleiner Python-Objekte
+#Lösung: Haltestellen-, Trip- und Linien-IDs werden einmalig auf fortlaufende Integer abgebildet (interniert),
+#die Verbindungen liegen als parallele, typisierte NumPy-Arrays vor (eine Position = eine Verbindung)
+#Texte (Linienname, Richtung, IDs) werden erst für die Verbindungen einer gefundenen Route nachgeschlagen (record)
+
+#Arrays mit einem Eintrag pro Verbindung (select/concat behandeln genau diese)
+CONNECTION_FIELDS = ('dep', 'arr', 'from_stop', 'to_stop', 'from_seq', 'to_seq', 'trip', 'route', 'service_mask',
+                     'day_offset')
+
+
+class ConnectionArrays:
+
+    def __init__(self, table: pd.DataFrame, trips: pd.DataFrame, stops: Optional[pd.DataFrame],
+                 footpaths: Optional[pd.DataFrame]):
+        #table: Verbindungen aus GTFSProcessor._build_connection_table (Reihenfolge bleibt erhalten),
+        #       Spalte trip = Zeile in trips
+        #trips: Trip- und Linieninformationen pro Trip (trip_id, route_id, route_short_name, route_long_name,
+        #       route_type, headsign, priority)
+        #footpaths: Fußwege aus GTFSProcessor._build_footpaths (from_stop_id, to_stop_id, distance, walking_time)
+        stop_columns = [table['from_stop_id'].to_numpy(dtype=object), table['to_stop_id'].to_numpy(dtype=object)]
+        if stops is not None:
+            stop_columns.insert(0, stops['stop_id'].to_numpy(dtype=object))
+        #Alle Haltestellen, auch solche ohne Verbindungen (z.B. Parent-Stationen)
+        self.stop_ids: List[str] = list(pd.unique(np.concatenate(stop_columns)))
+        self.stop_index: Dict[str, int] = {stop_id: i for i, stop_id in enumerate(self.stop_ids)}
+        stop_lookup = pd.Index(self.stop_ids)
+
+        #Trips und Linien in der Reihenfolge ihres ersten Auftretens in table nummerieren
+        #trip_rows: Zeile in trips pro Trip-Nummer
+        trip_codes, trip_rows = pd.factorize(table['trip'].to_numpy())
+        route_of_trip, route_ids = pd.factorize(trips['route_id'].to_numpy(dtype=object)[trip_rows])
+        self.trip_ids: List[str] = trips['trip_id'].to_numpy(dtype=object)[trip_rows].tolist()
+        self.route_ids: List[str] = list(route_ids)
+
+        #Pro Verbindung (alle Arrays gleich lang)
+        self.dep = table['departure_time'].to_numpy(dtype=np.int32)       #Abfahrt in Sekunden nach Mitternacht
+        self.arr = table['arrival_time'].to_numpy(dtype=np.int32)         #Ankunft in Sekunden nach Mitternacht
+        self.from_stop = stop_lookup.get_indexer(table['from_stop_id']).astype(np.int32)
+        self.to_stop = stop_lookup.get_indexer(table['to_stop_id']).astype(np.int32)
+        self.from_seq = table['from_stop_sequence'].to_numpy(dtype=np.int32) #stop_sequence aus stop_times (für Echtzeit)
+        self.to_seq = table['to_stop_sequence'].to_numpy(dtype=np.int32)
+        self.trip = trip_codes.astype(np.int32)
+        self.route = route_of_trip[trip_codes].astype(np.int32)
+        self.service_mask = table['service_mask'].to_numpy(dtype=np.uint64) #Betriebstage (service_calendar.py)
+        self.day_offset = table['day_offset'].to_numpy(dtype=np.int8)      #-1 = Fahrt des Vortags nach 24:00
+
+        #Pro Trip bzw. Linie (Linieninformationen vom ersten Trip der Linie)
+        first_of_route = trip_rows[np.unique(route_of_trip, return_index=True)[1]]
+        self.trip_headsigns: List = trips['headsign'].to_numpy(dtype=object)[trip_rows].tolist()
+        self.route_short_names: List = trips['route_short_name'].to_numpy(dtype=object)[first_of_route].tolist()
+        self.route_long_names: List = trips['route_long_name'].to_numpy(dtype=object)[first_of_route].tolist()
+        self.route_types: List = trips['route_type'].to_numpy(dtype=object)[first_of_route].tolist()
+        self.route_priorities = trips['priority'].to_numpy(dtype=np.int8)[first_of_route]
+        self.route_kinds = [config.GTFS_ROUTE_TYPES.get(route_type, 'bus') for route_type in self.route_types]
+
+        #Fußwege als CSR-Struktur: Fußwege ab Haltestelle s liegen in [footpath_start[s], footpath_start[s+1])
+        #Reihenfolge pro Haltestelle wie in footpaths
+        if footpaths is None or footpaths.empty:
+            fp_from = np.array([], dtype=np.int32)
+            self.footpath_to = np.array([], dtype=np.int32)
+            self.footpath_time = np.array([], dtype=np.int32)
+            self.footpath_distance = np.array([], dtype=np.float64)
+        else:
+            fp_from = stop_lookup.get_indexer(footpaths['from_stop_id'])
+            order = np.argsort(fp_from, kind='stable')
+            fp_from = fp_from[order].astype(np.int32)
+            self.footpath_to = stop_lookup.get_indexer(footpaths['to_stop_id'])[order].astype(np.int32)
+            self.footpath_time = footpaths['walking_time'].to_numpy()[order].astype(np.int32)
+            self.footpath_distance = footpaths['distance'].to_numpy(dtype=np.float64)[order]
+        self.footpath_start = np.searchsorted(fp_from, np.arange(len(self.stop_ids) + 1))
+
+        self._update_has_connections()
+
+    def _update_has_connections(self):
+        #Haltestellen mit mindestens einer Abfahrt oder einem Fußweg (früher: Schlüssel von connections_by_stop)
+        self.has_connections = np.diff(self.footpath_start) > 0
+        self.has_connections[self.from_stop] = True
+
+    def __len__(self) -> int:
+        return len(self.dep)
+
+    #Teilmengen und Zusammenführen (für GTFSProcessor.update_service_date und die Fahrten nach Mitternacht)
+    #Alle Methoden liefern ein neues Objekt, das bisherige bleibt unverändert (laufende Anfragen arbeiten weiter darauf)
+
+    def select(self, rows: np.ndarray) -> 'ConnectionArrays':
+        #Verbindungen an den Positionen rows (auch zum Umsortieren); Haltestellen, Fußwege und Texte werden geteilt
+        subset = copy.copy(self)
+        for name in CONNECTION_FIELDS:
+            setattr(subset, name, getattr(self, name)[rows])
+        subset._update_has_connections()
+        return subset
+
+    def concat(self, other: 'ConnectionArrays') -> 'ConnectionArrays':
+        #Hängt die Verbindungen von other an; other muss dieselbe Nummerierung haben (z.B. aus select)
+        combined = copy.copy(self)
+        for name in CONNECTION_FIELDS:
+            setattr(combined, name, np.concatenate([getattr(self, name), getattr(other, name)]))
+        combined._update_has_connections()
+        return combined
+
+    def extend(self, other: 'ConnectionArrays') -> 'ConnectionArrays':
+        #Hängt die Verbindungen eines eigenständig aufgebauten ConnectionArrays an (eigene Nummerierung)
+        #Trips von other werden als neue Trips angehängt, Linien und Haltestellen über ihre ID zugeordnet
+        #Haltestellen, die es in self noch nicht gibt, werden ans Ende gestellt (ohne Fußwege)
+        combined = copy.copy(self)
+        new_stops = [stop_id for stop_id in other.stop_ids if stop_id not in self.stop_index]
+        if new_stops:
+            combined.stop_ids = self.stop_ids + new_stops
+            combined.stop_index = {**self.stop_index,
+                                   **{stop_id: len(self.stop_ids) + i for i, stop_id in enumerate(new_stops)}}
+            combined.footpath_start = np.append(self.footpath_start,
+                                                np.repeat(self.footpath_start[-1], len(new_stops)))
+        stop_map = np.array([combined.stop_index[stop_id] for stop_id in other.stop_ids], dtype=np.int32)
+
+        route_index = {route_id: i for i, route_id in enumerate(self.route_ids)}
+        new_routes = [i for i, route_id in enumerate(other.route_ids) if route_id not in route_index]
+        combined.route_ids = self.route_ids + [other.route_ids[i] for i in new_routes]
+        combined.route_short_names = self.route_short_names + [other.route_short_names[i] for i in new_routes]
+        combined.route_long_names = self.route_long_names + [other.route_long_names[i] for i in new_routes]
+        combined.route_types = self.route_types + [other.route_types[i] for i in new_routes]
+        combined.route_kinds = self.route_kinds + [other.route_kinds[i] for i in new_routes]
+        combined.route_priorities = np.concatenate([self.route_priorities, other.route_priorities[new_routes]])
+        route_index.update({other.route_ids[i]: len(self.route_ids) + k for k, i in enumerate(new_routes)})
+        route_map = np.array([route_index[route_id] for route_id in other.route_ids], dtype=np.int32)
+
+        combined.trip_ids = self.trip_ids + other.trip_ids
+        combined.trip_headsigns = self.trip_headsigns + other.trip_headsigns
+        added = copy.copy(other)
+        added.from_stop = stop_map[other.from_stop]
+        added.to_stop = stop_map[other.to_stop]
+        added.trip = other.trip + np.int32(len(self.trip_ids))
+        added.route = route_map[other.route]
+        return combined.concat(added)
+
+    def patch(self, rows: np.ndarray, dep: np.ndarray, arr: np.ndarray, service_mask: np.ndarray,
+              to_stop: np.ndarray, to_seq: np.ndarray) -> 'ConnectionArrays':
+        #Neue Zeiten, Betriebstage und Ziele (entfallene Halte) für die Verbindungen an den Positionen rows
+        #(Echtzeit, siehe realtime.py); nur tatsächlich geänderte Arrays werden kopiert,
+        #Reihenfolge und Nummerierung bleiben gleich
+        patched = copy.copy(self)
+        for name, values in (('dep', dep), ('arr', arr), ('service_mask', service_mask),
+                             ('to_stop', to_stop), ('to_seq', to_seq)):
+            if np.array_equal(getattr(self, name)[rows], values):
+                continue
+            array = getattr(self, name).copy()
+            array[rows] = values
+            setattr(patched, name, array)
+        return patched
+
+    def renumber(self) -> 'ConnectionArrays':
+        #Trips und Linien wie beim vollständigen Aufbau nach erstem Auftreten nummerieren, unbenutzte entfallen
+        renumbered = copy.copy(self)
+        trip_codes, trips = pd.factorize(self.trip)
+        route_codes, routes = pd.factorize(self.route)
+        renumbered.trip = trip_codes.astype(np.int32)
+        renumbered.trip_ids = [self.trip_ids[t] for t in trips.tolist()]
+        renumbered.trip_headsigns = [self.trip_headsigns[t] for t in trips.tolist()]
+        renumbered.route = route_codes.astype(np.int32)
+        renumbered.route_ids = [self.route_ids[r] for r in routes.tolist()]
+        renumbered.route_short_names = [self.route_short_names[r] for r in routes.tolist()]
+        renumbered.route_long_names = [self.route_long_names[r] for r in routes.tolist()]
+        renumbered.route_types = [self.route_types[r] for r in routes.tolist()]
+        renumbered.route_kinds = [self.route_kinds[r] for r in routes.tolist()]
+        renumbered.route_priorities = self.route_priorities[np.asarray(routes, dtype=np.int64)]
+        return renumbered
+
+    @property
+    def footpath_count(self) -> int:
+        return len(self.footpath_to)
+
+    @property
+    def priority(self) -> np.ndarray:
+        #Verkehrsmittel-Priorität pro Verbindung
+        return self.route_priorities[self.route]
+
+    def mode_mask(self, transport_mode: int) -> np.ndarray:
+        #Verbindungen mit den erlaubten Verkehrsmitteln des Modus (config.TRANSPORT_MODE_TYPES)
+        allowed_types = config.TRANSPORT_MODE_TYPES.get(transport_mode)
+        if allowed_types is None:
+            return np.ones(len(self), dtype=bool)
+        allowed_routes = np.array([kind in allowed_types for kind in self.route_kinds], dtype=bool)
+        return allowed_routes[self.route]
+
+    def day_mask(self, service_day: int) -> np.ndarray:
+        #Verbindungen, die am Betriebstag fahren (siehe GTFSProcessor.service_day)
+        return active_on_day(self.service_mask, service_day)
+
+    def rows_for(self, transport_mode: int, service_day: int) -> np.ndarray:
+        #Positionen aller Verbindungen für Modus und Betriebstag (in Tabellenreihenfolge)
+        return np.nonzero(self.mode_mask(transport_mode) & self.day_mask(service_day))[0]
+
+    def record(self, row: int) -> Dict:
+        #Eine Verbindung im bisherigen Dictionary-Format (nur für Routen, die als Journey ausgegeben werden)
+        route = int(self.route[row])
+        return {
+            'trip_id': self.trip_ids[self.trip[row]],
+            'route_id': self.route_ids[route],
+            'route_short_name': self.route_short_names[route],
+            'route_long_name': self.route_long_names[route],
+            'route_type': self.route_types[route],
+            'from_stop_id': self.stop_ids[self.from_stop[row]],
+            'to_stop_id': self.stop_ids[self.to_stop[row]],
+            'departure_time': timedelta(seconds=int(self.dep[row])),
+            'arrival_time': timedelta(seconds=int(self.arr[row])),
+            'headsign': self.trip_headsigns[self.trip[row]],
+            'priority': int(self.route_priorities[route]),
+            'service_mask': int(self.service_mask[row]),
+            'day_offset': int(self.day_offset[row])
+        }
+
+    def records(self, rows) -> List[Dict]:
+        return [self.record(row) for row in rows]
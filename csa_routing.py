@@ -0,0 +1,338 @@
+import copy
+import numpy as np
+import pandas as pd
+from bisect import bisect_left
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+from gtfs_processing import GTFSProcessor, ServiceWindow
+from connection_arrays import ConnectionArrays
+from config import config
+from metrics import metrics
+from service_calendar import ALL_DAYS_BIT, active_on_day
+
+INFINITY = 10 ** 9 #"Unendlich" in Sekunden (Integer-Vergleiche sind schneller als float('inf'))
+
+#Art des Vorgängers einer Haltestelle (für die Rekonstruktion des Pfades)
+PRED_NONE = 0
+PRED_SOURCE = 1
+PRED_VEHICLE = 2
+PRED_WALK = 3
+
+
+def trip_keys(connections: ConnectionArrays, rows: np.ndarray) -> np.ndarray:
+    #Eindeutiger Schlüssel pro Fahrt im ganzen Graphen: Trip * 2, +1 für die Kopie des Vortags (day_offset = -1)
+    return connections.trip[rows].astype(np.int64) * 2 + (connections.day_offset[rows] < 0)
+
+
+def trip_codes(connections: ConnectionArrays, rows: np.ndarray) -> np.ndarray:
+    #Fortlaufende Nummer pro Fahrt; ein Trip des Vortags (day_offset = -1) ist eine eigene Fahrt
+    return pd.factorize(trip_keys(connections, rows))[0]
+
+
+def source_version(connections: ConnectionArrays, live, window: ServiceWindow) -> Optional[int]:
+    #Stand, aus dem ein Fahrplan mit diesen Verbindungen erstellt wurde (für realtime.LiveTimetable.changed_rows):
+    #Nummer des Echtzeit-Stands, None = Sollfahrplan, -1 = unbekannt (Stand wurde währenddessen ausgetauscht)
+    if live is not None and connections is live.connections:
+        return live.version
+    return None if connections is window.connections else -1
+
+
+def _merge_list(values: List, positions: List[int], items: List[int], new_values: List) -> List:
+    #Kopie von values, in der an den (aufsteigenden) positions ein Eintrag entfällt (item = -1) oder
+    #new_values[item] vor dem Eintrag eingefügt wird; die Abschnitte dazwischen werden als Ganzes übernommen
+    merged = []
+    start = 0
+    for position, item in zip(positions, items):
+        merged += values[start:position]
+        if item < 0:
+            start = position + 1
+        else:
+            merged.append(new_values[item])
+            start = position
+    merged += values[start:]
+    return merged
+
+
+class StopArrays:
+    #Gemeinsame Grundlage der Array-Engines (CSA, RAPTOR):
+    #Haltestellen als fortlaufende Integer und Fußwege als CSR-Struktur, übernommen aus den Verbindungen des Betriebstags
+    #(als Python-Listen, da Einzelzugriffe in den Suchschleifen darauf schneller sind)
+    def __init__(self, connections: ConnectionArrays):
+        self.connections = connections #Sollfahrplan oder Echtzeit-Stand (GTFSProcessor.connections_for)
+        self.stop_ids = connections.stop_ids
+        self.stop_index = connections.stop_index
+
+        #Fußwege von Haltestelle s liegen in [footpath_start[s], footpath_start[s+1])
+        self.footpath_start = connections.footpath_start.tolist()
+        self.footpath_to = connections.footpath_to.tolist()
+        self.footpath_time = connections.footpath_time.tolist()
+        self.footpath_distance = connections.footpath_distance.tolist()
+
+
+class CSATimetable(StopArrays):
+    #Fahrplan als nach Abfahrtszeit sortierte Arrays für den Connection Scan Algorithm
+    #Alle Arrays sind Python-Listen, da Einzelzugriffe auf Listen in der Scan-Schleife
+    #deutlich schneller sind als auf NumPy-Arrays
+    def __init__(self, processor: GTFSProcessor, transport_mode: int, service_day: int = ALL_DAYS_BIT,
+                 window: Optional[ServiceWindow] = None):
+        connections = processor.connections_for(service_day, window)
+        super().__init__(connections)
+        rows = connections.rows_for(transport_mode, service_day)
+        rows = rows[np.argsort(connections.dep[rows], kind='stable')]
+
+        #Position in self.connections (für die Rekonstruktion)
+        self.row = rows.tolist()
+        self.dep = connections.dep[rows].tolist()
+        self.arr = connections.arr[rows].tolist()
+        self.from_stop = connections.from_stop[rows].tolist()
+        self.to_stop = connections.to_stop[rows].tolist()
+        keys = trip_keys(connections, rows)
+        trips = pd.factorize(keys)[0]
+        self.trip = trips.tolist()
+        self.trip_count = int(trips.max()) + 1 if len(trips) else 0
+        self.live_version = None #Echtzeit-Stand von connections (source_version)
+
+        #Für patched: Reihenfolge als Array und Fahrtnummer pro trip_keys-Schlüssel (-1 = Fahrt nicht enthalten)
+        self._rows = rows
+        self._trip_of_key = np.full(len(connections.trip_ids) * 2, -1, dtype=np.int64)
+        self._trip_of_key[keys] = trips
+
+    def patched(self, connections: ConnectionArrays, changed_rows: np.ndarray, transport_mode: int,
+                service_day: int) -> 'CSATimetable':
+        #Fahrplan für einen Echtzeit-Stand, der sich von self.connections nur in den Verbindungen changed_rows
+        #unterscheidet (realtime.LiveTimetable.changed_rows): diese werden entfernt und nach (Abfahrt, Position)
+        #neu einsortiert, alle anderen behalten ihre Reihenfolge -> gleiche Reihenfolge wie bei einem Neuaufbau
+        #Der bisherige Fahrplan bleibt unverändert (laufende Anfragen rechnen darauf weiter)
+        old = self.connections
+        changed = changed_rows[connections.mode_mask(transport_mode)[changed_rows]]
+        removed = changed[active_on_day(old.service_mask[changed], service_day)]
+        added = changed[active_on_day(connections.service_mask[changed], service_day)]
+
+        #Sortierschlüssel: Abfahrt in den oberen 32 Bit, bei Gleichstand die Position in connections (wie argsort stable)
+        low = min(int(old.dep.min()), int(connections.dep.min())) if len(old) else 0
+        keys = ((old.dep[self._rows].astype(np.int64) - low) << 32) | self._rows
+        keep = np.ones(len(keys), dtype=bool)
+        keep[np.searchsorted(keys, ((old.dep[removed].astype(np.int64) - low) << 32) | removed)] = False
+        added_keys = np.sort(((connections.dep[added].astype(np.int64) - low) << 32) | added)
+        added = added_keys & 0xFFFFFFFF
+        insert = np.searchsorted(keys[keep], added_keys) #Anzahl unveränderter Einträge vor jedem neuen Eintrag
+
+        #Fahrten, die bisher nicht enthalten waren (z.B. Ausfall zurückgenommen), bekommen neue Nummern
+        added_trips = trip_keys(connections, added)
+        trip_of_key, trip_count = self._trip_of_key, self.trip_count
+        new_trips = np.unique(added_trips[trip_of_key[added_trips] < 0])
+        if len(new_trips):
+            trip_of_key = trip_of_key.copy()
+            trip_of_key[new_trips] = np.arange(trip_count, trip_count + len(new_trips))
+            trip_count += len(new_trips)
+
+        target = insert + np.arange(len(added))
+        rows = np.empty(len(keys) - len(removed) + len(added), dtype=self._rows.dtype)
+        placed = np.zeros(len(rows), dtype=bool)
+        placed[target] = True
+        rows[target], rows[~placed] = added, self._rows[keep]
+
+        patched = copy.copy(self)
+        patched.connections = connections
+        patched.trip_count = trip_count
+        patched._rows = rows
+        patched._trip_of_key = trip_of_key
+        if (len(removed) + len(added)) * 32 < len(rows):
+            #Wenige Änderungen: Listen abschnittsweise kopieren (die unveränderten Einträge werden geteilt)
+            #Ereignisse nach alter Position: Eintrag entfernen oder neuen Eintrag davor einfügen
+            positions = np.concatenate([np.nonzero(~keep)[0], np.append(np.nonzero(keep)[0], len(keep))[insert]])
+            items = np.concatenate([np.full(len(removed), -1), np.arange(len(added))])
+            order = np.argsort(positions, kind='stable')
+            positions, items = positions[order].tolist(), items[order].tolist()
+            for name, values in (('row', added), ('dep', connections.dep[added]), ('arr', connections.arr[added]),
+                                 ('from_stop', connections.from_stop[added]), ('to_stop', connections.to_stop[added]),
+                                 ('trip', trip_of_key[added_trips])):
+                setattr(patched, name, _merge_list(getattr(self, name), positions, items, values.tolist()))
+        else:
+            #Viele Änderungen: Listen aus der neuen Reihenfolge erstellen (ohne erneutes Sortieren)
+            patched.row = rows.tolist()
+            patched.dep = connections.dep[rows].tolist()
+            patched.arr = connections.arr[rows].tolist()
+            patched.from_stop = connections.from_stop[rows].tolist()
+            patched.to_stop = connections.to_stop[rows].tolist()
+            patched.trip = trip_of_key[trip_keys(connections, rows)].tolist()
+        return patched
+
+
+class ConnectionScanRouter:
+    #Connection Scan Algorithm (CSA)
+    #Idee: Alle Verbindungen des Tages liegen in EINEM nach Abfahrtszeit sortierten Array
+    #Ein einziger Durchlauf von der Startzeit an genügt: Eine Verbindung ist nutzbar, wenn ihr Trip
+    #schon erreicht wurde (sitzen bleiben) oder man rechtzeitig an ihrer Start-Haltestelle ist
+    #Im Gegensatz zu _dijkstra_routing gibt es kein Iterationslimit -> Ergebnis ist exakt
+    #Fußwege werden nach jeder verbesserten Fahrzeugankunft entspannt (ein Fußweg pro Umstieg)
+
+    def __init__(self, gtfs_processor: GTFSProcessor):
+        self.gtfs_processor = gtfs_processor
+        self._timetables = {} #(transport_mode, Betriebstag) -> CSATimetable (wird beim ersten Bedarf erstellt)
+        self._graph_version = gtfs_processor.graph_version #Stand des Graphen, zu dem die Fahrpläne gehören
+
+    def get_timetable(self, transport_mode: int, service_day: int = ALL_DAYS_BIT,
+                      window: Optional[ServiceWindow] = None) -> CSATimetable:
+        #window: Stand des Graphen, aus dem service_day berechnet wurde (Standard: aktueller Stand)
+        window = window or self.gtfs_processor.window
+        if window.version < self._graph_version:
+            #Anfrage hat vor einem Umbau begonnen -> Fahrplan aus ihrem Stand, ohne die neuen zu verwerfen
+            with metrics.timer('timetable_build_seconds', engine='csa'):
+                return CSATimetable(self.gtfs_processor, transport_mode, service_day, window)
+        if window.version != self._graph_version:
+            #Graph wurde neu auf- oder umgebaut (z.B. Tageswechsel) -> Fahrpläne und Tagesnummern passen nicht mehr
+            self._timetables = {}
+            self._graph_version = window.version
+        key = (transport_mode, service_day)
+        live = self.gtfs_processor.live_timetable(service_day, window)
+        timetable = self._timetables.get(key)
+        connections = live.connections if live is not None else window.connections
+        if timetable is None or timetable.connections is not connections:
+            #Neuer Echtzeit-Stand für den Tag (realtime.py) -> nur die geänderten Verbindungen nachführen,
+            #neu erstellt wird nur ohne bekannten Ausgangsstand (z.B. mehr als RealtimeOverlay.CHANGE_LOG Stände)
+            changed_rows = live.changed_rows(timetable.live_version) \
+                if timetable is not None and live is not None else None
+            with metrics.timer('timetable_build_seconds', engine='csa'):
+                if changed_rows is not None:
+                    timetable = timetable.patched(connections, changed_rows, transport_mode, service_day)
+                else:
+                    timetable = CSATimetable(self.gtfs_processor, transport_mode, service_day, window)
+            timetable.live_version = source_version(timetable.connections, live, window)
+            self._timetables[key] = timetable
+        return timetable
+
+    def _scan(self, tt: CSATimetable, sources: Dict[int, int], targets: Dict[int, int]) -> Tuple[List[int], List[int], List[int], List[int]]:
+        #Kern des CSA: berechnet früheste Ankunft pro Haltestelle
+        #sources: Haltestellenindex -> frühester Abfahrtszeitpunkt in Sekunden
+        #targets: Zielhaltestelle -> Fußweg zum eigentlichen Ziel in Sekunden (0 = Ziel ist die Haltestelle)
+        #Der Scan endet, sobald keine Verbindung das beste Ziel (inkl. Fußweg) mehr verbessern kann
+        n_stops = len(tt.stop_ids)
+        arrival = [INFINITY] * n_stops      #Früheste Ankunft pro Haltestelle
+        board = [INFINITY] * n_stops        #Frühester Einstieg pro Haltestelle (Ankunft + Umstiegszeit)
+        vehicle_arrival = [INFINITY] * n_stops #Früheste Ankunft mit einem Fahrzeug (Ausgangspunkt für Fußwege)
+        trip_board = [-1] * tt.trip_count   #Einstiegsverbindung pro Trip (-1 = Trip nicht erreicht)
+        pred_kind = [PRED_NONE] * n_stops
+        pred_a = [0] * n_stops
+        pred_b = [0] * n_stops
+
+        dep, arr, frm, to, trip = tt.dep, tt.arr, tt.from_stop, tt.to_stop, tt.trip
+        fp_start, fp_to, fp_time = tt.footpath_start, tt.footpath_to, tt.footpath_time
+        transfer = config.TRANSFER_TIME_SECONDS
+        best_target = INFINITY
+
+        def relax_footpaths(stop: int, time: int, best: int) -> int:
+            #Fußwege ab stop: pred_a = Ausgangshaltestelle, pred_b = Fußweg-Index
+            for k in range(fp_start[stop], fp_start[stop + 1]):
+                w = fp_to[k]
+                walk_arrival = time + fp_time[k]
+                if walk_arrival < arrival[w]:
+                    arrival[w] = walk_arrival
+                    board[w] = min(board[w], walk_arrival)
+                    pred_kind[w] = PRED_WALK
+                    pred_a[w] = stop
+                    pred_b[w] = k
+                    if w in targets and walk_arrival + targets[w] < best:
+                        best = walk_arrival + targets[w]
+            return best
+
+        for stop, time in sources.items():
+            if time < arrival[stop]:
+                arrival[stop] = time
+                board[stop] = time
+                pred_kind[stop] = PRED_SOURCE
+        for stop, time in sources.items():
+            if stop in targets:
+                best_target = min(best_target, arrival[stop] + targets[stop])
+        for stop in sources:
+            best_target = relax_footpaths(stop, arrival[stop], best_target)
+
+        start = bisect_left(dep, min(sources.values())) if sources else len(dep)
+        for i in range(start, len(dep)):
+            d = dep[i]
+            if d >= best_target:
+                break #Keine spätere Verbindung kann das Ziel noch früher erreichen
+            t = trip[i]
+            if trip_board[t] < 0:
+                if board[frm[i]] > d:
+                    continue #Trip nicht erreichbar
+                trip_board[t] = i
+            a = arr[i]
+            v = to[i]
+            if a < vehicle_arrival[v]:
+                vehicle_arrival[v] = a
+                if a < arrival[v]:
+                    arrival[v] = a
+                    board[v] = min(board[v], a + transfer)
+                    pred_kind[v] = PRED_VEHICLE
+                    pred_a[v] = trip_board[t]
+                    pred_b[v] = i
+                    if v in targets and a + targets[v] < best_target:
+                        best_target = a + targets[v]
+                #Fußwege auch dann, wenn v vorher schon zu Fuß früher erreicht wurde
+                best_target = relax_footpaths(v, a, best_target)
+
+        return arrival, pred_kind, pred_a, pred_b
+
+    def _reconstruct(self, tt: CSATimetable, target: int, arrival: List[int], pred_kind: List[int],
+                     pred_a: List[int], pred_b: List[int]) -> List[Dict]:
+        #Baut den Pfad rückwärts vom Ziel zur Quelle als Liste von Verbindungs-Dictionaries auf
+        connections = tt.connections
+        path = []
+        stop = target
+        while pred_kind[stop] not in (PRED_SOURCE, PRED_NONE):
+            if pred_kind[stop] == PRED_VEHICLE:
+                board_pos, exit_pos = pred_a[stop], pred_b[stop]
+                #Verbindungen eines Trips liegen in tt.connections direkt hintereinander
+                leg = connections.records(range(tt.row[board_pos], tt.row[exit_pos] + 1))
+                path = leg + path
+                stop = tt.from_stop[board_pos]
+            else:
+                from_stop, k = pred_a[stop], pred_b[stop]
+                walk = self.gtfs_processor._walking_connection(
+                    tt.stop_ids[from_stop], tt.stop_ids[stop],
+                    tt.footpath_distance[k], tt.footpath_time[k]
+                )
+                walk['departure_time'] = timedelta(seconds=arrival[stop] - tt.footpath_time[k])
+                walk['arrival_time'] = timedelta(seconds=arrival[stop])
+                path = [walk] + path
+                stop = from_stop
+        return path
+
+    def route(self, start_stop_id: str, end_stop_id: str, departure_time: timedelta,
+              transport_mode: int = 2, service_day: int = ALL_DAYS_BIT) -> Optional[Tuple[List[Dict], timedelta]]:
+        #Früheste Ankunft von einer Start- zu einer Zielhaltestelle
+        #Rückgabe: (Pfad als Verbindungsliste, Ankunftszeit) oder None
+        result = self.route_many({start_stop_id: departure_time}, {end_stop_id: timedelta(0)},
+                                 transport_mode, service_day)
+        return result[:2] if result else None
+
+    def route_many(self, sources: Dict[str, timedelta], targets: Dict[str, timedelta],
+                   transport_mode: int = 2, service_day: int = ALL_DAYS_BIT,
+                   window: Optional[ServiceWindow] = None) -> Optional[Tuple[List[Dict], timedelta, timedelta]]:
+        #Wie route, aber mit mehreren Start- und Zielhaltestellen in EINEM Scan
+        #sources: stop_id -> früheste Abfahrt an dieser Haltestelle (z.B. Startzeit + Fußweg von der Adresse)
+        #targets: stop_id -> Fußweg von der Haltestelle zum eigentlichen Ziel
+        #Rückgabe: (Pfad, Ankunft an der Zielhaltestelle, Ankunft am Ziel inkl. Fußweg) oder None
+        #Bei Gleichstand gewinnt die zuerst angegebene Zielhaltestelle
+        tt = self.get_timetable(transport_mode, service_day, window)
+        source_times = {}
+        for stop_id, time in sources.items():
+            stop = tt.stop_index.get(stop_id)
+            if stop is not None:
+                seconds = int(time.total_seconds())
+                source_times[stop] = min(seconds, source_times.get(stop, INFINITY))
+        egress = {}
+        for stop_id, walk in targets.items():
+            stop = tt.stop_index.get(stop_id)
+            if stop is not None and stop not in egress:
+                egress[stop] = int(walk.total_seconds())
+        if not source_times or not egress:
+            return None
+
+        arrival, pred_kind, pred_a, pred_b = self._scan(tt, source_times, egress)
+        target = min(egress, key=lambda stop: arrival[stop] + egress[stop])
+        if arrival[target] >= INFINITY:
+            return None
+        path = self._reconstruct(tt, target, arrival, pred_kind, pred_a, pred_b)
+        return path, timedelta(seconds=arrival[target]), timedelta(seconds=arrival[target] + egress[target])
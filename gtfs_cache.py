@@ -0,0 +1,222 @@
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, Optional, Tuple, Union
+from config import config
+from metrics import metrics
+
+CACHE_FORMAT_VERSION = 2 #2: stop_times in kompakter Form (siehe stop_times_reader.py)
+
+class GTFSCache:
+    #Binärer Spaltencache für die rohen GTFS-Tabellen
+    #PROBLEM: pd.read_csv muss bei jedem Start Millionen Zeilen Text parsen (v.a. stop_times.txt)
+    #Lösung: Jede Tabelle wird einmalig spaltenweise als .npy-Dateien abgelegt
+    # - Zahlenspalten direkt als NumPy-Array
+    # - Textspalten als Integer-Codes + Liste der eindeutigen Werte (wie eine Kategorie)
+    # - Kategorie-Spalten (pd.Categorical) direkt als Codes + Kategorien
+    #Ein Manifest (manifest.json) merkt sich Größe und Änderungszeit der Quelldatei
+    #Ändert sich die .txt-Datei, passt der Schlüssel nicht mehr und die Tabelle wird neu erzeugt
+
+    def __init__(self, cache_path: Optional[str] = None):
+        self.cache_path = cache_path or config.GTFS_CACHE_PATH
+        self.manifest_path = os.path.join(self.cache_path, 'manifest.json')
+        self.manifest = self._read_manifest()
+
+    def _read_manifest(self) -> Dict:
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == CACHE_FORMAT_VERSION:
+                return manifest
+        except (OSError, ValueError):
+            pass
+        #Kein oder veraltetes Manifest -> leerer Cache
+        return {'version': CACHE_FORMAT_VERSION, 'tables': {}}
+
+    def _write_manifest(self):
+        #Erst in temporäre Datei schreiben, dann atomar ersetzen
+        #So bleibt bei einem Abbruch nie ein halbes Manifest zurück
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    @staticmethod
+    def _source_key(source_path: str) -> Dict:
+        #Schlüssel der Quelldatei: Größe + Änderungszeit (ohne die Datei zu lesen)
+        stat = os.stat(source_path)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def _table_dir(self, name: str) -> str:
+        return os.path.join(self.cache_path, name)
+
+    def is_valid(self, name: str, source_path: str) -> bool:
+        #Prüft ob der Cache für eine Tabelle noch zur Quelldatei passt
+        entry = self.manifest['tables'].get(name)
+        if entry is None:
+            return False
+        if entry.get('source') != self._source_key(source_path):
+            return False
+        table_dir = self._table_dir(name)
+        return all(os.path.exists(os.path.join(table_dir, f"{col['file']}.npy"))
+                   for col in entry['columns'])
+
+    def load(self, name: str) -> pd.DataFrame:
+        #Lädt eine Tabelle aus dem Cache
+        #Zahlenspalten werden per mmap eingelesen -> Kosten hängen nur von der Festplatte ab
+        entry = self.manifest['tables'][name]
+        table_dir = self._table_dir(name)
+        data = {}
+
+        for col in entry['columns']:
+            values = np.load(os.path.join(table_dir, f"{col['file']}.npy"), mmap_mode='r')
+            if col['kind'] == 'str':
+                uniques = np.load(os.path.join(table_dir, f"{col['file']}.uniques.npy"))
+                #NaN wird ans Ende gehängt, Code -1 zeigt damit automatisch auf NaN
+                lookup = np.append(uniques.astype(object), np.nan)
+                data[col['name']] = lookup[np.asarray(values)]
+            elif col['kind'] == 'cat':
+                categories = np.load(os.path.join(table_dir, f"{col['file']}.uniques.npy"))
+                data[col['name']] = pd.Categorical.from_codes(np.asarray(values), categories)
+            else:
+                data[col['name']] = np.array(values)
+
+        return pd.DataFrame(data, columns=[col['name'] for col in entry['columns']])
+
+    def open_columns(self, name: str) -> Dict[str, Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]]:
+        #Wie load, aber ohne DataFrame: Zahlenspalten als mmap-Array, Text-/Kategorie-Spalten als (Codes als mmap, Werte)
+        #So kann eine große Tabelle blockweise gefiltert werden, ohne sie vollständig in den Speicher zu holen
+        entry = self.manifest['tables'][name]
+        table_dir = self._table_dir(name)
+        columns = {}
+        for col in entry['columns']:
+            values = np.load(os.path.join(table_dir, f"{col['file']}.npy"), mmap_mode='r')
+            if col['kind'] == 'num':
+                columns[col['name']] = values
+            else:
+                columns[col['name']] = (values, np.load(os.path.join(table_dir, f"{col['file']}.uniques.npy")))
+        return columns
+
+    def store(self, name: str, source_path: str, df: pd.DataFrame):
+        #Schreibt eine frisch geparste Tabelle in den Cache
+        table_dir = self._table_dir(name)
+        os.makedirs(table_dir, exist_ok=True)
+
+        columns = []
+        for i, col_name in enumerate(df.columns):
+            series = df[col_name]
+            file_stem = f"col{i}"
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                #Kategorien behalten ihren Typ (Zahlen-IDs bleiben Zahlen), Text wird als str gespeichert
+                categories = series.cat.categories.to_numpy()
+                if categories.dtype == object:
+                    categories = categories.astype(str)
+                np.save(os.path.join(table_dir, f"{file_stem}.npy"), series.cat.codes.to_numpy(dtype=np.int32))
+                np.save(os.path.join(table_dir, f"{file_stem}.uniques.npy"), categories)
+                columns.append({'name': col_name, 'file': file_stem, 'kind': 'cat'})
+            elif pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_bool_dtype(series.dtype):
+                np.save(os.path.join(table_dir, f"{file_stem}.npy"), series.to_numpy())
+                columns.append({'name': col_name, 'file': file_stem, 'kind': 'num'})
+            else:
+                #Textspalte: gemischte Typen (z.B. Zahlen und Text in einer Spalte) werden zu str
+                non_null = series.notna()
+                as_text = series.where(~non_null, series[non_null].astype(str))
+                codes, uniques = pd.factorize(as_text, use_na_sentinel=True)
+                np.save(os.path.join(table_dir, f"{file_stem}.npy"), codes.astype(np.int32))
+                np.save(os.path.join(table_dir, f"{file_stem}.uniques.npy"),
+                        np.asarray(uniques, dtype=str))
+                columns.append({'name': col_name, 'file': file_stem, 'kind': 'str'})
+
+        self.manifest['tables'][name] = {
+            'source': self._source_key(source_path),
+            'rows': len(df),
+            'columns': columns
+        }
+        self._write_manifest()
+
+    def store_chunks(self, name: str, source_path: str, chunks: Iterable[pd.DataFrame]):
+        #Wie store, aber blockweise: jeder Block wird sofort an die Spaltendateien angehängt
+        #-> Speicherbedarf = ein Block, unabhängig von der Größe der Tabelle (für stop_times.txt)
+        #Nur Zahlen- und Kategorie-Spalten; die Kategorien aller Blöcke werden zu einer Kategorie vereinigt
+        table_dir = self._table_dir(name)
+        os.makedirs(table_dir, exist_ok=True)
+        names, parts, dtypes, categories = None, {}, {}, {}
+        rows = 0
+        try:
+            for chunk in chunks:
+                if names is None:
+                    names = list(chunk.columns)
+                    parts = {col_name: open(os.path.join(table_dir, f"col{i}.part"), 'wb')
+                             for i, col_name in enumerate(names)}
+                for col_name in names:
+                    series = chunk[col_name]
+                    if isinstance(series.dtype, pd.CategoricalDtype):
+                        #Codes des Blocks auf die Codes der bisher gesehenen Kategorien umrechnen (-1 = fehlt)
+                        chunk_categories = series.cat.categories
+                        known = categories.get(col_name, chunk_categories[:0])
+                        known = known.append(chunk_categories[~chunk_categories.isin(known)])
+                        categories[col_name] = known
+                        lookup = np.append(known.get_indexer(chunk_categories), -1).astype(np.int32)
+                        values = lookup[series.cat.codes.to_numpy()]
+                    else:
+                        values = series.to_numpy()
+                    dtype = dtypes.setdefault(col_name, values.dtype)
+                    parts[col_name].write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+                rows += len(chunk)
+        finally:
+            for part in parts.values():
+                part.close()
+        if names is None:
+            return #Keine Blöcke -> nichts zu speichern
+
+        #Angehängte Rohdaten mit .npy-Kopf versehen (gleiches Format wie np.save, lesbar per mmap)
+        columns = []
+        for i, col_name in enumerate(names):
+            file_stem = f"col{i}"
+            part_path = os.path.join(table_dir, f"{file_stem}.part")
+            with open(os.path.join(table_dir, f"{file_stem}.npy"), 'wb') as out, open(part_path, 'rb') as part:
+                np.lib.format.write_array_header_1_0(out, {
+                    'descr': np.lib.format.dtype_to_descr(dtypes[col_name]),
+                    'fortran_order': False,
+                    'shape': (rows,)
+                })
+                shutil.copyfileobj(part, out)
+            os.remove(part_path)
+            if col_name in categories:
+                values = categories[col_name].to_numpy()
+                if values.dtype == object:
+                    values = values.astype(str)
+                np.save(os.path.join(table_dir, f"{file_stem}.uniques.npy"), values)
+                columns.append({'name': col_name, 'file': file_stem, 'kind': 'cat'})
+            else:
+                columns.append({'name': col_name, 'file': file_stem, 'kind': 'num'})
+
+        self.manifest['tables'][name] = {
+            'source': self._source_key(source_path),
+            'rows': rows,
+            'columns': columns
+        }
+        self._write_manifest()
+
+    def read_table(self, name: str, source_path: str) -> pd.DataFrame:
+        #Warmstart: aus dem Cache laden, sonst CSV parsen und Cache neu aufbauen
+        if self.is_valid(name, source_path):
+            try:
+                df = self.load(name)
+                metrics.inc('gtfs_cache_total', result='hit')
+                return df
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Cache für {name} unbrauchbar ({e}), lese CSV neu ein")
+
+        metrics.inc('gtfs_cache_total', result='miss')
+        df = pd.read_csv(source_path)
+        try:
+            self.store(name, source_path, df)
+            #Aus dem Cache zurücklesen -> Kalt- und Warmstart liefern dieselben Spaltentypen (Text immer als str)
+            return self.load(name)
+        except OSError as e:
+            #Cache ist nur eine Beschleunigung -> Fehler beim Schreiben sind nicht kritisch
+            print(f"Warnung: Cache für {name} konnte nicht geschrieben werden: {e}")
+        return df
@@ -1,17 +1,32 @@
 import pandas as pd
+import numpy as np
 import os
+import time
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 from config import config
+from gtfs_cache import GTFSCache
+from metrics import metrics
+from spatial_index import GridIndex
+from stop_times_reader import StopTimesReader
 
 class GTFSLoader:
     def __init__(self):
         #Speichert alle GTFS-Tabellen als Pandas DataFrame
         self.stops = None #Alle Haltestellen mit Koordinaten und Namen
         self.parent_to_children = None #Mapping
+        self.stop_parent = None #Zeile in stops -> Zeile der Parent-Station (-1 = keine)
+        self.station_of = None #Zeile in stops -> Zeile der Station (Parent-Station oder die Haltestelle selbst)
+        self.station_offsets = None #Station (Zeile) -> Bereich in station_members (CSR, Länge = Anzahl Zeilen + 1)
+        self.station_members = None #Alle Haltestellen (Zeilen) einer Station, die Station selbst zuerst
+        self.stop_index = None #Räumlicher Index über alle Haltestellen-Koordinaten (Position = Zeile in stops)
+        self.stop_rows = {} #stop_id -> Zeile in stops (erster Eintrag)
+        self.route_rows = {} #route_id -> Zeile in routes (erster Eintrag)
+        self._stop_columns = ([], []) #Spaltennamen und Spaltenwerte von stops als Listen
+        self._route_columns = ([], []) #Spaltennamen und Spaltenwerte von routes als Listen
         self.routes = None #Alle Lininen (Bus, Bahn, etc.) mit Typ und Namen
         self.trips = None #Einzelne Fahrten einer Linie zu bestimmten Zeiten
-        self.stop_times = None #Ankunfts und Abfahrtszeiten für jede Haltestelle pro Trip
+        self.stop_times_reader = None #Ankunfts und Abfahrtszeiten für jede Haltestelle pro Trip, gefiltert gelesen (read_stop_times)
         self.calendar = None #Wochentage, an denen Services aktiv sind
         self.calendar_dates = None #Ausnahmen wie Feiertage, Sonderfahrpläne, etc
 
@@ -21,6 +36,10 @@ class GTFSLoader:
         #Nach dem Laden wird dann das parent/child Mapping erstellt
         try:
             print("Lade GTFS-Daten...")
+            load_start = time.perf_counter()
+
+            #Binärer Cache: Warmstart ohne erneutes CSV-Parsen (siehe gtfs_cache.py)
+            cache = GTFSCache() if config.USE_GTFS_CACHE else None
 
             #Erforderliche GTFS-Daten
             required_files = {
@@ -36,24 +55,44 @@ class GTFSLoader:
                 if not os.path.exists(filepath):
                     print(f"Fehler: {filename} nicht gefunden in {config.GTFS_PATH}")
                     return False
-               
-                df = pd.read_csv(filepath)
+
+                if attr == 'stop_times':
+                    #stop_times wird nicht vollständig geladen, sondern erst beim Aufbau des Verbindungsgraphs
+                    #gefiltert auf die aktiven Trips gelesen (siehe stop_times_reader.py)
+                    self.stop_times_reader = StopTimesReader(filepath, self.trips['trip_id'], self.stops['stop_id'], cache)
+                    if cache:
+                        with metrics.timer('gtfs_load_table_seconds', table='stop_times_cache'):
+                            self.stop_times_reader.prepare_cache()
+                    print(f"{filename} gefunden (wird beim Aufbau des Verbindungsgraphs gefiltert gelesen)")
+                    continue
+
+                with metrics.timer('gtfs_load_table_seconds', table=attr):
+                    df = cache.read_table(attr, filepath) if cache else pd.read_csv(filepath)
                 setattr(self, attr, df)
+                metrics.set_gauge('gtfs_rows', len(df), table=attr)
                 print(f"{filename} geladen: {len(df)} Einträge")
 
+            self.build_lookup_tables()
             self.build_parent_to_child_mapping()    
+            self.build_stop_index()
 
             calendar_dates_path = os.path.join(config.GTFS_PATH, 'calendar_dates.txt')
             if os.path.exists(calendar_dates_path):
-                self.calendar_dates = pd.read_csv(calendar_dates_path)
+                self.calendar_dates = (cache.read_table('calendar_dates', calendar_dates_path)
+                                       if cache else pd.read_csv(calendar_dates_path))
                 print(f"calendar_dates.txt geladen: {len(self.calendar_dates)} Einträge")
 
+            metrics.observe('gtfs_load_seconds', time.perf_counter() - load_start)
             return True
         
         except Exception as e:
             print(f"Fehler beim Laden der GTFS-Daten: {e}")
             return False
 
+    def read_stop_times(self, trip_ids) -> pd.DataFrame:
+        #stop_times der angegebenen Trips (Spalten und Typen siehe StopTimesReader)
+        return self.stop_times_reader.read(trip_ids)
+
     def build_parent_to_child_mapping(self):
         #PROBLEM: Große Bahnhöfe haben mehrere "child stops" (Gleise, Bahnsteige)
         #z.B.: "Hauptbahnhof" hat mehrere Gleise
@@ -62,14 +101,89 @@ class GTFSLoader:
         if self.stops is None:
             print("Warnung: stops ist None - Mapping wird nicht erstellt!")
             return
-        self.parent_to_children = {}
-        for _, row in self.stops.iterrows():
-            parent = row.get('parent_station')
-            stop_id = row['stop_id']
-            if pd.isna(parent) or not parent:
-                #Haltestellen ohne parent_station ist sozusagen ihr eigenener parent
-                parent = stop_id
-            self.parent_to_children.setdefault(parent, []).append(stop_id)
+        #Spaltenweise statt iterrows; Ergebnis in beide Richtungen als Integer-Arrays über die Zeilen von stops
+        if not self.stop_rows:
+            self.build_lookup_tables()
+        stop_ids = self.stops['stop_id']
+        parents = self.stops['parent_station'] if 'parent_station' in self.stops.columns \
+            else pd.Series([None] * len(self.stops), index=self.stops.index)
+        #Haltestellen ohne parent_station ist sozusagen ihr eigenener parent
+        has_parent = np.array([not (pd.isna(parent) or not parent) for parent in parents.tolist()], dtype=bool)
+        keys = parents.where(has_parent, stop_ids)
+        self.parent_to_children = stop_ids.groupby(keys.to_numpy(), sort=False).agg(list).to_dict()
+
+        #Kind -> Parent (Doppelte stop_ids zeigen wie bei get_stop auf die erste Zeile)
+        n = len(self.stops)
+        own_rows = np.array([self.stop_rows[stop_id] for stop_id in stop_ids.tolist()], dtype=np.int64)
+        self.stop_parent = np.array(
+            [self.stop_rows.get(parent, -1) if flag else -1 for parent, flag in zip(parents.tolist(), has_parent)],
+            dtype=np.int64
+        )
+        self.station_of = np.where(self.stop_parent >= 0, self.stop_parent, own_rows)
+
+        #Parent -> Kinder als CSR: Mitglieder der Station s liegen in station_members[station_offsets[s]:station_offsets[s+1]]
+        unique_rows = own_rows == np.arange(n)
+        members = np.nonzero(unique_rows)[0]
+        stations = self.station_of[members]
+        order = np.lexsort((members, members != stations, stations))
+        self.station_members = members[order]
+        self.station_offsets = np.searchsorted(stations[order], np.arange(n + 1))
+
+    def get_station_stop_ids(self, stop_id: str) -> List[str]:
+        #Alle Haltestellen (Station + Gleise/Bahnsteige) der Station, zu der stop_id gehört
+        row = self.stop_rows.get(stop_id)
+        if row is None or self.station_of is None:
+            return [stop_id]
+        station = self.station_of[row]
+        members = self.station_members[self.station_offsets[station]:self.station_offsets[station + 1]]
+        stop_ids = self._stop_columns[1][self._stop_columns[0].index('stop_id')]
+        return [stop_ids[member] for member in members.tolist()]
+
+    def get_station_key(self, stop_id: str):
+        #Eindeutiger Schlüssel der Station (Zeile der Parent-Station bzw. der Haltestelle selbst)
+        row = self.stop_rows.get(stop_id)
+        if row is None or self.station_of is None:
+            return stop_id
+        return int(self.station_of[row])
+
+    def build_stop_index(self):
+        #Baut einmalig den räumlichen Index für Umkreis- und Nächste-Haltestellen-Suchen
+        #Indizes im Index entsprechen den Zeilenpositionen in self.stops (für .iloc)
+        if self.stops is None:
+            return
+        lats = pd.to_numeric(self.stops['stop_lat'], errors='coerce').to_numpy()
+        lons = pd.to_numeric(self.stops['stop_lon'], errors='coerce').to_numpy()
+        self.stop_index = GridIndex(lats, lons, cell_size_m=config.MAX_WALKING_DISTANCE_M)
+
+    def build_lookup_tables(self):
+        #Hash-Tabellen für Zugriffe per ID in konstanter Zeit (statt Maskenvergleich über die ganze Tabelle)
+        #Bei doppelten IDs gilt wie bisher (.iloc[0]) der erste Eintrag
+        self.stop_rows, self._stop_columns = self._lookup_table(self.stops, 'stop_id')
+        self.route_rows, self._route_columns = self._lookup_table(self.routes, 'route_id')
+
+    def _lookup_table(self, df: Optional[pd.DataFrame], id_column: str) -> Tuple[Dict, Tuple[List[str], List[List]]]:
+        if df is None:
+            return {}, ([], [])
+        rows = {}
+        for row, key in enumerate(df[id_column].tolist()):
+            rows.setdefault(key, row)
+        columns = list(df.columns)
+        return rows, (columns, [df[col].tolist() for col in columns])
+
+    def _record(self, table_columns: Tuple[List[str], List[List]], row: int) -> Dict:
+        columns, values = table_columns
+        return {col: column_values[row] for col, column_values in zip(columns, values)}
+
+    def get_stop_by_row(self, row: int) -> Dict:
+        #Haltestelle an Zeilenposition row in stops als Dictionary (z.B. für Treffer aus stop_index)
+        return self._record(self._stop_columns, row)
+
+    def get_stop(self, stop_id: str) -> Optional[Dict]:
+        #Holt alle Attribute einer Haltestelle anhand ihrer ID
+        row = self.stop_rows.get(stop_id)
+        if row is None:
+            return None
+        return self._record(self._stop_columns, row)
 
     def get_all_child_stop_ids(self, stop_id: str) -> list[str]:
         # liefert: {stop_id selbst} ∪ direkte Kinder ∪ Geschwister
@@ -80,10 +194,12 @@ class GTFSLoader:
             base = [stop_id] + self.parent_to_children[stop_id]
         else:                                           # stop ist Child
             base = [stop_id]
-            for parent, children in self.parent_to_children.items():
-                if stop_id in children:
-                    base += children + [parent]
-                    break
+            row = self.stop_rows.get(stop_id)
+            parent_row = self.stop_parent[row] if row is not None and self.stop_parent is not None else -1
+            if parent_row >= 0:
+                # Parent über den vorberechneten Index statt Suche in allen Einträgen
+                parent = self.get_stop_by_row(parent_row)['stop_id']
+                base += self.parent_to_children.get(parent, []) + [parent]
         return list(dict.fromkeys(base))                # Duplikate entfernen
     
 
@@ -111,18 +227,18 @@ class GTFSLoader:
         if self.routes is None:
             return None
         
-        route = self.routes[self.routes['route_id'] == route_id]
-        if route.empty:
+        row = self.route_rows.get(route_id)
+        if row is None:
             return None
         
-        return route.iloc[0].to_dict()
+        return self._record(self._route_columns, row)
     
     def get_stop_name(self, stop_id: str) -> str:
         #Holt den Namen einer Haltestelle anhand ihrer ID
         if self.stops is None:
             return stop_id
         
-        stop = self.stops[self.stops['stop_id'] == stop_id]
-        if not stop.empty:
-            return stop.iloc[0]['stop_name']
+        stop = self.get_stop(stop_id)
+        if stop is not None:
+            return stop['stop_name']
         return stop_id
\ No newline at end of file
@@ -1,215 +1,134 @@
 import pandas as pd
-import itertools
+import numpy as np
+import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from gtfs_loader import GTFSLoader
 from config import config
-from tqdm import tqdm
-from address_processor import AddressProcessor
+from spatial_index import GridIndex
+from connection_arrays import ConnectionArrays
+from metrics import metrics
+from service_calendar import ServiceCalendar, ALL_DAYS_BIT, active_on_day
+
+@dataclass
+class ModeIndex:
+    #Abfahrten eines Verkehrsmittel-Modus, nach (Haltestelle, Abfahrtszeit) sortiert (für Binärsuche)
+    #Abfahrten von Haltestelle s liegen in [stop_start[s], stop_start[s+1]), Fußwege stehen in ConnectionArrays
+    stop_start: np.ndarray        #Offsets pro Haltestelle (Länge: Anzahl Haltestellen + 1)
+    departure_seconds: np.ndarray #Abfahrtszeiten in Sekunden (pro Haltestelle sortiert)
+    rows: np.ndarray              #Position der Verbindung in connections
+    service_masks: np.ndarray     #Betriebstage jeder Abfahrt als Bitmaske
+    connections: ConnectionArrays #Verbindungen, auf die rows zeigt (Sollfahrplan oder Echtzeit-Stand, realtime.py)
+
+    def departures_of(self, stop: int) -> int:
+        return int(self.stop_start[stop + 1] - self.stop_start[stop])
+
+
+@dataclass(frozen=True)
+class ServiceWindow:
+    #Ein fertig aufgebauter Graph mit seinem Zeitfenster, wird nur als Ganzes ausgetauscht (GTFSProcessor._activate)
+    #Eine Anfrage liest GTFSProcessor.window einmal: Tagesnummer (service_day) und Betriebstage-Masken der
+    #Verbindungen stammen so immer aus demselben Zeitfenster, auch während eines Tageswechsels
+    calendar: Optional[ServiceCalendar]        #Betriebstage aller Services im Zeitfenster
+    day_route_counts: List[int]                #Anzahl aktiver Linien pro Tag im Zeitfenster
+    connections: Optional[ConnectionArrays]    #Alle Verbindungen und Fußwege als Arrays mit Integer-IDs
+    connections_by_mode: Dict[int, ModeIndex]  #Index pro Verkehrsmittel-Modus: Modus -> ModeIndex
+    uses_all_trips: bool                       #True -> keine Services im Zeitfenster, alle Trips ohne Tagesfilter
+    version: int                               #Wird bei jedem Auf- oder Umbau erhöht (Router verwerfen ihre Fahrpläne)
+
 
 class GTFSProcessor:
     def __init__(self, gtfs_loader: GTFSLoader):
         self.gtfs = gtfs_loader
-        self.connections = [] #Liste aller möglichen Verbindungen
-        self.connections_by_stop = {} # Index: stop_id -> Liste von Verbindungen
+        self.window = ServiceWindow(None, [], None, {}, False, 0) # Aktueller Graph mit Zeitfenster (noch leer)
+        self.realtime = None # Echtzeit-Overlay (realtime.RealtimeOverlay), None = nur Sollfahrplan
+
+    #Lesezugriff auf den aktuellen Stand (für mehrere Werte derselben Anfrage einmal self.window lesen)
+    @property
+    def connections(self) -> Optional[ConnectionArrays]:
+        return self.window.connections
+
+    @property
+    def connections_by_mode(self) -> Dict[int, ModeIndex]:
+        return self.window.connections_by_mode
+
+    @property
+    def service_calendar(self) -> Optional[ServiceCalendar]:
+        return self.window.calendar
+
+    @property
+    def day_route_counts(self) -> List[int]:
+        return self.window.day_route_counts
+
+    @property
+    def uses_all_trips(self) -> bool:
+        return self.window.uses_all_trips
+
+    @property
+    def graph_version(self) -> int:
+        return self.window.version
         
         
     def build_connection_graph(self, target_date: datetime) -> bool:
-        """Erstellt Verbindungsgraph für einen bestimmten Tag"""
-        address_processor = AddressProcessor()
-
+        """Erstellt den Verbindungsgraph für ein Zeitfenster von Betriebstagen ab target_date"""
         try:
             print("Erstelle Verbindungsgraph...")
+            build_start = phase_start = time.perf_counter()
 
-            # Filtere aktive Services für das Zieldatum
-            #1.: Welche Service sind aktiv?
-            active_services = self._get_active_services(target_date)
-            #Prüft calendar.txt -> Fährt die Linie montags? dienstags? mittwochs? ...
-            #Prüft caledar_dates.txt -> Welche Ausnahmen gibt es?
+            #1.: Betriebstage aller Services als Bitmaske (siehe service_calendar.py)
+            #2.: Welche Trips fahren im Zeitfenster? (siehe _window)
+            # Trip = eine konkrete Fahrt einer Linie zu einer bestimmten Zeit
+            # Gefiltert wird erst bei der Anfrage (Bit-Test pro Verbindung), ein Aufbau reicht für alle Tage
+            calendar, active_trips = self._window(target_date)
+            print(f"Trips im Zeitfenster ({calendar.days} Tage ab {calendar.window_start}): {len(active_trips)}")
 
             #Sicherung, wenn keine aktiven Services gefunden wurden
-            if not active_services:
-                print("Keine aktiven Services für das Datum gefunden")
-                return False
-
-            # Filtere Trips nach aktiven Services
-            #2.: Welche Trips fahren heute?
-            # Trip = eine konkrete Fahrt einer Linie zu einer bestimmten Zeit
-            active_trips = self.gtfs.trips[self.gtfs.trips['service_id'].isin(active_services)]
-            print(f"Aktive Trips: {len(active_trips)}") #Zeigt alle aktiven Trips
-
-            #DEBUGGING
-            route_ids = set(active_trips['route_id'].unique())
-            print(f"Aktive Route-IDs: {len(route_ids)}")
-            if len(route_ids) < 50: #Falls zu wenige Routen
-                print("ACHTUNG: Sehr wenige aktive Routen gefunden")
-                print("Versuche alle verfügbaren Services...")
-                active_trips = self.gtfs.trips #Alle trips verwenden
+            uses_all_trips = active_trips.empty
+            if uses_all_trips:
+                print("WARNUUUNG: Keine Services im Zeitfenster gefunden, verwende alle verfügbaren Services")
+                active_trips = self.gtfs.trips.assign(service_mask=np.uint64(0))
                 print(f"Alle verfügbaren trips: {len(active_trips)}")
+            if active_trips.empty:
+                print("Keine Trips gefunden")
+                return False
 
-            # Gruppiere Stop Times einmalig nach trip_id (Performance-Tipp)
-            # 3.: Für jeden Trip werden alle Verbindungen zwischen Haltestellen erstellt
-            stop_times_grouped = self.gtfs.stop_times.groupby('trip_id') #.groupby - Optimierung für schnellen Zugriff
-
-            # --- VERBINDUNGSGRAPH AUFBAUEN ---
-            self.connections = []
-
-            # tqdm-Fortschrittsbalken für Fortschrittsbalken darstellung
-            for _, trip in tqdm(active_trips.iterrows(), total=len(active_trips), desc='Verarbeite Trips'):
-                try:
-                    trip_stops = stop_times_grouped.get_group(trip['trip_id']).sort_values('stop_sequence') #Holt alle Haltestellen dieses Trips in der richtigen Reihenfolge
-                except KeyError:
-                    continue  # Falls ein Trip keine Stop Times hat
-
-                if len(trip_stops) < 2:
-                    continue
-
-                route_info = self.gtfs.get_route_info(trip['route_id']) or {'route_short_name': 'N/A', 'route_type': 3}
-                #if not route_info:
-                #    continue               Wurde hier entfernt weil oben auf Standardwerte gesetzt wurde
-
-                # Erstelle Verbindungen zwischen aufeinanderfolgenden Haltestellen
-                # Verwendet Vektoroperationen mit pandas statt doppelte Schleifen weil dies bei großen Netzen langsam sein kann
-                for i in range(1, len(trip_stops)):
-                    from_stop = trip_stops.iloc[i-1]
-                    to_stop = trip_stops.iloc[i]
-
-                    # Erstelle Verbindungsobjekt mit allen wichtigen Informationen
-                    dep_time = self._parse_gtfs_time(from_stop['departure_time'])
-                    arr_time = self._parse_gtfs_time(to_stop['arrival_time'])
-
-                    if arr_time < dep_time:
-                        arr_time += timedelta(days=1)
-
-                    travel = arr_time - dep_time
-                    if travel <= timedelta(0) or travel > timedelta(hours=3):
-                        continue
-
-
-                    connection = {
-                        'trip_id': trip['trip_id'],
-                        'route_id': trip['route_id'],
-                        'route_short_name': route_info.get('route_short_name', ''),
-                        'route_long_name': route_info.get('route_long_name', ''),
-                        'route_type': route_info.get('route_type', 3),
-                        'from_stop_id': from_stop['stop_id'],
-                        'to_stop_id': to_stop['stop_id'],
-                        'departure_time': dep_time,
-                        'arrival_time': arr_time,
-                        'headsign': trip.get('trip_headsign', ''),
-                        'priority': config.TRANSPORT_PRIORITIES.get(
-                            config.GTFS_ROUTE_TYPES.get(route_info.get('route_type', 3), 'bus'), 3
-                        )
-                    }
-
-                    self.connections.append(connection)
-
-            print(f"\n{len(self.connections)} Verbindungen erstellt") 
-                             
-            # 4.: Index erstellen für schnellen Zugriff
-            # Anstatt, dass alle Verbindungen durchsucht werden -> direkte filterung nach Start und Ziel Haltestelle
-            self.connections_by_stop = {}
-            for conn in self.connections:
-                stop_id = conn['from_stop_id']
-                if stop_id not in self.connections_by_stop:
-                    self.connections_by_stop[stop_id] = []
-                self.connections_by_stop[stop_id].append(conn)
-            
-            print(f"Verbindungsindex für {len(self.connections_by_stop)} Haltestellen erstellt")
-            
-
-            # 5. Füge Fußwege zwischen nahen Haltestellen hinzu
-            max_walk = config.MAX_WALKING_DISTANCE_M
-            # Filtere Stops mit gültigen Koordinaten
-            valid_stops = self.gtfs.stops[
-                (self.gtfs.stops['stop_lat'].notna()) & 
-                (self.gtfs.stops['stop_lon'].notna()) &
-                (self.gtfs.stops['stop_lat'] != 0) &
-                (self.gtfs.stops['stop_lon'] != 0)
-            ][['stop_id', 'stop_lat', 'stop_lon']]
-
-            stops = valid_stops.to_dict('records')
-            print(f"Gefilterte Stops mit gültigen Koordinaten: {len(stops)}")
-
-            walking_connections_added = 0
-
-            if __debug__:
-                print(f"Prüfe {len(stops)} Haltestellen für Fußwege...")
-            for i, stop_a in enumerate(stops):
-                for j, stop_b in enumerate(stops[i+1:], i+1):
-                    try:
-                        dist = address_processor._haversine_distance(
-                            float(stop_a['stop_lat']), float(stop_a['stop_lon']),
-                            float(stop_b['stop_lat']), float(stop_b['stop_lon'])
-                        )
-
-                        #Erweitert Fußwege für KA Halten
-                        is_karlsruhe_a = stop_a['stop_id'].startswith('de:08212:')
-                        is_karlsruhe_b = stop_b['stop_id'].startswith('de:08212:')
-                        max_dist = max_walk * 2 if (is_karlsruhe_a and is_karlsruhe_b) else max_walk
-
-                        if dist <= max_dist:
-                            # Bidirektionale Fußwege hinzufügen
-                            for sa, sb in [(stop_a, stop_b), (stop_b, stop_a)]:
-                                walking_time = max(30, round(dist / config.WALKING_SPEED_MS))  # Mindestens 30 Sekunden
-                                
-                                self.connections_by_stop.setdefault(sa['stop_id'], []).append({
-                                    'from_stop_id': sa['stop_id'],
-                                    'to_stop_id': sb['stop_id'],
-                                    'departure_time': timedelta(0),
-                                    'arrival_time': timedelta(seconds=walking_time),
-                                    'route_id': 'WALK',
-                                    'route_short_name': 'Fußweg',
-                                    'route_long_name': f'Fußweg ({dist:.0f}m)',
-                                    'route_type': 3,
-                                    'headsign': f'zu {sb["stop_id"]}',
-                                    'priority': config.TRANSPORT_PRIORITIES.get('bus', 3)
-                                })
-                                walking_connections_added += 1
-                                
-                    except (ValueError, TypeError) as e:
-                        continue  # Überspringe fehlerhafte Koordinaten
-            print(f"Fußwege hinzugefügt: {walking_connections_added} Verbindungen")
-
-            
-
-            print(f"\n=== VERBINDUNGSSTATISTIK ===")
-            total_connections = sum(len(conns) for conns in self.connections_by_stop.values())
-            walking_connections = sum(1 for conns in self.connections_by_stop.values() 
-                                    for conn in conns if conn['route_id'] == 'WALK')
-            print(f"Gesamte Verbindungen: {total_connections}")
-            print(f"Davon Fußwege: {walking_connections}")
-            print(f"ÖPNV-Verbindungen: {total_connections - walking_connections}")
-
-            # Zeige Beispiel-Haltestellen mit Verbindungen
-            print("\nBeispiel-Haltestellen mit Verbindungen:")
-            for i, (stop_id, conns) in enumerate(self.connections_by_stop.items()):
-                if i < 10 and len(conns) > 0:
-                    walking = sum(1 for c in conns if c['route_id'] == 'WALK')
-                    transit = len(conns) - walking
-                    print(f"  {stop_id}: {len(conns)} total ({transit} ÖPNV, {walking} Fußweg)")
-            print("=== ENDE STATISTIK ===\n")
-            
-            #DEBUGGING: Prüft KA Verbindungen speziell
-            karlsruhe_connections = [c for c in self.connections if c['from_stop_id'].startswith('de:08212:')]
-            print(f"\nKarlsruher Verbindungen (de:08212:): {len(karlsruhe_connections)}")
-
-            if len(karlsruhe_connections) < 1000:
-                print("WARNUNG: Sehr wenige Karlsruher Verbindungen gefunden!")
-                # Zeige Beispiele
-                for i, conn in enumerate(karlsruhe_connections[:5]):
-                    print(f"  {conn['from_stop_id']} -> {conn['to_stop_id']} ({conn['route_short_name']})")
-
-            # Zeige Verbindungen für die gesuchten Haltestellen
-            test_stops = ['de:08212:1115:1:1', 'de:08212:1111:1:1']  # Neureut Kirchfeld, Bärenweg
-            for stop_id in test_stops:
-                if stop_id in self.connections_by_stop:
-                    conns = self.connections_by_stop[stop_id]
-                    print(f"Verbindungen ab {stop_id}: {len(conns)}")
-                    for conn in conns[:3]:
-                        print(f"  -> {conn['to_stop_id']} ({conn['route_short_name']})")
-                else:
-                    print(f"KEINE Verbindungen ab {stop_id}!")
+            #DEBUGGING: Anzahl aktiver Linien pro Tag (für die Prüfung in service_day)
+            day_route_counts = self._count_day_routes(calendar, active_trips)
+            if config.DEBUG_OUTPUT:
+                print(f"Aktive Route-IDs pro Tag: {day_route_counts}")
+            metrics.set_gauge('graph_active_trips', len(active_trips))
+            phase_start = self._phase_done('calendar', phase_start)
+
+            # 3.: Für alle Trips gleichzeitig die Verbindungen zwischen aufeinanderfolgenden Haltestellen erstellen
+            # Spaltenweiser Aufbau statt Schleife über jeden Trip (siehe _build_connection_table)
+            table, trip_info = self._build_connection_table(active_trips)
+            phase_start = self._phase_done('connection_table', phase_start)
+
+            # 4. Fußwege zwischen nahen Haltestellen
+            # Räumliches Gitter statt jede Haltestelle mit jeder anderen zu vergleichen (siehe _build_footpaths)
+            footpaths = self._build_footpaths()
+            phase_start = self._phase_done('footpaths', phase_start)
+
+            # 5.: Verbindungen und Fußwege als kompakte Arrays mit Integer-IDs (siehe connection_arrays.py)
+            # Die Tabelle mit den Text-Spalten wird danach nicht mehr gebraucht
+            connections = ConnectionArrays(table, trip_info, self.gtfs.stops, footpaths)
+            del table, trip_info
+            connections = self._add_overnight_connections(connections)
+            print(f"\n{len(connections)} Verbindungen erstellt")
+            print(f"Fußwege hinzugefügt: {connections.footpath_count} Verbindungen")
+            phase_start = self._phase_done('connection_arrays', phase_start)
+
+            # 6. Index pro Verkehrsmittel-Modus einmalig erstellen (jede Anfrage wählt nur noch den passenden aus)
+            connections_by_mode = self._build_mode_indexes(connections)
+            self._phase_done('mode_indexes', phase_start)
+
+            self._activate(calendar, day_route_counts, connections, connections_by_mode, uses_all_trips)
+            metrics.observe('graph_build_seconds', time.perf_counter() - build_start)
+
+            #DEBUGGING: Statistik und Stichproben nur auf Wunsch (config.DEBUG_OUTPUT), sie gehen alle Verbindungen durch
+            if config.DEBUG_OUTPUT:
+                self._print_statistics()
 
             return True
         
@@ -217,60 +136,352 @@ class GTFSProcessor:
             print(f"Fehler beim Erstellen des Verbindungsgraphs: {e}")
             return False
 
-    def _get_active_services(self, target_date: datetime) -> List[str]:
-        """Ermittelt aktive Services für ein Datum"""
-        active_services = []
-
-        #Sicherung, dass calendar einträge bestehen werden diese weiter gegeben
-        if self.gtfs.calendar is not None:
-            #weekday = target_date.strftime('%A').lower()
-            weekday_en = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
-            weekday_index = target_date.weekday()
-            weekday_col = weekday_en[weekday_index]
-
-            date_str = target_date.strftime('%Y%m%d')
-
-            for _, service in self.gtfs.calendar.iterrows():
-                # Prüfe ob Service an diesem Wochentag aktiv ist
-                if service.get(weekday_col, 0) == 1:
-                    # Prüfe Gültigkeitszeitraum
-                    start_date = str(service['start_date'])
-                    end_date = str(service['end_date'])
-
-                    if start_date <= date_str <= end_date:
-                        active_services.append(service['service_id'])
-            if not active_services:
-                print("WARNUUUNG: Keine Services für heute gefunden, verwende alle verfügbaren Services")
-                active_services = self.gtfs.calendar['service_id'].unique().tolist()
-                print(f"Fallback: {len(active_services)} Services geladen")
-        
-        
-        # Prüfe calendar_dates für Ausnahmen
-        if self.gtfs.calendar_dates is not None:
-            date_str = target_date.strftime('%Y%m%d')
-            if 'date' not in self.gtfs.calendar_dates.columns:
-                raise ValueError("Spalte 'date' fehlt in calendar_dates")
-            exceptions = self.gtfs.calendar_dates[
-                self.gtfs.calendar_dates['date'].astype(str) == date_str
-            ]
-
-            for _, exception in exceptions.iterrows():
-                if exception['exception_type'] == 1:  # Service hinzugefügt
-                    if exception['service_id'] not in active_services:
-                        active_services.append(exception['service_id'])
-                elif exception['exception_type'] == 2:  # Service entfernt
-                    if exception['service_id'] in active_services:
-                        active_services.remove(exception['service_id'])
-
-        return active_services
-
-    # ersetze _parse_gtfs_time komplett
-    def _parse_gtfs_time(self, time_str: str) -> timedelta:
-        """GTFS-Zeit (HH:MM[:SS]) → timedelta, inkl. Stunden ≥24"""
+    def update_service_date(self, target_date: datetime) -> bool:
+        """Verschiebt das Zeitfenster auf target_date und baut nur die geänderten Trips neu auf"""
+        # Für den Tageswechsel eines lang laufenden Dienstes: von einem Tag zum nächsten fahren fast dieselben Trips
+        # - Trips, die weiter fahren, behalten ihre Verbindungen (nur die Betriebstage werden neu berechnet)
+        # - Weggefallene Trips werden entfernt, nur neu hinzugekommene Trips werden aus stop_times gelesen
+        # - Haltestellen, Fußwege und Linieninformationen werden unverändert übernommen
+        # Das Ergebnis ist dasselbe wie bei build_connection_graph(target_date) (gleiche Reihenfolge der Verbindungen)
+        window = self.window
+        if window.connections is None or window.uses_all_trips:
+            return self.build_connection_graph(target_date)
         try:
-            h, m, s = (time_str.split(':') + ['0', '0'])[:3]
-            h, m, s = int(h), int(m), int(s)
-            d, h = divmod(h, 24)          # Tage und Reststunden
-            return timedelta(days=d, hours=h, minutes=m, seconds=s)
-        except Exception:
-            return timedelta(0)
\ No newline at end of file
+            update_start = time.perf_counter()
+            calendar, active_trips = self._window(target_date)
+            if active_trips.empty:
+                return self.build_connection_graph(target_date) # Sicherung mit allen Trips wie beim Aufbau
+            day_route_counts = self._count_day_routes(calendar, active_trips)
+            active_trips = active_trips.drop_duplicates('trip_id')
+            active_ids = pd.Index(active_trips['trip_id'])
+
+            # Betriebstage im neuen Fenster pro bisherigem Trip (0 = fährt nicht mehr)
+            old = window.connections
+            trip_rows = active_ids.get_indexer(old.trip_ids)
+            trip_masks = np.append(active_trips['service_mask'].to_numpy(dtype=np.uint64), np.uint64(0))[trip_rows]
+            day_bits = np.uint64((1 << ALL_DAYS_BIT) - 1)
+            kept = np.nonzero((old.day_offset == 0) & ((trip_masks[old.trip] & day_bits) != 0))[0]
+            connections = old.select(kept)
+            connections.service_mask = trip_masks[connections.trip] | np.uint64(1 << ALL_DAYS_BIT)
+
+            # Neu hinzugekommene Trips wie beim Aufbau, aber nur für diese Trips
+            added_trips = active_trips[~active_ids.isin(old.trip_ids)]
+            if not added_trips.empty:
+                table, trip_info = self._build_connection_table(added_trips)
+                connections = connections.extend(ConnectionArrays(table, trip_info, self.gtfs.stops, None))
+                del table, trip_info
+
+            # Reihenfolge wie beim vollständigen Aufbau: Trips in der Reihenfolge von trips.txt, Kopien nach 24:00 am Ende
+            trip_order = active_ids.get_indexer(connections.trip_ids)
+            connections = connections.select(np.argsort(trip_order[connections.trip], kind='stable')).renumber()
+            connections = self._add_overnight_connections(connections)
+            connections_by_mode = self._build_mode_indexes(connections)
+
+            removed = int(np.count_nonzero((trip_masks & day_bits) == 0))
+            print(f"Zeitfenster ab {calendar.window_start}: {len(added_trips)} Trips neu, {removed} entfallen, "
+                  f"{len(connections)} Verbindungen")
+            self._activate(calendar, day_route_counts, connections, connections_by_mode, False)
+            metrics.observe('graph_update_seconds', time.perf_counter() - update_start)
+            metrics.set_gauge('graph_active_trips', len(active_trips))
+            return True
+
+        except Exception as e:
+            print(f"Fehler beim Aktualisieren des Verbindungsgraphs: {e}")
+            return False
+
+    def _window(self, target_date) -> Tuple[ServiceCalendar, pd.DataFrame]:
+        """Betriebstage im Zeitfenster ab target_date und alle Trips, die darin fahren (Spalte service_mask)"""
+        # Das Fenster beginnt einen Tag vor target_date, damit Fahrten des Vortags nach 24:00 verfügbar sind
+        #Prüft calendar.txt -> Fährt die Linie montags? dienstags? mittwochs? ...
+        #Prüft caledar_dates.txt -> Welche Ausnahmen gibt es?
+        window_start = (target_date.date() if isinstance(target_date, datetime) else target_date) - timedelta(days=1)
+        calendar = ServiceCalendar(
+            self.gtfs.calendar, self.gtfs.calendar_dates, window_start, config.SERVICE_WINDOW_DAYS + 1
+        )
+        trip_masks = calendar.masks_for(self.gtfs.trips['service_id'])
+        return calendar, self.gtfs.trips.assign(service_mask=trip_masks)[trip_masks != 0]
+
+    def _count_day_routes(self, calendar: ServiceCalendar, active_trips: pd.DataFrame) -> List[int]:
+        """Anzahl aktiver Linien pro Tag im Zeitfenster"""
+        route_ids = active_trips['route_id'].to_numpy(dtype=object)
+        masks = active_trips['service_mask'].to_numpy()
+        return [len(pd.unique(route_ids[active_on_day(masks, day)])) for day in range(calendar.days)]
+
+    def _activate(self, calendar: ServiceCalendar, day_route_counts: List[int], connections: ConnectionArrays,
+                  connections_by_mode: Dict[int, ModeIndex], uses_all_trips: bool):
+        """Übernimmt einen fertig aufgebauten Graphen (alle Teile werden mit einer Zuweisung ausgetauscht)"""
+        self.window = ServiceWindow(calendar, day_route_counts, connections, connections_by_mode, uses_all_trips,
+                                    self.window.version + 1)
+        metrics.set_gauge('graph_connections', len(connections))
+        metrics.set_gauge('graph_footpaths', connections.footpath_count)
+        metrics.set_gauge('graph_stops', int(connections.has_connections.sum()))
+        for mode, index in connections_by_mode.items():
+            metrics.set_gauge('graph_departures', len(index.rows), mode=mode)
+
+    def _phase_done(self, phase: str, phase_start: float) -> float:
+        """Meldet die Laufzeit einer Aufbau-Phase (metrics.py) und gibt den Start der nächsten zurück"""
+        now = time.perf_counter()
+        metrics.observe('graph_build_phase_seconds', now - phase_start, phase=phase)
+        return now
+
+    def _print_statistics(self):
+        """Diagnose-Ausgabe nach dem Aufbau (Verbindungen, Route-Typen, Stichproben)"""
+        conns = self.connections
+        print(f"\n=== VERBINDUNGSSTATISTIK ===")
+        print(f"Gesamte Verbindungen: {len(conns) + conns.footpath_count}")
+        print(f"Davon Fußwege: {conns.footpath_count}")
+        print(f"ÖPNV-Verbindungen: {len(conns)}")
+        print(f"Gefundene Route-Typen im System: {sorted(set(conns.route_types))}")
+        for mode, index in self.connections_by_mode.items():
+            print(f"Modus {mode}: {len(index.rows)} Abfahrten")
+
+        # Zeige Beispiel-Haltestellen mit Verbindungen
+        print("\nBeispiel-Haltestellen mit Verbindungen:")
+        departures = np.bincount(conns.from_stop, minlength=len(conns.stop_ids))
+        walks = np.diff(conns.footpath_start)
+        for stop in np.nonzero(conns.has_connections)[0][:10].tolist():
+            total = int(departures[stop] + walks[stop])
+            print(f"  {conns.stop_ids[stop]}: {total} total ({departures[stop]} ÖPNV, {walks[stop]} Fußweg)")
+        print("=== ENDE STATISTIK ===\n")
+        
+        #DEBUGGING: Prüft KA Verbindungen speziell
+        is_karlsruhe = np.array([stop_id.startswith('de:08212:') for stop_id in conns.stop_ids], dtype=bool)
+        karlsruhe_rows = np.nonzero(is_karlsruhe[conns.from_stop])[0]
+        print(f"\nKarlsruher Verbindungen (de:08212:): {len(karlsruhe_rows)}")
+
+        if len(karlsruhe_rows) < 1000:
+            print("WARNUNG: Sehr wenige Karlsruher Verbindungen gefunden!")
+            # Zeige Beispiele
+            for conn in conns.records(karlsruhe_rows[:5].tolist()):
+                print(f"  {conn['from_stop_id']} -> {conn['to_stop_id']} ({conn['route_short_name']})")
+
+        # Zeige Verbindungen für die gesuchten Haltestellen
+        test_stops = ['de:08212:1115:1:1', 'de:08212:1111:1:1']  # Neureut Kirchfeld, Bärenweg
+        for stop_id in test_stops:
+            stop = conns.stop_index.get(stop_id)
+            if stop is not None and conns.has_connections[stop]:
+                rows = np.nonzero(conns.from_stop == stop)[0]
+                print(f"Verbindungen ab {stop_id}: {len(rows) + walks[stop]}")
+                for conn in conns.records(rows[:3].tolist()):
+                    print(f"  -> {conn['to_stop_id']} ({conn['route_short_name']})")
+            else:
+                print(f"KEINE Verbindungen ab {stop_id}!")
+
+    def _build_connection_table(self, active_trips: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Baut alle Verbindungen spaltenweise auf (eine Zeile pro Fahrt zwischen zwei Haltestellen)"""
+        # Rückgabe: (Verbindungen, Trip-Informationen); Spalte trip der Verbindungen = Zeile in den Trip-Informationen
+        # Ablauf:
+        # 1. stop_times der aktiven Trips lesen (Zeiten schon in Sekunden, siehe stop_times_reader.py)
+        # 2. Einmalig nach (Trip, stop_sequence) sortieren
+        # 3. Jede Zeile mit der nächsten Zeile desselben Trips paaren (verschobene Arrays)
+        # 4. Linieninformationen pro Trip anhängen
+        # Doppelte trip_ids (ungültig nach GTFS) zählen nur einmal
+        trips = active_trips.drop_duplicates('trip_id').reset_index(drop=True)
+        trips = trips.assign(_trip_pos=np.arange(len(trips)))
+        if 'trip_headsign' not in trips.columns:
+            trips['trip_headsign'] = ''
+
+        # Spalte trip = Position in trips (= _trip_pos)
+        stop_times = self.gtfs.read_stop_times(trips['trip_id'])
+        # Reihenfolge wie bisher: Trips in der Reihenfolge von active_trips, innerhalb eines Trips nach stop_sequence
+        order = np.lexsort((stop_times['stop_sequence'].to_numpy(), stop_times['trip'].to_numpy()))
+
+        trip_pos = stop_times['trip'].to_numpy()[order]
+        dep_seconds = stop_times['departure_time'].to_numpy(dtype=np.int64)[order]
+        arr_seconds = stop_times['arrival_time'].to_numpy(dtype=np.int64)[order]
+        stop_ids = stop_times['stop_id'].to_numpy()[order]
+        sequences = stop_times['stop_sequence'].to_numpy(dtype=np.int32)[order]
+        del stop_times
+
+        # Paar (i, i+1) nur wenn beide Zeilen zum selben Trip gehören
+        same_trip = trip_pos[:-1] == trip_pos[1:]
+        dep = dep_seconds[:-1][same_trip]
+        arr = arr_seconds[1:][same_trip]
+        arr = np.where(arr < dep, arr + 86400, arr) # Fahrt über Mitternacht
+
+        travel = arr - dep
+        valid = (travel > 0) & (travel <= 3 * 3600) # Keine Zeitreisen und keine Sprünge über 3 Stunden
+
+        table = pd.DataFrame({
+            'trip': trip_pos[:-1][same_trip][valid],
+            'from_stop_id': stop_ids[:-1][same_trip][valid],
+            'to_stop_id': stop_ids[1:][same_trip][valid],
+            'from_stop_sequence': sequences[:-1][same_trip][valid],
+            'to_stop_sequence': sequences[1:][same_trip][valid],
+            'departure_time': dep[valid],
+            'arrival_time': arr[valid]
+        })
+
+        # Linieninformationen pro Trip (wie get_route_info: erster Eintrag pro route_id)
+        # Sie bleiben in einer eigenen Tabelle (eine Zeile pro Trip) statt an jede Verbindung angehängt zu werden
+        routes = self.gtfs.routes.drop_duplicates('route_id', keep='first')
+        route_cols = [c for c in ['route_short_name', 'route_long_name', 'route_type'] if c in routes.columns]
+        trip_info = trips[['trip_id', 'route_id', 'trip_headsign', 'service_mask']].merge(
+            routes[['route_id'] + route_cols], on='route_id', how='left', indicator=True
+        )
+        # Unbekannte Linie -> Standardwerte wie bisher
+        missing = trip_info['_merge'] == 'left_only'
+        for col, default, fallback in [('route_short_name', 'N/A', ''), ('route_long_name', '', ''), ('route_type', 3, 3)]:
+            if col not in trip_info.columns:
+                trip_info[col] = fallback
+            trip_info[col] = trip_info[col].astype(object).where(~missing, default)
+        if 'route_type' in routes.columns and pd.api.types.is_integer_dtype(routes['route_type']):
+            trip_info['route_type'] = trip_info['route_type'].astype(np.int64)
+        trip_info['priority'] = [
+            config.TRANSPORT_PRIORITIES.get(config.GTFS_ROUTE_TYPES.get(route_type, 'bus'), 3)
+            for route_type in trip_info['route_type']
+        ]
+        trip_info = trip_info.rename(columns={'trip_headsign': 'headsign'}).drop(columns='_merge')
+
+        # Bit ALL_DAYS_BIT: Verbindung gehört zum eigentlichen Fahrplan (für Anfragen ohne Tagesfilter)
+        trip_masks = trip_info['service_mask'].to_numpy(dtype=np.uint64) | np.uint64(1 << ALL_DAYS_BIT)
+        table['service_mask'] = trip_masks[table['trip'].to_numpy()]
+        table['day_offset'] = 0
+        return table, trip_info
+
+    def _add_overnight_connections(self, connections: ConnectionArrays) -> ConnectionArrays:
+        """Hängt Fahrten nach 24:00 zusätzlich als Fahrten des Folgetags an (Zeiten - 24h)"""
+        # Ein Trip des Vortags mit Abfahrt 24:30 fährt am Anfragetag um 00:30
+        # -> Kopie mit verschobenen Zeiten und um einen Tag verschobener Maske (Bit d-1 -> Bit d)
+        # Die Kopien stehen am Ende, pro Trip weiterhin in Haltestellenfolge (day_offset = -1)
+        rows = np.nonzero(connections.dep >= 86400)[0]
+        day_bits = np.uint64((1 << ALL_DAYS_BIT) - 1)
+        masks = (connections.service_mask[rows] << np.uint64(1)) & day_bits
+        rows, masks = rows[masks != 0], masks[masks != 0]
+        if len(rows) == 0:
+            return connections
+        overnight = connections.select(rows)
+        overnight.service_mask = masks
+        overnight.dep = overnight.dep - 86400
+        overnight.arr = overnight.arr - 86400
+        overnight.day_offset = np.full(len(rows), -1, dtype=np.int8)
+        if config.DEBUG_OUTPUT:
+            print(f"Fahrten nach Mitternacht (Vortag): {len(overnight)} Verbindungen")
+        return connections.concat(overnight)
+
+    def service_day(self, service_date, window: Optional[ServiceWindow] = None) -> int:
+        """Bit des Betriebstags für eine Anfrage (siehe service_calendar.active_on_day)"""
+        # Liegt der Tag außerhalb des Zeitfensters oder fahren dort kaum Linien, wird wie bisher
+        # ohne Tagesfilter geroutet (alle Trips, keine Kopien nach Mitternacht)
+        # window: Stand, aus dem die Anfrage auch ihre Verbindungen nimmt (Standard: aktueller Stand)
+        window = window or self.window
+        day = window.calendar.day_index(service_date) if window.calendar else None
+        if day is None:
+            metrics.inc('service_day_fallback_total', reason='outside_window')
+            if config.DEBUG_OUTPUT:
+                print(f"WARNUNG: {service_date} liegt außerhalb des Fahrplan-Zeitfensters, verwende alle Services")
+            return ALL_DAYS_BIT
+        # Mindestzahl relativ zum Feed (Anteil aller Linien in routes.txt), damit kleine Netze nicht immer ohne Filter laufen
+        active_routes = window.day_route_counts[day]
+        route_count = len(self.gtfs.routes) if self.gtfs.routes is not None else 0
+        if active_routes == 0 or active_routes < config.MIN_ACTIVE_ROUTE_SHARE * route_count:
+            metrics.inc('service_day_fallback_total', reason='few_routes')
+            if config.DEBUG_OUTPUT:
+                print(f"ACHTUNG: Am {service_date} fahren nur {active_routes} von {route_count} Linien, "
+                      f"verwende alle Services")
+            return ALL_DAYS_BIT
+        return day
+
+    def _build_mode_indexes(self, conns: ConnectionArrays) -> Dict[int, ModeIndex]:
+        """Erstellt für jeden Verkehrsmittel-Modus einen eigenen Haltestellen-Index (ModeIndex)"""
+        # Pro Haltestelle: Abfahrten nach Zeit sortiert
+        # -> Die Suche springt per Binärsuche zur ersten nutzbaren Abfahrt statt alle Abfahrten des Tages zu prüfen
+        connections_by_mode = {}
+        # Einmal nach (Haltestelle, Abfahrt) sortieren, stabil -> gleiche Abfahrten bleiben in Originalreihenfolge
+        # Beide Schlüssel in einer Zahl (Haltestelle in den oberen 32 Bit): ein Sortierlauf statt zwei wie bei lexsort
+        dep_offset = conns.dep.astype(np.int64) - (int(conns.dep.min()) if len(conns) else 0)
+        order = np.argsort((conns.from_stop.astype(np.int64) << 32) | dep_offset, kind='stable')
+        stops = np.arange(len(conns.stop_ids) + 1)
+
+        for mode in config.TRANSPORT_MODE_TYPES:
+            rows = order[conns.mode_mask(mode)[order]]
+            connections_by_mode[mode] = ModeIndex(
+                stop_start=np.searchsorted(conns.from_stop[rows], stops),
+                departure_seconds=conns.dep[rows],
+                rows=rows.astype(np.int32),
+                service_masks=conns.service_mask[rows],
+                connections=conns
+            )
+        return connections_by_mode
+
+    def live_timetable(self, service_day: int, window: Optional[ServiceWindow] = None):
+        """Echtzeit-Stand für den Betriebstag, falls das Overlay zum Graphen von window gehört (sonst None)"""
+        # Nach einem Umbau (z.B. Tageswechsel) gilt bis zur Neuberechnung im Overlay wieder der Sollfahrplan
+        window = window or self.window
+        live = self.realtime.live if self.realtime is not None else None
+        if live is not None and live.service_day == service_day and live.base is window.connections:
+            return live
+        return None
+
+    def connections_for(self, service_day: int, window: Optional[ServiceWindow] = None) -> ConnectionArrays:
+        """Verbindungen für Anfragen an einem Betriebstag (mit Verspätungen, wenn ein Echtzeit-Overlay aktiv ist)"""
+        window = window or self.window
+        live = self.live_timetable(service_day, window)
+        return live.connections if live is not None else window.connections
+
+    def get_connection_index(self, transport_mode: int, service_day: int = ALL_DAYS_BIT,
+                             window: Optional[ServiceWindow] = None) -> ModeIndex:
+        """Liefert den vorab erstellten Index für einen Modus (für den Betriebstag ggf. mit Echtzeit)"""
+        window = window or self.window
+        connections_by_mode = window.connections_by_mode
+        live = self.live_timetable(service_day, window)
+        if live is not None:
+            connections_by_mode = live.connections_by_mode
+        if transport_mode not in connections_by_mode:
+            transport_mode = max(connections_by_mode) # Unbekannter Modus -> Bus und Bahn
+        return connections_by_mode[transport_mode]
+
+    def has_connections(self, stop_id: str) -> bool:
+        """Hat die Haltestelle Abfahrten oder Fußwege?"""
+        connections = self.connections
+        stop = connections.stop_index.get(stop_id) if connections is not None else None
+        return stop is not None and bool(connections.has_connections[stop])
+
+    def _build_footpaths(self) -> pd.DataFrame:
+        """Findet alle Haltestellenpaare in Gehweite über ein räumliches Gitter"""
+        stops = self.gtfs.stops
+        lats = pd.to_numeric(stops['stop_lat'], errors='coerce')
+        lons = pd.to_numeric(stops['stop_lon'], errors='coerce')
+        # Filtere Stops mit gültigen Koordinaten
+        valid = lats.notna() & lons.notna() & (lats != 0) & (lons != 0)
+        stop_ids = stops.loc[valid, 'stop_id'].to_numpy()
+        if config.DEBUG_OUTPUT:
+            print(f"Gefilterte Stops mit gültigen Koordinaten: {len(stop_ids)}")
+
+        max_walk = config.MAX_WALKING_DISTANCE_M
+        # Größter möglicher Radius: doppelte Gehweite zwischen zwei KA Halten
+        grid = GridIndex(lats[valid].to_numpy(), lons[valid].to_numpy(), cell_size_m=max_walk * 2)
+        if config.DEBUG_OUTPUT:
+            print(f"Prüfe {len(stop_ids)} Haltestellen in {len(grid.cell_keys)} Gitterzellen für Fußwege...")
+        i, j, dist = grid.pairs_within(max_walk * 2)
+
+        #Erweitert Fußwege für KA Halten
+        is_karlsruhe = pd.Series(stop_ids).astype(str).str.startswith('de:08212:').to_numpy()
+        max_dist = np.where(is_karlsruhe[i] & is_karlsruhe[j], max_walk * 2, max_walk)
+        keep = dist <= max_dist
+        i, j, dist = i[keep], j[keep], dist[keep]
+        walking_time = np.maximum(30, np.round(dist / config.WALKING_SPEED_MS)).astype(np.int64) # Mindestens 30 Sekunden
+
+        # Bidirektionale Fußwege: (a -> b) direkt gefolgt von (b -> a)
+        return pd.DataFrame({
+            'from_stop_id': np.column_stack([stop_ids[i], stop_ids[j]]).ravel(),
+            'to_stop_id': np.column_stack([stop_ids[j], stop_ids[i]]).ravel(),
+            'distance': np.repeat(dist, 2),
+            'walking_time': np.repeat(walking_time, 2)
+        })
+
+    def _walking_connection(self, from_stop_id: str, to_stop_id: str, dist: float, walking_time: int) -> Dict:
+        """Fußweg zwischen zwei Haltestellen im Format einer Verbindung"""
+        # departure_time = 0, arrival_time = Gehzeit -> wird beim Routing auf die aktuelle Zeit verschoben
+        return {
+            'from_stop_id': from_stop_id,
+            'to_stop_id': to_stop_id,
+            'departure_time': timedelta(0),
+            'arrival_time': timedelta(seconds=walking_time),
+            'route_id': 'WALK',
+            'route_short_name': 'Fußweg',
+            'route_long_name': f'Fußweg ({dist:.0f}m)',
+            'route_type': 3,
+            'headsign': f'zu {to_stop_id}',
+            'priority': config.TRANSPORT_PRIORITIES.get('bus', 3)
+        }
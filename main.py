@@ -6,6 +6,7 @@ from gtfs_loader import GTFSLoader
 from gtfs_processing import GTFSProcessor
 from address_processor import AddressProcessor
 from routing import PublicTransportRouter, Journey, RouteSegment
+from metrics import metrics
 from config import config
 
 class KarlsruheTransitRouter:
@@ -282,6 +283,8 @@ def main():
     try:
         router = KarlsruheTransitRouter()      
         router.run()
+        if metrics.enabled:
+            print(metrics.snapshot())
     except Exception as e:
         print(f"Kritischer Fehler: {e}")
         sys.exit(1)
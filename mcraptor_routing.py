@@ -0,0 +1,241 @@
+from bisect import bisect_left
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+from config import config
+from gtfs_processing import ServiceWindow
+from raptor_routing import RaptorRouter, RaptorTimetable
+from service_calendar import ALL_DAYS_BIT
+
+#Felder eines Labels (Tupel statt Objekt, damit die Bags schnell bleiben)
+#(Ankunft, Fußweg in Metern, Priorität, Runde = Anzahl Fahrten, frühester Einstieg, Vorgänger-Label, Schritt, Haltestelle)
+#Der früheste Einstieg ist bei Ankunft mit einem Fahrzeug um die Umstiegszeit später als die Ankunft
+ARRIVAL, WALK, PRIORITY, ROUND, READY, PARENT, STEP, STOP = range(8)
+
+#Art des Schritts, über den ein Label entstanden ist
+STEP_RIDE = 0 #(STEP_RIDE, Muster, Trip, Einstiegsposition, Ausstiegsposition)
+STEP_WALK = 1 #(STEP_WALK, Fußweg-Index)
+
+
+def _dominates(a: Tuple, b: Tuple) -> bool:
+    #a ist in keinem Kriterium schlechter als b
+    return a[ARRIVAL] <= b[ARRIVAL] and a[WALK] <= b[WALK] and a[PRIORITY] <= b[PRIORITY] and a[ROUND] <= b[ROUND]
+
+
+def _can_walk(label: Tuple) -> bool:
+    #Fußwege schließen nur an Start oder Fahrzeugankunft an (ein Fußweg pro Runde)
+    return label[STEP] is None or label[STEP][0] == STEP_RIDE
+
+
+def _dominates_at_stop(a: Tuple, b: Tuple) -> bool:
+    #Innerhalb einer Haltestelle zählt zusätzlich, wann man weiterfahren kann und ob noch ein Fußweg möglich ist
+    return _dominates(a, b) and a[READY] <= b[READY] and (_can_walk(a) or not _can_walk(b))
+
+
+class McRaptorRouter:
+    #McRAPTOR: RAPTOR mit mehreren Kriterien (Ankunftszeit, Anzahl Fahrten, Fußweg in Metern,
+    #optional Verkehrsmittel-Priorität)
+    #PROBLEM: Dijkstra fasst alles zu einer Priorität (Reisezeit + 1 Minute pro Umstieg) zusammen,
+    #RAPTOR optimiert nur Ankunft und Umstiege -> eine Route mit kurzem Fußweg oder nur mit Bahnen
+    #wird nie angeboten, wenn sie etwas später ankommt
+    #Lösung: Pro Haltestelle ein "Bag" mit allen Labels, die von keinem anderen Label dominiert werden.
+    #Dominierte Labels werden sofort verworfen, ebenso Labels, die schon von einem Ergebnis am Ziel
+    #dominiert werden -> die Mengen bleiben klein
+    #Die Fahrpläne (Linienmuster) werden mit dem RaptorRouter geteilt
+
+    def __init__(self, raptor: RaptorRouter):
+        self.raptor = raptor
+        self.gtfs_processor = raptor.gtfs_processor
+
+    def _run(self, tt: RaptorTimetable, sources: Dict[int, Tuple[int, int]], targets: Dict[int, Tuple[int, int]],
+             max_rounds: int, use_priority: bool) -> Tuple[List[Tuple], List[List[int]]]:
+        #sources: Haltestelle -> (früheste Abfahrt, Fußweg vom Start in Metern)
+        #targets: Haltestelle -> (Gehzeit zum Ziel in Sekunden, Fußweg zum Ziel in Metern)
+        #Rückgabe: alle Labels und die Bags (Label-Indizes) pro Haltestelle
+        transfer = config.TRANSFER_TIME_SECONDS
+        fp_start, fp_to, fp_time = tt.footpath_start, tt.footpath_to, tt.footpath_time
+        fp_distance = tt.footpath_distance
+
+        labels = []
+        bags = [[] for _ in tt.stop_ids]
+        target_results = [] #Bereits erreichte Zielwerte (inkl. Fußweg zum Ziel) für das Pruning
+
+        def dominated_by_target(arrival: int, walk_m: int, priority: int, round_no: int) -> bool:
+            for result_arrival, result_walk, result_priority, result_round in target_results:
+                if result_arrival <= arrival and result_walk <= walk_m and result_priority <= priority \
+                        and result_round <= round_no:
+                    return True
+            return False
+
+        def add_label(stop: int, label: Tuple, new_labels: Dict[int, List[int]]) -> bool:
+            #Label in den Bag der Haltestelle übernehmen, falls es von nichts dominiert wird
+            #(Pruning am Ziel übernimmt der Aufrufer)
+            bag = bags[stop]
+            arrival, walk_m, priority, round_no, ready = label[:STEP - 1]
+            can_walk = _can_walk(label)
+            for other in bag:
+                o = labels[other]
+                if o[ARRIVAL] <= arrival and o[WALK] <= walk_m and o[PRIORITY] <= priority and o[ROUND] <= round_no \
+                        and o[READY] <= ready and (_can_walk(o) or not can_walk):
+                    return False
+            labels.append(label)
+            index = len(labels) - 1
+            bag[:] = [other for other in bag if not _dominates_at_stop(label, labels[other])]
+            bag.append(index)
+            new_labels.setdefault(stop, []).append(index)
+            if stop in targets:
+                walk_time, walk_m = targets[stop]
+                result = (label[ARRIVAL] + walk_time, label[WALK] + walk_m, label[PRIORITY], label[ROUND])
+                target_results[:] = [other for other in target_results if not _dominates(result, other)]
+                target_results.append(result)
+            return True
+
+        def relax_footpaths(round_no: int, starts: Dict[int, List[int]], new_labels: Dict[int, List[int]]):
+            #Ein Fußweg pro Runde, jeweils von den neuen Labels aus (nicht von Fußweg-Labels)
+            for stop, indices in list(starts.items()):
+                alive = set(bags[stop])
+                for index in indices:
+                    if index not in alive:
+                        continue
+                    label = labels[index]
+                    for k in range(fp_start[stop], fp_start[stop + 1]):
+                        walk_arrival = label[ARRIVAL] + fp_time[k]
+                        walk_m = label[WALK] + int(round(fp_distance[k]))
+                        if not dominated_by_target(walk_arrival, walk_m, label[PRIORITY], round_no):
+                            add_label(fp_to[k], (walk_arrival, walk_m, label[PRIORITY], round_no, walk_arrival,
+                                                 index, (STEP_WALK, k), fp_to[k]), new_labels)
+
+        #Runde 0: Start-Haltestellen und Fußwege vom Start
+        marked = {}
+        for stop, (time, walk_m) in sources.items():
+            add_label(stop, (time, walk_m, 0, 0, time, -1, None, stop), marked)
+        relax_footpaths(0, dict(marked), marked)
+
+        for round_no in range(1, max_rounds + 1):
+            if not marked:
+                break
+            queue = {}
+            for stop in marked:
+                for p, pos in tt.stop_patterns[stop]:
+                    if pos < queue.get(p, len(tt.pattern_stops[p])):
+                        queue[p] = pos
+            #Neue Labels der Vorrunde, die noch nicht dominiert wurden
+            boarding = {}
+            for stop, indices in marked.items():
+                alive = set(bags[stop])
+                boarding[stop] = [(labels[index][READY], labels[index][WALK], labels[index][PRIORITY], index)
+                                  for index in indices if index in alive]
+            marked = {}
+
+            for p, start_pos in queue.items():
+                stops = tt.pattern_stops[p]
+                dep_by_pos = tt.pattern_dep[p]
+                arr_by_trip = tt.pattern_arr[p]
+                priority = tt.pattern_priority[p] if use_priority else 0
+                last_pos = len(stops) - 1
+                route_bag = [] #(Trip, Fußweg, Priorität, Einstiegs-Label, Einstiegsposition)
+                for pos in range(start_pos, len(stops)):
+                    stop = stops[pos]
+                    #Aussteigen: jedes Label im Fahrzeug erzeugt eine Ankunft
+                    #Ist eine Ankunft schon am Ziel dominiert, gilt das auch für alle weiteren Haltestellen
+                    #des Trips -> das Label verlässt den Route-Bag
+                    remaining = []
+                    for entry in route_bag:
+                        trip, walk_m, label_priority, parent, board_pos = entry
+                        a = arr_by_trip[trip][pos]
+                        if dominated_by_target(a, walk_m, label_priority, round_no):
+                            continue
+                        remaining.append(entry)
+                        add_label(stop, (a, walk_m, label_priority, round_no, a + transfer, parent,
+                                         (STEP_RIDE, p, trip, board_pos, pos), stop), marked)
+                    route_bag = remaining
+                    #Einsteigen: neue Labels der Vorrunde nehmen den frühesten erreichbaren Trip
+                    if pos == last_pos or stop not in boarding:
+                        continue
+                    departures = dep_by_pos[pos]
+                    for ready, walk_m, label_priority, index in boarding[stop]:
+                        trip = bisect_left(departures, ready)
+                        if trip == len(departures):
+                            continue
+                        label_priority = max(label_priority, priority)
+                        for other in route_bag:
+                            if other[0] <= trip and other[1] <= walk_m and other[2] <= label_priority:
+                                break
+                        else:
+                            route_bag = [other for other in route_bag if not (
+                                trip <= other[0] and walk_m <= other[1] and label_priority <= other[2])]
+                            route_bag.append((trip, walk_m, label_priority, index, pos))
+
+            relax_footpaths(round_no, {stop: [index for index in indices if _can_walk(labels[index])]
+                                       for stop, indices in marked.items()}, marked)
+
+        return labels, bags
+
+    def _reconstruct(self, tt: RaptorTimetable, labels: List[Tuple], index: int) -> List[Dict]:
+        #Pfad über die Vorgänger-Labels rückwärts aufbauen
+        connections = tt.connections
+        path = []
+        while index >= 0:
+            label = labels[index]
+            step = label[STEP]
+            if step is None:
+                break
+            if step[0] == STEP_RIDE:
+                _, p, trip, board_pos, alight_pos = step
+                path = connections.records(tt.pattern_rows[p][trip][board_pos:alight_pos]) + path
+            else:
+                k = step[1]
+                walk = self.gtfs_processor._walking_connection(
+                    tt.stop_ids[labels[label[PARENT]][STOP]], tt.stop_ids[label[STOP]],
+                    tt.footpath_distance[k], tt.footpath_time[k]
+                )
+                walk['departure_time'] = timedelta(seconds=label[ARRIVAL] - tt.footpath_time[k])
+                walk['arrival_time'] = timedelta(seconds=label[ARRIVAL])
+                path = [walk] + path
+            index = label[PARENT]
+        return path
+
+    def route_many(self, sources: Dict[str, Tuple[timedelta, float]], targets: Dict[str, Tuple[timedelta, float]],
+                   transport_mode: int = 2, max_transfers: Optional[int] = None, use_priority: bool = False,
+                   service_day: int = ALL_DAYS_BIT,
+                   window: Optional[ServiceWindow] = None) -> List[Tuple[List[Dict], timedelta, int, int, int]]:
+        #Pareto-Menge über Ankunft, Anzahl Fahrten, Fußweg (und optional Verkehrsmittel-Priorität)
+        #sources: stop_id -> (früheste Abfahrt, Fußweg vom Start in Metern)
+        #targets: stop_id -> (Gehzeit zum Ziel, Fußweg zum Ziel in Metern)
+        #use_priority: Routen nur mit Bahnen (config.TRANSPORT_PRIORITIES) zählen als eigenes Kriterium
+        #Rückgabe: Liste von (Pfad, Ankunft am Ziel inkl. Fußweg, Anzahl Fahrten, Fußweg gesamt in Metern,
+        #schlechteste Priorität der genutzten Linien bzw. 0), früheste Ankunft zuerst
+        if max_transfers is None:
+            max_transfers = config.MAX_TRANSFERS
+        tt = self.raptor.get_timetable(transport_mode, service_day, window)
+        source_labels = {}
+        for stop_id, (time, walk_m) in sources.items():
+            stop = tt.stop_index.get(stop_id)
+            value = (int(time.total_seconds()), int(round(walk_m)))
+            if stop is not None and (stop not in source_labels or value < source_labels[stop]):
+                source_labels[stop] = value
+        egress = {}
+        for stop_id, (walk, walk_m) in targets.items():
+            stop = tt.stop_index.get(stop_id)
+            if stop is not None and stop not in egress:
+                egress[stop] = (int(walk.total_seconds()), int(round(walk_m)))
+        if not source_labels or not egress:
+            return []
+
+        labels, bags = self._run(tt, source_labels, egress, max_transfers + 1, use_priority)
+
+        #Ergebnisse aller Zielhaltestellen zusammenführen und erneut auf Dominanz prüfen
+        candidates = []
+        for stop, (walk_time, walk_m) in egress.items():
+            for index in bags[stop]:
+                label = labels[index]
+                candidates.append(((label[ARRIVAL] + walk_time, label[WALK] + walk_m,
+                                    label[PRIORITY], label[ROUND]), index))
+        results = []
+        for values, index in sorted(candidates):
+            if any(_dominates(other, values) for other, _ in results):
+                continue
+            results.append((values, index))
+        return [
+            (self._reconstruct(tt, labels, index), timedelta(seconds=arrival), trips, walk_m, priority)
+            for (arrival, walk_m, priority, trips), index in results
+        ]
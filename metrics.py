@@ -0,0 +1,179 @@
+import math
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+from config import config
+
+#Prozessweite Messwerte: Zähler, aktuelle Werte (Gauges) und Laufzeit-Histogramme
+#PROBLEM: Die einzige Diagnose waren print-Ausgaben, die auch bei jeder Anfrage Zeit kosten
+#Lösung: Messpunkte im Code melden an das globale "metrics"-Objekt; ausgeschaltet (config.METRICS_ENABLED)
+#kehrt jeder Aufruf nach einer einzigen Abfrage sofort zurück, timer() liefert dann einen leeren Kontext
+#Labels (z.B. engine="raptor") werden als Schlüsselwortargumente übergeben
+#
+#Verwendung:
+#   with metrics.timer('routing_query_seconds', engine='raptor'):
+#       ...
+#   metrics.inc('routing_queries_total', engine='raptor')
+#   print(metrics.snapshot())
+
+#Obergrenzen der Histogramm-Klassen in Sekunden (von 1 ms bis 1 min, danach +Inf)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]] #(Name, sortierte Labels)
+
+
+class Histogram:
+    #Verteilung von Messwerten in festen Klassen (wie Prometheus: kumulative Ausgabe im Snapshot)
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) #Letzte Klasse = größer als alle Grenzen
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        #Schätzung über die Klassengrenzen (Obergrenze der Klasse, in der das Quantil liegt)
+        if self.count == 0:
+            return math.nan
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+
+class _Timer:
+    #Misst die Laufzeit eines with-Blocks und trägt sie ins Histogramm ein
+    __slots__ = ('registry', 'key', 'start')
+
+    def __init__(self, registry: 'MetricsRegistry', key: MetricKey):
+        self.registry = registry
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry._observe(self.key, time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    #Ersatz für _Timer bei ausgeschalteten Metriken (ein gemeinsames Objekt, keine Zeitmessung)
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def _key(name: str, labels: Dict[str, object]) -> MetricKey:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+class MetricsRegistry:
+    #Thread-sicher (der Routing-Dienst meldet aus mehreren Threads); das Lock wird nur bei
+    #eingeschalteten Metriken genommen
+
+    def __init__(self, enabled: Optional[bool] = None):
+        self.enabled = config.METRICS_ENABLED if enabled is None else enabled
+        self._lock = threading.Lock()
+        self.counters: Dict[MetricKey, float] = {}
+        self.gauges: Dict[MetricKey, float] = {}
+        self.histograms: Dict[MetricKey, Histogram] = {}
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        #Zähler erhöhen (nur steigend, z.B. Anzahl Anfragen)
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name: str, value: float, **labels):
+        #Aktuellen Wert setzen (z.B. Anzahl Verbindungen nach dem Aufbau)
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            self.gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        #Messwert (in Sekunden) ins Histogramm eintragen
+        if not self.enabled:
+            return
+        self._observe(_key(name, labels), value)
+
+    def _observe(self, key: MetricKey, value: float):
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def timer(self, name: str, **labels):
+        #Kontextmanager: Laufzeit des with-Blocks als Histogramm-Messwert
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, _key(name, labels))
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def snapshot(self) -> str:
+        #Alle Werte als Text (Prometheus-Textformat, zusätzlich geschätzte Quantile als Kommentar)
+        with self._lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = {key: (list(h.counts), h.count, h.sum, h.quantile(0.5), h.quantile(0.95))
+                          for key, h in self.histograms.items()}
+        lines: List[str] = []
+        for kind, values in (('counter', counters), ('gauge', gauges)):
+            for name in sorted({key[0] for key in values}):
+                lines.append(f"# TYPE {name} {kind}")
+                for key in sorted(k for k in values if k[0] == name):
+                    lines.append(f"{name}{_format_labels(key[1])} {_format_value(values[key])}")
+        for name in sorted({key[0] for key in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for key in sorted(k for k in histograms if k[0] == name):
+                counts, count, total, p50, p95 = histograms[key]
+                cumulative = 0
+                for bound, bucket_count in zip(LATENCY_BUCKETS + (math.inf,), counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == math.inf else f"{bound:g}"
+                    lines.append(f"{name}_bucket{_format_labels(key[1] + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(key[1])} {total:.6f}")
+                lines.append(f"{name}_count{_format_labels(key[1])} {count}")
+                lines.append(f"# {name}{_format_labels(key[1])} p50<={p50:g}s p95<={p95:g}s")
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{label}="{value}"' for label, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else f"{value:.6f}"
+
+
+#Globale Instanz (wie config), an-/ausschalten über metrics.enabled
+metrics = MetricsRegistry()
@@ -0,0 +1,177 @@
+import json
+import multiprocessing
+import os
+import numpy as np
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+from routing import PublicTransportRouter
+from config import config
+
+#Reisezeit-Matrizen (Origin-Destination) zwischen vielen Haltestellen oder Adress-Zonen
+#PROBLEM: find_routes in einer Schleife rechnet pro Paar eine eigene Suche und baut Journey-Objekte,
+#von denen die Matrix nur Ankunft und Umstiege braucht
+#Lösung: Pro Start und Abfahrtszeit EINE One-to-all-Suche (RAPTOR ohne Ziel), daraus werden alle Ziele
+#gleichzeitig abgelesen. Die Suchen laufen in einem Prozess-Pool; die Worker entstehen per fork NACH dem
+#Aufbau des Fahrplans und lesen ihn nur (Copy-on-Write, kein erneutes Laden oder Pickeln)
+#Die Ergebnisse werden direkt in .npy-Dateien auf der Platte geschrieben (np.lib.format.open_memmap),
+#die Matrix muss also nie komplett im Speicher liegen
+
+UNREACHABLE = -1 #Wert in beiden Matrizen für "nicht erreichbar"
+
+#Vom Elternprozess vor dem fork gesetzt, in den Workern nur gelesen
+_shared = {}
+
+
+@dataclass
+class ODMatrix:
+    #Ergebnis von compute_od_matrix (Arrays sind Memory-Maps der Dateien in output_dir)
+    origins: List[str]
+    destinations: List[str]
+    departure_times: List[timedelta]
+    arrival_times: np.ndarray #[Abfahrt, Start, Ziel] Ankunft in Sekunden nach Mitternacht (int32)
+    transfers: np.ndarray #[Abfahrt, Start, Ziel] Anzahl Umstiege (int8)
+    output_dir: str
+
+    def travel_times(self) -> np.ndarray:
+        #Reisezeit in Sekunden (UNREACHABLE bleibt erhalten)
+        departures = np.array([int(td.total_seconds()) for td in self.departure_times], dtype=np.int32)
+        return np.where(self.arrival_times >= 0, self.arrival_times - departures[:, None, None], UNREACHABLE)
+
+
+def _zone_stops(router: PublicTransportRouter, locations: Sequence[str]) -> List[Dict[str, timedelta]]:
+    #Haltestellen jeder Zone mit Fußweg (Adresse -> nächste Haltestellen, Name -> Station mit allen Gleisen)
+    zones = []
+    for location in locations:
+        stops, _ = router._resolve_location(location)
+        zones.append(router._access_times(stops))
+    return zones
+
+
+def _origin_row(task: Tuple[int, int]) -> Tuple[int, int, np.ndarray, np.ndarray]:
+    #Eine One-to-all-Suche: Ankunft und Umstiege von einem Start zu allen Zielen
+    departure_index, origin_index = task
+    router = _shared['router']
+    departure = _shared['departure_times'][departure_index]
+    sources = {stop_id: departure + walk for stop_id, walk in _shared['origins'][origin_index].items()}
+    arrival, trips = router.raptor.one_to_all(sources, _shared['transport_mode'], service_day=_shared['service_day'],
+                                              window=_shared['window'])
+
+    #Ziel-Haltestellen (flach über alle Zonen) -> früheste Ankunft pro Zone inkl. Fußweg
+    dest_stop, dest_walk, dest_zone = _shared['destination_stops']
+    n_zones = _shared['n_destinations']
+    stop_arrival = arrival[dest_stop]
+    reached = stop_arrival >= 0
+    totals = np.where(reached, stop_arrival + dest_walk, np.iinfo(np.int64).max)
+    best = np.full(n_zones, np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(best, dest_zone, totals)
+
+    #Umstiege der Haltestelle, über die die Zone am frühesten erreicht wird (bei Gleichstand: wenigste)
+    row_transfers = np.full(n_zones, UNREACHABLE, dtype=np.int8)
+    winners = reached & (totals == best[dest_zone])
+    order = np.lexsort((trips[dest_stop][winners], dest_zone[winners]))
+    zones = dest_zone[winners][order]
+    first = np.ones(len(zones), dtype=bool)
+    first[1:] = zones[1:] != zones[:-1]
+    row_transfers[zones[first]] = np.maximum(trips[dest_stop][winners][order][first] - 1, 0)
+
+    row_arrival = np.where(best < np.iinfo(np.int64).max, best, UNREACHABLE).astype(np.int32)
+    return departure_index, origin_index, row_arrival, row_transfers
+
+
+def compute_od_matrix(router: PublicTransportRouter, origins: Sequence[str], destinations: Sequence[str],
+                      departure_times: Sequence[timedelta], output_dir: str, transport_mode: int = 2,
+                      service_date: Optional[date] = None, workers: Optional[int] = None) -> ODMatrix:
+    #origins/destinations: Haltestellennamen oder Adressen (wie bei find_routes)
+    #Schreibt arrival_times.npy, transfers.npy (Form: Abfahrten x Starts x Ziele) und meta.json nach output_dir
+    service_date = service_date or date.today()
+    workers = workers or config.OD_WORKERS or os.cpu_count() or 1
+    departure_times = list(departure_times)
+    print(f"OD-Matrix: {len(origins)} Starts x {len(destinations)} Ziele x {len(departure_times)} Abfahrtszeiten")
+
+    graph = router.gtfs_processor.window #Tagesnummer und Fahrplan aus demselben Stand des Graphen
+    service_day = router.gtfs_processor.service_day(service_date, graph)
+    tt = router.raptor.get_timetable(transport_mode, service_day, graph) #Vor dem fork aufbauen -> von allen Workern geteilt
+    origin_zones = _zone_stops(router, origins)
+    destination_zones = _zone_stops(router, destinations)
+
+    dest_stop, dest_walk, dest_zone = [], [], []
+    for zone, stops in enumerate(destination_zones):
+        for stop_id, walk in stops.items():
+            stop = tt.stop_index.get(stop_id)
+            if stop is not None:
+                dest_stop.append(stop)
+                dest_walk.append(int(walk.total_seconds()))
+                dest_zone.append(zone)
+
+    _shared.update({
+        'router': router,
+        'departure_times': departure_times,
+        'origins': origin_zones,
+        'destination_stops': (np.array(dest_stop, dtype=np.int64), np.array(dest_walk, dtype=np.int64),
+                              np.array(dest_zone, dtype=np.int64)),
+        'n_destinations': len(destinations),
+        'transport_mode': transport_mode,
+        'service_day': service_day,
+        'window': graph,
+    })
+
+    os.makedirs(output_dir, exist_ok=True)
+    shape = (len(departure_times), len(origins), len(destinations))
+    arrival_times = np.lib.format.open_memmap(os.path.join(output_dir, 'arrival_times.npy'), mode='w+',
+                                              dtype=np.int32, shape=shape)
+    transfers = np.lib.format.open_memmap(os.path.join(output_dir, 'transfers.npy'), mode='w+',
+                                          dtype=np.int8, shape=shape)
+    with open(os.path.join(output_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({
+            'origins': list(origins),
+            'destinations': list(destinations),
+            'departure_times': [int(td.total_seconds()) for td in departure_times],
+            'service_date': service_date.isoformat(),
+            'transport_mode': transport_mode,
+            'unreachable': UNREACHABLE,
+        }, f, ensure_ascii=False, indent=2)
+
+    tasks = [(d, o) for d in range(len(departure_times)) for o in range(len(origins))]
+    try:
+        #fork: Worker erben Fahrplan und Router ohne Kopie; ohne fork (z.B. Windows) wird seriell gerechnet
+        use_pool = workers > 1 and len(tasks) > 1 and 'fork' in multiprocessing.get_all_start_methods()
+        if use_pool:
+            with multiprocessing.get_context('fork').Pool(workers) as pool:
+                results = pool.imap_unordered(_origin_row, tasks, chunksize=max(1, len(tasks) // (workers * 8)))
+                _write_rows(results, arrival_times, transfers, len(tasks))
+        else:
+            _write_rows(map(_origin_row, tasks), arrival_times, transfers, len(tasks))
+    finally:
+        _shared.clear()
+
+    print(f"✓ OD-Matrix gespeichert in {output_dir}")
+    return ODMatrix(list(origins), list(destinations), departure_times, arrival_times, transfers, output_dir)
+
+
+def _write_rows(results, arrival_times: np.ndarray, transfers: np.ndarray, total: int):
+    #Zeilen sofort in die Memory-Maps schreiben und regelmäßig auf die Platte bringen
+    flush_every = max(1, total // 20)
+    for done, (departure_index, origin_index, row_arrival, row_transfers) in enumerate(results, 1):
+        arrival_times[departure_index, origin_index] = row_arrival
+        transfers[departure_index, origin_index] = row_transfers
+        if done % flush_every == 0:
+            arrival_times.flush()
+            transfers.flush()
+            print(f"  {done}/{total} Zeilen berechnet")
+    arrival_times.flush()
+    transfers.flush()
+
+
+def load_od_matrix(output_dir: str) -> ODMatrix:
+    #Liest eine gespeicherte Matrix wieder ein (Arrays als Memory-Maps, nur lesend)
+    with open(os.path.join(output_dir, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    return ODMatrix(
+        meta['origins'],
+        meta['destinations'],
+        [timedelta(seconds=seconds) for seconds in meta['departure_times']],
+        np.load(os.path.join(output_dir, 'arrival_times.npy'), mmap_mode='r'),
+        np.load(os.path.join(output_dir, 'transfers.npy'), mmap_mode='r'),
+        output_dir
+    )
@@ -0,0 +1,633 @@
+import copy
+import numpy as np
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+from gtfs_processing import GTFSProcessor, ServiceWindow
+from connection_arrays import ConnectionArrays
+from csa_routing import INFINITY, StopArrays, source_version, trip_codes
+from config import config
+from metrics import metrics
+from service_calendar import ALL_DAYS_BIT, active_on_day
+
+#Art des Vorgängers einer Haltestelle in einer Runde
+PRED_NONE = 0
+PRED_SOURCE = 1
+PRED_VEHICLE = 2
+PRED_WALK = 3
+
+
+def _collect_runs(connections: ConnectionArrays, rows: np.ndarray) -> Tuple[Dict, Dict[int, int]]:
+    #Fahrten (Runs) der Verbindungen rows nach Linie + Haltestellenfolge gruppieren (in der Reihenfolge von rows)
+    #connections ist nach Trip und Haltestellenfolge sortiert
+    #Ein Trip wird dort geteilt, wo eine ungültige Verbindung entfernt wurde (Lücke in der Kette)
+    trips = trip_codes(connections, rows)
+    route_ids = connections.route[rows].tolist()
+    from_stop = connections.from_stop[rows]
+    to_stop = connections.to_stop[rows]
+    dep = connections.dep[rows]
+    arr = connections.arr[rows]
+    priorities = connections.priority[rows]
+
+    continues = np.zeros(len(rows), dtype=bool)
+    if len(rows) > 1:
+        continues[1:] = (trips[1:] == trips[:-1]) & (from_stop[1:] == to_stop[:-1])
+    run_starts = np.nonzero(~continues)[0].tolist() + [len(rows)]
+
+    groups = {}
+    group_priority = {} #Linie -> Verkehrsmittel-Priorität (config.TRANSPORT_PRIORITIES)
+    for start, end in zip(run_starts[:-1], run_starts[1:]):
+        stops = (int(from_stop[start]),) + tuple(to_stop[start:end].tolist())
+        run = (
+            dep[start:end].tolist(),                   #Abfahrt an Position 0..n-2
+            [None] + arr[start:end].tolist(),          #Ankunft an Position 1..n-1
+            rows[start:end].tolist()                   #Verbindung Position p -> p+1
+        )
+        groups.setdefault((route_ids[start], stops), []).append(run)
+        group_priority[route_ids[start]] = int(priorities[start])
+    return groups, group_priority
+
+
+def _assign_lanes(runs: List[Tuple[List, List, List]]) -> List[List[Tuple[List, List, List]]]:
+    #Überholende Trips in eigene Muster aufteilen (Zeiten müssen pro Position monoton sein)
+    #runs: nach Abfahrt an der ersten Position sortiert
+    if len(runs) > 2:
+        #Häufigster Fall: kein Trip überholt seinen Vorgänger -> ein Muster (in einem Schritt geprüft)
+        dep = np.array([run[0] for run in runs])
+        arr = np.array([run[1][1:] for run in runs])
+        if (dep[1:] >= dep[:-1]).all() and (arr[1:] >= arr[:-1]).all():
+            return [runs]
+    lanes = []
+    for run in runs:
+        for lane in lanes:
+            last = lane[-1]
+            if all(d >= ld for d, ld in zip(run[0], last[0])) and \
+               all(a >= la for a, la in zip(run[1][1:], last[1][1:])):
+                lane.append(run)
+                break
+        else:
+            lanes.append([run])
+    return lanes
+
+
+class RaptorTimetable(StopArrays):
+    #Fahrplan gruppiert nach Linienmustern (route patterns) für RAPTOR
+    #Ein Muster = alle Trips einer Linie mit exakt derselben Haltestellenfolge
+    #Innerhalb eines Musters sind die Trips nach Abfahrt sortiert und überholen sich nicht
+    #-> An jeder Haltestelle ist der früheste erreichbare Trip per Binärsuche zu finden
+    def __init__(self, processor: GTFSProcessor, transport_mode: int, service_day: int = ALL_DAYS_BIT,
+                 window: Optional[ServiceWindow] = None):
+        connections = processor.connections_for(service_day, window)
+        super().__init__(connections)
+        groups, group_priority = _collect_runs(connections, connections.rows_for(transport_mode, service_day))
+
+        self.pattern_stops = []      #Muster -> Liste der Haltestellen
+        self.pattern_dep = []        #Muster -> Position -> Abfahrtszeiten aller Trips (sortiert, für bisect)
+        self.pattern_arr = []        #Muster -> Trip -> Ankunftszeiten pro Position
+        self.pattern_rows = []       #Muster -> Trip -> Positionen in self.connections
+        self.pattern_priority = []   #Muster -> Verkehrsmittel-Priorität der Linie (1 = Bahn ... 3 = Bus)
+        self.live_version = None     #Echtzeit-Stand von connections (csa_routing.source_version)
+        self._groups = {}            #Für patched: (Linie, Haltestellen) -> (erste Verbindung, erstes Muster, Musterende)
+        for (route_id, stops), runs in groups.items():
+            first_row = runs[0][2][0]
+            runs.sort(key=lambda run: run[0][0])
+            start = len(self.pattern_stops)
+            self._add_patterns(stops, _assign_lanes(runs), group_priority[route_id])
+            self._groups[(route_id, stops)] = (first_row, start, len(self.pattern_stops))
+        self._index_stops()
+
+    def _add_patterns(self, stops: Tuple[int, ...], lanes: List, priority: int):
+        for lane in lanes:
+            self.pattern_stops.append(list(stops))
+            self.pattern_dep.append([list(times) for times in zip(*[run[0] for run in lane])])
+            self.pattern_arr.append([run[1] for run in lane])
+            self.pattern_rows.append([run[2] for run in lane])
+            self.pattern_priority.append(priority)
+
+    def _index_stops(self):
+        #Haltestelle -> [(Muster, erste Position der Haltestelle im Muster)]
+        self.stop_patterns = [[] for _ in self.stop_ids]
+        for p, stops in enumerate(self.pattern_stops):
+            seen = set()
+            for pos, stop in enumerate(stops[:-1]): #An der letzten Position kann man nicht einsteigen
+                if stop not in seen:
+                    seen.add(stop)
+                    self.stop_patterns[stop].append((p, pos))
+
+    def patched(self, connections: ConnectionArrays, changed_rows: np.ndarray, transport_mode: int,
+                service_day: int) -> 'RaptorTimetable':
+        #Fahrplan für einen Echtzeit-Stand, der sich von self.connections nur in den Verbindungen changed_rows
+        #unterscheidet (realtime.LiveTimetable.changed_rows, immer alle Verbindungen eines Trips)
+        #Nur die Linienmuster, in denen diese Trips bisher lagen oder jetzt liegen, werden neu aufgeteilt;
+        #alle anderen Muster werden übernommen -> gleiches Ergebnis wie bei einem Neuaufbau
+        #Der bisherige Fahrplan bleibt unverändert (laufende Anfragen rechnen darauf weiter)
+        changed = changed_rows[connections.mode_mask(transport_mode)[changed_rows]]
+        old_runs, _ = _collect_runs(self.connections, changed[active_on_day(self.connections.service_mask[changed],
+                                                                             service_day)])
+        new_runs, group_priority = _collect_runs(connections, changed[active_on_day(connections.service_mask[changed],
+                                                                                    service_day)])
+        changed = set(changed.tolist())
+
+        groups = dict(self._groups)
+        lanes = {}
+        for key in list(old_runs) + [key for key in new_runs if key not in old_runs]:
+            runs = list(new_runs.get(key, []))
+            if key in self._groups:
+                #Unveränderte Trips des Musters behalten
+                _, start, end = self._groups[key]
+                for p in range(start, end):
+                    deps = list(zip(*self.pattern_dep[p])) #Abfahrten pro Trip
+                    for dep, arr, rows in zip(deps, self.pattern_arr[p], self.pattern_rows[p]):
+                        if rows[0] not in changed:
+                            runs.append((dep, arr, rows))
+                group_priority[key[0]] = self.pattern_priority[start]
+            if not runs:
+                del groups[key]
+                continue
+            #Wie beim Aufbau: nach Abfahrt, bei Gleichstand in Tabellenreihenfolge
+            runs.sort(key=lambda run: (run[0][0], run[2][0]))
+            lanes[key] = _assign_lanes(runs)
+            groups[key] = (min(run[2][0] for run in runs), 0, 0)
+
+        patched = copy.copy(self)
+        patched.connections = connections
+        patched.pattern_stops, patched.pattern_dep, patched.pattern_arr = [], [], []
+        patched.pattern_rows, patched.pattern_priority = [], []
+        patched._groups = {}
+        #Muster in der Reihenfolge der ersten Verbindung ihrer Gruppe (wie beim Aufbau)
+        for key, (first_row, start, end) in sorted(groups.items(), key=lambda item: item[1][0]):
+            new_start = len(patched.pattern_stops)
+            if key in lanes:
+                patched._add_patterns(key[1], lanes[key], group_priority[key[0]])
+            else:
+                patched.pattern_stops += self.pattern_stops[start:end]
+                patched.pattern_dep += self.pattern_dep[start:end]
+                patched.pattern_arr += self.pattern_arr[start:end]
+                patched.pattern_rows += self.pattern_rows[start:end]
+                patched.pattern_priority += self.pattern_priority[start:end]
+            patched._groups[key] = (first_row, new_start, len(patched.pattern_stops))
+        if [(key, start, end) for key, (_, start, end) in patched._groups.items()] != \
+                [(key, start, end) for key, (_, start, end) in self._groups.items()]:
+            patched._index_stops() #Muster sind hinzugekommen, entfallen oder verschoben
+        return patched
+
+
+class RaptorRouter:
+    #RAPTOR (Round-bAsed Public Transit Optimized Router)
+    #Runde k berechnet die früheste Ankunft mit höchstens k Fahrten (= k-1 Umstiege)
+    #Pro Runde werden nur die Linienmuster abgefahren, die eine in der Vorrunde verbesserte
+    #("markierte") Haltestelle bedienen -> der Scan bleibt schmal
+    #Ergebnis: exakte Pareto-Menge aus Ankunftszeit und Anzahl Umstiege
+
+    def __init__(self, gtfs_processor: GTFSProcessor):
+        self.gtfs_processor = gtfs_processor
+        self._timetables = {} #(transport_mode, Betriebstag) -> RaptorTimetable (wird beim ersten Bedarf erstellt)
+        self._graph_version = gtfs_processor.graph_version #Stand des Graphen, zu dem die Fahrpläne gehören
+
+    def get_timetable(self, transport_mode: int, service_day: int = ALL_DAYS_BIT,
+                      window: Optional[ServiceWindow] = None) -> RaptorTimetable:
+        #window: Stand des Graphen, aus dem service_day berechnet wurde (Standard: aktueller Stand)
+        window = window or self.gtfs_processor.window
+        if window.version < self._graph_version:
+            #Anfrage hat vor einem Umbau begonnen -> Fahrplan aus ihrem Stand, ohne die neuen zu verwerfen
+            with metrics.timer('timetable_build_seconds', engine='raptor'):
+                return RaptorTimetable(self.gtfs_processor, transport_mode, service_day, window)
+        if window.version != self._graph_version:
+            #Graph wurde neu auf- oder umgebaut (z.B. Tageswechsel) -> Fahrpläne und Tagesnummern passen nicht mehr
+            self._timetables = {}
+            self._graph_version = window.version
+        key = (transport_mode, service_day)
+        live = self.gtfs_processor.live_timetable(service_day, window)
+        timetable = self._timetables.get(key)
+        connections = live.connections if live is not None else window.connections
+        if timetable is None or timetable.connections is not connections:
+            #Neuer Echtzeit-Stand für den Tag (realtime.py) -> nur die Muster der geänderten Trips neu aufteilen
+            #(wie ConnectionScanRouter.get_timetable)
+            changed_rows = live.changed_rows(timetable.live_version) \
+                if timetable is not None and live is not None else None
+            with metrics.timer('timetable_build_seconds', engine='raptor'):
+                if changed_rows is not None:
+                    timetable = timetable.patched(connections, changed_rows, transport_mode, service_day)
+                else:
+                    timetable = RaptorTimetable(self.gtfs_processor, transport_mode, service_day, window)
+            timetable.live_version = source_version(timetable.connections, live, window)
+            self._timetables[key] = timetable
+        return timetable
+
+    def _run(self, tt: RaptorTimetable, sources: Dict[int, int], targets: Dict[int, int], max_rounds: int,
+             arrival_limit: int = INFINITY):
+        #Führt bis zu max_rounds Runden aus
+        #targets: Zielhaltestelle -> Fußweg zum eigentlichen Ziel in Sekunden (für das Pruning)
+        #arrival_limit: Ankünfte ab dieser Zeit werden nicht weiter verfolgt (z.B. für Isochronen)
+        #Rückgabe: pro Runde (Ankunft, Vorgängerart, Fußweg-Ausgangshaltestelle, Fußweg-Index, Fahrzeugetappen)
+        #Fahrzeugetappen: Haltestelle -> (Muster, Trip, Einstiegsposition, Runde des Einstiegs, Ankunft)
+        #Sie werden für JEDE verbesserte Fahrzeugankunft gespeichert (auch wenn die Haltestelle zu Fuß
+        #schon früher erreicht war), weil von dort aus noch Fußwege möglich sind
+        n_stops = len(tt.stop_ids)
+        transfer = config.TRANSFER_TIME_SECONDS
+        fp_start, fp_to, fp_time = tt.footpath_start, tt.footpath_to, tt.footpath_time
+
+        best = [INFINITY] * n_stops          #Beste bekannte Ankunft über alle Runden (lokales Pruning)
+        best_vehicle = [INFINITY] * n_stops  #Beste Ankunft mit einem Fahrzeug über alle Runden
+        board = [INFINITY] * n_stops         #Frühester Einstieg über alle bisherigen Runden
+        board_round = [0] * n_stops          #Runde, aus der dieser früheste Einstieg stammt
+
+        def relax_footpaths(starts, arrival, kind, walk_from, walk_fp, round_board, marked, target_best):
+            for stop, time in starts:
+                for k in range(fp_start[stop], fp_start[stop + 1]):
+                    w = fp_to[k]
+                    walk_arrival = time + fp_time[k]
+                    if walk_arrival < best[w] and walk_arrival < target_best:
+                        arrival[w] = best[w] = walk_arrival
+                        round_board[w] = walk_arrival
+                        kind[w] = PRED_WALK
+                        walk_from[w], walk_fp[w] = stop, k
+                        marked.add(w)
+                        if w in targets:
+                            target_best = min(target_best, walk_arrival + targets[w])
+            return target_best
+
+        rounds = []
+        marked = set()
+        for round_no in range(max_rounds + 1):
+            arrival = [INFINITY] * n_stops
+            kind = [PRED_NONE] * n_stops
+            walk_from = [0] * n_stops
+            walk_fp = [0] * n_stops
+            legs = {}
+            round_board = {} #Einstiegszeiten dieser Runde, werden erst nach der Runde übernommen
+            target_best = min(min((best[t] + targets[t] for t in targets), default=INFINITY), arrival_limit)
+
+            if round_no == 0:
+                #Runde 0: Start-Haltestellen und Fußwege vom Start
+                for stop, time in sources.items():
+                    if time < best[stop]:
+                        arrival[stop] = best[stop] = time
+                        round_board[stop] = time
+                        kind[stop] = PRED_SOURCE
+                        marked.add(stop)
+                        if stop in targets:
+                            target_best = min(target_best, time + targets[stop])
+                starts = [(stop, arrival[stop]) for stop in list(marked)]
+            else:
+                if not marked:
+                    break
+                #Muster sammeln, die eine markierte Haltestelle bedienen (früheste Position pro Muster)
+                queue = {}
+                for stop in marked:
+                    for p, pos in tt.stop_patterns[stop]:
+                        if pos < queue.get(p, INFINITY):
+                            queue[p] = pos
+                marked = set()
+
+                for p, start_pos in queue.items():
+                    stops = tt.pattern_stops[p]
+                    dep_by_pos = tt.pattern_dep[p]
+                    arr_by_trip = tt.pattern_arr[p]
+                    last_pos = len(stops) - 1
+                    trip = -1
+                    board_pos = -1
+                    board_from = 0
+                    for pos in range(start_pos, len(stops)):
+                        stop = stops[pos]
+                        if trip >= 0:
+                            a = arr_by_trip[trip][pos]
+                            if a < best_vehicle[stop] and a < target_best:
+                                best_vehicle[stop] = a
+                                legs[stop] = (p, trip, board_pos, board_from, a)
+                                if a < best[stop]:
+                                    arrival[stop] = best[stop] = a
+                                    round_board[stop] = a + transfer
+                                    kind[stop] = PRED_VEHICLE
+                                    marked.add(stop)
+                                    if stop in targets:
+                                        target_best = min(target_best, a + targets[stop])
+                        #Früheren Trip an dieser Haltestelle erreichbar?
+                        if pos < last_pos:
+                            ready = board[stop]
+                            if ready < INFINITY and (trip < 0 or ready <= dep_by_pos[pos][trip]):
+                                earliest = bisect_left(dep_by_pos[pos], ready)
+                                if earliest < len(dep_by_pos[pos]) and (trip < 0 or earliest < trip):
+                                    trip = earliest
+                                    board_pos = pos
+                                    board_from = board_round[stop]
+                starts = [(stop, leg[4]) for stop, leg in legs.items()]
+
+            #Fußwege von allen per Fahrzeug verbesserten Haltestellen (bzw. vom Start)
+            relax_footpaths(starts, arrival, kind, walk_from, walk_fp, round_board, marked, target_best)
+
+            for stop, time in round_board.items():
+                if time < board[stop]:
+                    board[stop] = time
+                    board_round[stop] = round_no
+
+            rounds.append((arrival, kind, walk_from, walk_fp, legs))
+
+        return rounds
+
+    def _run_profile(self, tt: RaptorTimetable, sources: Dict[int, int], targets: Dict[int, int],
+                     max_rounds: int, departures: List[int]):
+        #rRAPTOR: Profil-Suche über alle Abfahrtszeiten eines Zeitfensters
+        #Die Abfahrten werden von der spätesten zur frühesten abgearbeitet, die Labels jeder Runde bleiben
+        #dabei erhalten: Was mit späterer Abfahrt erreichbar ist, ist es mit früherer Abfahrt auch
+        #-> jede weitere Abfahrt verbessert nur noch wenige Haltestellen und der Aufwand bleibt ein
+        #kleines Vielfaches einer Einzelanfrage
+        #Anders als in _run wird pro Runde separat gepruned (best[k] = beste Ankunft mit höchstens k Fahrten),
+        #sonst würde eine spätere Abfahrt mit mehr Umstiegen eine frühere mit weniger Umstiegen verdrängen
+        #sources: Start-Haltestelle -> Fußweg von der Startadresse in Sekunden (relativ zur Abfahrt)
+        #Rückgabe: Liste von (Abfahrt, Ankunft am Ziel inkl. Fußweg, Runde, Pfad) pro Pareto-optimaler Verbindung
+        n_stops = len(tt.stop_ids)
+        n_rounds = max_rounds + 1
+        transfer = config.TRANSFER_TIME_SECONDS
+        fp_start, fp_to, fp_time = tt.footpath_start, tt.footpath_to, tt.footpath_time
+
+        #Pro Runde, über alle Abfahrten hinweg: beste Werte sind kumulativ (Runde k enthält alle Runden <= k)
+        arrival = [[INFINITY] * n_stops for _ in range(n_rounds)]      #Label der Runde selbst
+        kind = [[PRED_NONE] * n_stops for _ in range(n_rounds)]
+        walk_from = [[0] * n_stops for _ in range(n_rounds)]
+        walk_fp = [[0] * n_stops for _ in range(n_rounds)]
+        legs = [{} for _ in range(n_rounds)]
+        best = [[INFINITY] * n_stops for _ in range(n_rounds)]
+        best_vehicle = [[INFINITY] * n_stops for _ in range(n_rounds)]
+        board = [[INFINITY] * n_stops for _ in range(n_rounds)]
+        board_round = [[0] * n_stops for _ in range(n_rounds)]
+        rounds = list(zip(arrival, kind, walk_from, walk_fp, legs)) #Sicht für _reconstruct
+
+        def lower(table, round_no, stop, value, source_round=None):
+            #Trägt einen verbesserten Wert in Runde round_no und alle späteren Runden ein
+            for k in range(round_no, n_rounds):
+                if value >= table[k][stop]:
+                    break
+                table[k][stop] = value
+                if source_round is not None:
+                    board_round[k][stop] = source_round
+
+        def target_bound(round_no):
+            return min(best[round_no][t] + targets[t] for t in targets)
+
+        def relax_footpaths(round_no, starts, round_board, marked, target_best):
+            for stop, time in starts:
+                for k in range(fp_start[stop], fp_start[stop + 1]):
+                    w = fp_to[k]
+                    walk_arrival = time + fp_time[k]
+                    if walk_arrival < best[round_no][w] and walk_arrival < target_best:
+                        arrival[round_no][w] = walk_arrival
+                        lower(best, round_no, w, walk_arrival)
+                        round_board[w] = walk_arrival
+                        kind[round_no][w] = PRED_WALK
+                        walk_from[round_no][w], walk_fp[round_no][w] = stop, k
+                        marked.add(w)
+                        if w in targets:
+                            target_best = min(target_best, walk_arrival + targets[w])
+
+        results = []
+        last_total = [INFINITY] * n_rounds #Ergebnis jeder Runde bei der zuletzt bearbeiteten (späteren) Abfahrt
+        for departure in sorted(set(departures), reverse=True):
+            marked = set()
+            for round_no in range(n_rounds):
+                round_board = {}
+                target_best = target_bound(round_no)
+                if round_no == 0:
+                    for stop, access in sources.items():
+                        time = departure + access
+                        if time < best[0][stop]:
+                            arrival[0][stop] = time
+                            lower(best, 0, stop, time)
+                            round_board[stop] = time
+                            kind[0][stop] = PRED_SOURCE
+                            marked.add(stop)
+                            if stop in targets:
+                                target_best = min(target_best, time + targets[stop])
+                    starts = [(stop, arrival[0][stop]) for stop in list(marked)]
+                else:
+                    if not marked:
+                        break
+                    queue = {}
+                    for stop in marked:
+                        for p, pos in tt.stop_patterns[stop]:
+                            if pos < queue.get(p, INFINITY):
+                                queue[p] = pos
+                    marked = set()
+                    ready_times = board[round_no - 1]
+                    ready_rounds = board_round[round_no - 1]
+                    round_best = best[round_no]
+                    round_vehicle = best_vehicle[round_no]
+                    round_legs = legs[round_no]
+                    starts = []
+
+                    for p, start_pos in queue.items():
+                        stops = tt.pattern_stops[p]
+                        dep_by_pos = tt.pattern_dep[p]
+                        arr_by_trip = tt.pattern_arr[p]
+                        last_pos = len(stops) - 1
+                        trip = -1
+                        board_pos = -1
+                        board_from = 0
+                        for pos in range(start_pos, len(stops)):
+                            stop = stops[pos]
+                            if trip >= 0:
+                                a = arr_by_trip[trip][pos]
+                                if a < round_vehicle[stop] and a < target_best:
+                                    lower(best_vehicle, round_no, stop, a)
+                                    round_legs[stop] = (p, trip, board_pos, board_from, a)
+                                    starts.append((stop, a))
+                                    if a < round_best[stop]:
+                                        arrival[round_no][stop] = a
+                                        lower(best, round_no, stop, a)
+                                        round_board[stop] = a + transfer
+                                        kind[round_no][stop] = PRED_VEHICLE
+                                        marked.add(stop)
+                                        if stop in targets:
+                                            target_best = min(target_best, a + targets[stop])
+                            if pos < last_pos:
+                                ready = ready_times[stop]
+                                if ready < INFINITY and (trip < 0 or ready <= dep_by_pos[pos][trip]):
+                                    earliest = bisect_left(dep_by_pos[pos], ready)
+                                    if earliest < len(dep_by_pos[pos]) and (trip < 0 or earliest < trip):
+                                        trip = earliest
+                                        board_pos = pos
+                                        board_from = ready_rounds[stop]
+
+                relax_footpaths(round_no, starts, round_board, marked, target_best)
+                for stop, time in round_board.items():
+                    lower(board, round_no, stop, time, round_no)
+
+            #Neue Pareto-optimale Verbindungen dieser Abfahrt: schneller als mit weniger Fahrten
+            #und schneller als bei der späteren Abfahrt mit gleich vielen Fahrten
+            fewer_trips = INFINITY
+            for round_no in range(n_rounds):
+                target = min(targets, key=lambda stop: best[round_no][stop] + targets[stop])
+                total = best[round_no][target] + targets[target]
+                if total < fewer_trips and total < last_total[round_no]:
+                    results.append((departure, total, round_no, self._reconstruct(tt, rounds, round_no, target)))
+                last_total[round_no] = total
+                fewer_trips = min(fewer_trips, total)
+        return results
+
+    def _reconstruct(self, tt: RaptorTimetable, rounds, round_no: int, target: int) -> List[Dict]:
+        #Pfad rückwärts aufbauen: Fahrzeug-Etappen führen in die Runde des Einstiegs,
+        #Fußwege führen zur Fahrzeugankunft derselben Runde (bzw. zum Start in Runde 0)
+        connections = tt.connections
+        path = []
+        stop = target
+        k = round_no
+        use_leg = False #True -> an dieser Haltestelle die Fahrzeugankunft verwenden (nach einem Fußweg)
+        while True:
+            arrival, kind, walk_from, walk_fp, legs = rounds[k]
+            if use_leg or kind[stop] == PRED_VEHICLE:
+                if k == 0:
+                    break #Fußweg begann direkt am Start
+                p, trip, board_pos, board_from, _ = legs[stop]
+                stops = tt.pattern_stops[p]
+                alight_pos = stops.index(stop, board_pos + 1)
+                rows = tt.pattern_rows[p][trip][board_pos:alight_pos]
+                path = connections.records(rows) + path
+                stop = stops[board_pos]
+                k = board_from
+                use_leg = False
+            elif kind[stop] == PRED_WALK:
+                from_stop, fp = walk_from[stop], walk_fp[stop]
+                walk = self.gtfs_processor._walking_connection(
+                    tt.stop_ids[from_stop], tt.stop_ids[stop],
+                    tt.footpath_distance[fp], tt.footpath_time[fp]
+                )
+                walk['departure_time'] = timedelta(seconds=arrival[stop] - tt.footpath_time[fp])
+                walk['arrival_time'] = timedelta(seconds=arrival[stop])
+                path = [walk] + path
+                stop = from_stop
+                use_leg = True
+            else:
+                break #Start erreicht
+        return path
+
+    def route(self, start_stop_id: str, end_stop_id: str, departure_time: timedelta,
+              transport_mode: int = 2, max_transfers: Optional[int] = None,
+              service_day: int = ALL_DAYS_BIT) -> List[Tuple[List[Dict], timedelta, int]]:
+        #Alle Pareto-optimalen Routen (Ankunftszeit vs. Umstiege) bis max_transfers Umstiege
+        #Rückgabe: Liste von (Pfad als Verbindungsliste, Ankunftszeit, Anzahl Fahrten), früheste Ankunft zuerst
+        return [result[:3] for result in self.route_many(
+            {start_stop_id: departure_time}, {end_stop_id: timedelta(0)}, transport_mode, max_transfers, service_day
+        )]
+
+    def route_many(self, sources: Dict[str, timedelta], targets: Dict[str, timedelta],
+                   transport_mode: int = 2, max_transfers: Optional[int] = None,
+                   service_day: int = ALL_DAYS_BIT,
+                   window: Optional[ServiceWindow] = None) -> List[Tuple[List[Dict], timedelta, int, timedelta]]:
+        #Wie route, aber mit mehreren Start- und Zielhaltestellen in EINEM Lauf
+        #sources: stop_id -> früheste Abfahrt an dieser Haltestelle (z.B. Startzeit + Fußweg von der Adresse)
+        #targets: stop_id -> Fußweg von der Haltestelle zum eigentlichen Ziel
+        #Rückgabe: Liste von (Pfad, Ankunft an der Zielhaltestelle, Anzahl Fahrten, Ankunft am Ziel inkl. Fußweg)
+        #Pro Runde zählt die früheste Ankunft am Ziel inkl. Fußweg, bei Gleichstand die zuerst angegebene Haltestelle
+        if max_transfers is None:
+            max_transfers = config.MAX_TRANSFERS
+        tt = self.get_timetable(transport_mode, service_day, window)
+        source_times = {}
+        for stop_id, time in sources.items():
+            stop = tt.stop_index.get(stop_id)
+            if stop is not None:
+                seconds = int(time.total_seconds())
+                source_times[stop] = min(seconds, source_times.get(stop, INFINITY))
+        egress = {}
+        for stop_id, walk in targets.items():
+            stop = tt.stop_index.get(stop_id)
+            if stop is not None and stop not in egress:
+                egress[stop] = int(walk.total_seconds())
+        if not source_times or not egress:
+            return []
+
+        rounds = self._run(tt, source_times, egress, max_transfers + 1)
+
+        results = []
+        best_total = INFINITY
+        for k, (arrival, kind, _, _, _) in enumerate(rounds):
+            #Nur Runden, in denen das Ziel echt früher erreicht wird, sind Pareto-optimal
+            reached = [stop for stop in egress if kind[stop] != PRED_NONE]
+            if not reached:
+                continue
+            target = min(reached, key=lambda stop: arrival[stop] + egress[stop])
+            total = arrival[target] + egress[target]
+            if total < best_total:
+                best_total = total
+                path = self._reconstruct(tt, rounds, k, target)
+                results.append((path, timedelta(seconds=arrival[target]), k, timedelta(seconds=total)))
+        results.sort(key=lambda result: result[3])
+        return results
+
+    def profile(self, sources: Dict[str, timedelta], targets: Dict[str, timedelta],
+                window_start: timedelta, window_end: timedelta, transport_mode: int = 2,
+                max_transfers: Optional[int] = None,
+                service_day: int = ALL_DAYS_BIT,
+                window: Optional[ServiceWindow] = None) -> List[Tuple[List[Dict], timedelta, timedelta, int]]:
+        #Profil-Anfrage: alle Pareto-optimalen Verbindungen (Abfahrt, Ankunft, Fahrten) mit Abfahrt
+        #zwischen window_start und window_end, in EINEM rRAPTOR-Lauf statt einer Anfrage pro Minute
+        #sources: stop_id -> Fußweg vom Start zu dieser Haltestelle, targets: stop_id -> Fußweg zum Ziel
+        #Rückgabe: Liste von (Pfad, Abfahrt am Start, Ankunft am Ziel inkl. Fußweg, Anzahl Fahrten),
+        #nach Abfahrt sortiert
+        if max_transfers is None:
+            max_transfers = config.MAX_TRANSFERS
+        tt = self.get_timetable(transport_mode, service_day, window)
+        access = {}
+        for stop_id, walk in sources.items():
+            stop = tt.stop_index.get(stop_id)
+            if stop is not None:
+                access[stop] = min(int(walk.total_seconds()), access.get(stop, INFINITY))
+        egress = {}
+        for stop_id, walk in targets.items():
+            stop = tt.stop_index.get(stop_id)
+            if stop is not None and stop not in egress:
+                egress[stop] = int(walk.total_seconds())
+        if not access or not egress:
+            return []
+
+        #Kandidaten für die Abfahrt: jede Abfahrt an einer Start-Haltestelle oder an einer von dort
+        #zu Fuß erreichbaren Haltestelle, zurückgerechnet auf den Start
+        start, end = int(window_start.total_seconds()), int(window_end.total_seconds())
+        departures = {start}
+        for stop, walk in access.items():
+            reachable = [(stop, walk)] + [
+                (tt.footpath_to[k], walk + tt.footpath_time[k])
+                for k in range(tt.footpath_start[stop], tt.footpath_start[stop + 1])
+            ]
+            for boarding_stop, offset in reachable:
+                for p, pos in tt.stop_patterns[boarding_stop]:
+                    times = tt.pattern_dep[p][pos]
+                    first = bisect_left(times, start + offset)
+                    last = bisect_right(times, end + offset)
+                    departures.update(time - offset for time in times[first:last])
+
+        results = [
+            (path, timedelta(seconds=departure), timedelta(seconds=total), k)
+            for departure, total, k, path in self._run_profile(tt, access, egress, max_transfers + 1, departures)
+        ]
+        results.sort(key=lambda result: (result[1], result[2]))
+        return results
+
+    def one_to_all(self, sources: Dict[str, timedelta], transport_mode: int = 2,
+                   max_transfers: Optional[int] = None, service_day: int = ALL_DAYS_BIT,
+                   max_arrival: Optional[timedelta] = None,
+                   window: Optional[ServiceWindow] = None) -> Tuple[np.ndarray, np.ndarray]:
+        #Früheste Ankunft an ALLEN Haltestellen in einem Lauf (ohne Ziel, also ohne Ziel-Pruning)
+        #max_arrival: spätere Ankünfte werden gar nicht erst verfolgt und gelten als nicht erreichbar
+        #Rückgabe: (Ankunft in Sekunden, Anzahl Fahrten) pro Haltestelle in der Reihenfolge von
+        #get_timetable(...).stop_ids, -1 = nicht erreichbar
+        #Bei gleicher Ankunft zählt die Runde mit den wenigsten Fahrten
+        if max_transfers is None:
+            max_transfers = config.MAX_TRANSFERS
+        tt = self.get_timetable(transport_mode, service_day, window)
+        source_times = {}
+        for stop_id, time in sources.items():
+            stop = tt.stop_index.get(stop_id)
+            if stop is not None:
+                source_times[stop] = min(int(time.total_seconds()), source_times.get(stop, INFINITY))
+
+        arrival = np.full(len(tt.stop_ids), INFINITY, dtype=np.int64)
+        trips = np.full(len(tt.stop_ids), -1, dtype=np.int8)
+        if source_times:
+            limit = INFINITY if max_arrival is None else int(max_arrival.total_seconds()) + 1
+            for k, (round_arrival, _, _, _, _) in enumerate(self._run(tt, source_times, {}, max_transfers + 1, limit)):
+                round_arrival = np.asarray(round_arrival, dtype=np.int64)
+                improved = round_arrival < arrival
+                arrival[improved] = round_arrival[improved]
+                trips[improved] = k
+        arrival[arrival >= INFINITY] = -1
+        return arrival, trips
@@ -0,0 +1,423 @@
+import itertools
+import json
+import threading
+import time
+import numpy as np
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from connection_arrays import ConnectionArrays
+from gtfs_processing import GTFSProcessor, ModeIndex, ServiceWindow
+from metrics import metrics
+
+try:
+    #Nur für binäre GTFS-Realtime-Dateien (.pb) nötig: pip install gtfs-realtime-bindings
+    from google.transit import gtfs_realtime_pb2
+    from google.protobuf.json_format import MessageToDict
+except ImportError:
+    gtfs_realtime_pb2 = None
+
+#Echtzeit-Verspätungen als Overlay über dem Sollfahrplan
+#PROBLEM: Der Router kannte nur den statischen Fahrplan; jede Änderung hätte einen Neuaufbau von
+#GTFSProcessor.connections (und aller Indizes) bedeutet
+#Lösung: GTFS-Realtime TripUpdates (Verspätung pro Trip oder pro Halt, Ausfälle) werden auf eine Kopie der
+#Zeiten und Betriebstage gelegt, nur die Verbindungen der geänderten Trips bekommen neue Werte
+# - Im Haltestellen-Index (ModeIndex) werden nur die Abschnitte der betroffenen Haltestellen neu sortiert
+# - CSA- und RAPTOR-Fahrpläne des Tages werden beim nächsten Bedarf nachgeführt: jeder Stand kennt die Verbindungen,
+#   die sich in den letzten Ständen geändert haben (LiveTimetable.changed_rows), nur diese werden neu einsortiert
+# - Der neue Stand (LiveTimetable) wird erst am Ende mit einer Zuweisung ausgetauscht: laufende Anfragen rechnen
+#   auf dem bisherigen Stand weiter, neue Anfragen sehen sofort die neuen Zeiten
+#Die Verspätungen gelten für EINEN Betriebstag (service_date, normalerweise heute), andere Tage nutzen den Sollfahrplan
+#(Routet GTFSProcessor.service_day den Tag ohne Tagesfilter, gelten sie für alle Anfragen ohne Tagesfilter)
+#
+#Eingabe: FeedMessage als JSON (Feldnamen wie google.protobuf.json_format.MessageToDict oder wie im .proto)
+#oder binär (.pb, nur mit gtfs-realtime-bindings)
+
+#Nummern der Echtzeit-Stände, eindeutig über alle Overlays (ein Router kann einen Stand eines ersetzten Overlays halten)
+_versions = itertools.count(1)
+
+
+@dataclass
+class StopTimeUpdate:
+    stop_sequence: Optional[int] = None
+    stop_id: Optional[str] = None
+    arrival_delay: Optional[int] = None   #Sekunden gegenüber dem Fahrplan
+    arrival_time: Optional[int] = None    #Absolute Zeit (POSIX), hat Vorrang vor arrival_delay
+    departure_delay: Optional[int] = None
+    departure_time: Optional[int] = None
+    schedule_relationship: str = 'SCHEDULED' #SCHEDULED, SKIPPED oder NO_DATA
+
+
+@dataclass
+class TripUpdate:
+    trip_id: str
+    start_date: Optional[date] = None #None = Betriebstag des Overlays
+    canceled: bool = False
+    delay: Optional[int] = None #Verspätung des ganzen Trips (gilt bis zum ersten StopTimeUpdate)
+    stop_time_updates: List[StopTimeUpdate] = field(default_factory=list)
+
+
+@dataclass
+class LiveTimetable:
+    #Ein unveränderlicher Echtzeit-Stand (wird als Ganzes ausgetauscht)
+    service_day: int                           #Tag im Zeitfenster (Bit in service_mask)
+    connections: ConnectionArrays              #Sollfahrplan mit Echtzeit-Zeiten
+    connections_by_mode: Dict[int, ModeIndex]  #Haltestellen-Index pro Modus zu connections
+    base: ConnectionArrays                     #Sollfahrplan, aus dem dieser Stand berechnet wurde
+    version: int = 0                           #Fortlaufende Nummer des Stands (steigt mit jedem Austausch)
+    start_version: int = 0                     #Nummer des Ausgangsstands (connections = base)
+    changes: Tuple[Tuple[int, np.ndarray], ...] = () #Letzte Stände: (Nummer, geänderte Verbindungen)
+
+    def changed_rows(self, since: Optional[int]) -> Optional[np.ndarray]:
+        #Verbindungen, die sich seit dem Stand since geändert haben (None = seit dem Sollfahrplan base)
+        #None als Ergebnis: Stand ist zu alt oder gehört nicht zu diesem Verlauf -> Fahrplan neu erstellen
+        since = self.start_version if since is None else since
+        if all(version != since for version, _ in self.changes):
+            return None
+        return np.unique(np.concatenate([rows for version, rows in self.changes if version > since] +
+                                        [np.array([], dtype=np.int64)]))
+
+
+def _field(data: Dict, name: str, default=None):
+    #Feld in snake_case (wie im .proto) oder camelCase (wie MessageToDict)
+    if name in data:
+        return data[name]
+    parts = name.split('_')
+    return data.get(parts[0] + ''.join(part.title() for part in parts[1:]), default)
+
+
+def _int(value) -> Optional[int]:
+    #MessageToDict liefert int64-Felder (z.B. time) als Text
+    return int(value) if value is not None and value != '' else None
+
+
+def _parse_event(data: Optional[Dict]) -> Tuple[Optional[int], Optional[int]]:
+    #StopTimeEvent -> (delay, time)
+    if not data:
+        return None, None
+    return _int(_field(data, 'delay')), _int(_field(data, 'time'))
+
+
+def parse_feed(feed: Dict) -> Tuple[List[TripUpdate], bool]:
+    #FeedMessage (als Dictionary) -> (TripUpdates, vollständiger Datensatz?)
+    #Vollständig (FULL_DATASET): Trips ohne Eintrag haben keine Verspätung mehr
+    #DIFFERENTIAL: nur die enthaltenen Trips werden geändert
+    header = _field(feed, 'header') or {}
+    full_dataset = str(_field(header, 'incrementality', 'FULL_DATASET')) not in ('DIFFERENTIAL', '1')
+    updates = []
+    for entity in _field(feed, 'entity') or []:
+        trip_update = _field(entity, 'trip_update')
+        if not trip_update:
+            continue #Nur TripUpdates (keine Fahrzeugpositionen oder Störungsmeldungen)
+        trip = _field(trip_update, 'trip') or {}
+        trip_id = _field(trip, 'trip_id')
+        if not trip_id:
+            continue #Trips ohne trip_id (nur route_id + Startzeit) werden nicht unterstützt
+        start_date = _field(trip, 'start_date')
+        stop_time_updates = []
+        for stu in _field(trip_update, 'stop_time_update') or []:
+            arrival_delay, arrival_time = _parse_event(_field(stu, 'arrival'))
+            departure_delay, departure_time = _parse_event(_field(stu, 'departure'))
+            stop_id = _field(stu, 'stop_id')
+            stop_time_updates.append(StopTimeUpdate(
+                stop_sequence=_int(_field(stu, 'stop_sequence')),
+                stop_id=str(stop_id) if stop_id is not None else None,
+                arrival_delay=arrival_delay,
+                arrival_time=arrival_time,
+                departure_delay=departure_delay,
+                departure_time=departure_time,
+                schedule_relationship=str(_field(stu, 'schedule_relationship', 'SCHEDULED'))
+            ))
+        updates.append(TripUpdate(
+            trip_id=str(trip_id),
+            start_date=datetime.strptime(str(start_date), '%Y%m%d').date() if start_date else None,
+            canceled=str(_field(trip, 'schedule_relationship', '')) in ('CANCELED', '3'),
+            delay=_int(_field(trip_update, 'delay')),
+            stop_time_updates=stop_time_updates
+        ))
+    return updates, full_dataset
+
+
+def read_feed(path: str) -> Tuple[List[TripUpdate], bool]:
+    #Liest einen GTFS-Realtime-Feed aus einer lokalen Datei (.json oder .pb)
+    if path.endswith('.pb'):
+        if gtfs_realtime_pb2 is None:
+            raise ImportError("Für .pb-Dateien wird gtfs-realtime-bindings benötigt (oder den Feed als JSON ablegen)")
+        message = gtfs_realtime_pb2.FeedMessage()
+        with open(path, 'rb') as f:
+            message.ParseFromString(f.read())
+        return parse_feed(MessageToDict(message))
+    with open(path, encoding='utf-8') as f:
+        return parse_feed(json.load(f))
+
+
+def _midnight(day: date) -> float:
+    #POSIX-Zeit von 00:00 des Tages (Ortszeit des Rechners, wie datetime.now() im Routing-Dienst)
+    return datetime.combine(day, datetime.min.time()).timestamp()
+
+
+class RealtimeOverlay:
+    #Hält die aktuellen TripUpdates und den daraus berechneten Echtzeit-Stand für GTFSProcessor
+    #apply() darf jederzeit parallel zu Anfragen aufgerufen werden (mehrere Schreiber werden per Lock nacheinander
+    #ausgeführt, Leser brauchen keinen Lock)
+    CHANGE_LOG = 8 #So viele Stände zurück können Router ihre Fahrpläne nachführen, ältere werden neu erstellt
+
+    def __init__(self, processor: GTFSProcessor, service_date: Optional[date] = None):
+        self.processor = processor
+        self.service_date = service_date or date.today()
+        self.updates: Dict[Tuple[str, date], TripUpdate] = {} #(trip_id, Betriebstag des Trips) -> letzte Meldung
+        self.live: Optional[LiveTimetable] = None
+        self._lock = threading.Lock()
+        #Nur für Schreiber (unter dem Lock): Verbindungen pro Trip und Position jeder Verbindung in den Indizes
+        self._trip_index: Dict[str, int] = {}
+        self._trip_start = np.array([0])
+        self._trip_rows = np.array([], dtype=np.int64)
+        self._positions: Dict[int, np.ndarray] = {}
+        processor.realtime = self
+
+    def apply(self, updates: List[TripUpdate], full_dataset: bool = True) -> int:
+        #Übernimmt TripUpdates; Rückgabe: Anzahl Trips, deren Zeiten neu berechnet wurden
+        with self._lock:
+            start = time.perf_counter()
+            current = {} if full_dataset else dict(self.updates)
+            for update in updates:
+                current[(update.trip_id, update.start_date or self.service_date)] = update
+            changed = self._recalculate(current)
+            metrics.observe('realtime_apply_seconds', time.perf_counter() - start)
+            metrics.inc('realtime_updates_total', len(updates))
+            metrics.set_gauge('realtime_trips', len(self.updates))
+            return changed
+
+    def load_file(self, path: str) -> bool:
+        #Liest einen Feed aus einer Datei und übernimmt ihn (Fehler -> bisheriger Stand bleibt)
+        try:
+            updates, full_dataset = read_feed(path)
+            changed = self.apply(updates, full_dataset)
+            print(f"Echtzeitdaten übernommen: {len(updates)} Meldungen, {changed} Trips geändert")
+            return True
+        except Exception as e:
+            metrics.inc('realtime_errors_total')
+            print(f"Fehler beim Lesen der Echtzeitdaten ({path}): {e}")
+            return False
+
+    def rebase(self, service_date: Optional[date] = None) -> int:
+        #Nach einem Umbau des Graphen (z.B. GTFSProcessor.update_service_date um Mitternacht):
+        #Echtzeit-Stand für den neuen Tag aus dem neuen Sollfahrplan berechnen, veraltete Meldungen verwerfen
+        with self._lock:
+            self.service_date = service_date or date.today()
+            oldest = self.service_date - timedelta(days=1)
+            current = {key: update for key, update in self.updates.items() if key[1] >= oldest}
+            self.live = None
+            return self._recalculate(current)
+
+    def _recalculate(self, current: Dict[Tuple[str, date], TripUpdate]) -> int:
+        #Berechnet die Trips neu, deren Meldung sich gegenüber self.updates geändert hat
+        window = self.processor.window #Graph und Zeitfenster aus einem Stand (GTFSProcessor._activate)
+        base = window.connections
+        #Gleicher Betriebstag wie bei Anfragen für service_date (GTFSProcessor.connections_for vergleicht ihn)
+        day = self.processor.service_day(self.service_date, window) if base is not None else None
+        live = self.live
+        if live is None or live.base is not base or live.service_day != day:
+            #Erster Aufruf oder neuer Graph -> alle Meldungen auf den Sollfahrplan anwenden
+            previous = {}
+            live = self._start(window, day)
+        else:
+            previous = self.updates
+        if live is None:
+            self.updates, self.live = current, None #Meldungen bleiben für einen späteren rebase erhalten
+            return 0
+
+        changed = [key for key in set(previous) | set(current) if previous.get(key) != current.get(key)]
+        patches = [patch for patch in (self._trip_patch(base, live.service_day, key, current.get(key))
+                                       for key in changed) if patch is not None]
+        if not patches:
+            self.updates, self.live = current, live
+            return 0
+        rows = np.concatenate([patch[0] for patch in patches])
+        dep = np.concatenate([patch[1] for patch in patches])
+        arr = np.concatenate([patch[2] for patch in patches])
+        masks = np.concatenate([patch[3] for patch in patches])
+        to_stop = np.concatenate([patch[4] for patch in patches])
+        to_seq = np.concatenate([patch[5] for patch in patches])
+
+        connections = live.connections.patch(rows, dep, arr, masks, to_stop, to_seq)
+        patched = {mode: self._patch_index(self._positions[mode], index, connections, rows)
+                   for mode, index in live.connections_by_mode.items()}
+        self._positions = {mode: positions for mode, (_, positions) in patched.items()}
+        connections_by_mode = {mode: index for mode, (index, _) in patched.items()}
+        #Austausch in einem Schritt (Anfragen lesen processor.realtime.live ohne Lock)
+        version = next(_versions)
+        changes = (live.changes + ((version, np.unique(rows)),))[-self.CHANGE_LOG:]
+        self.updates = current
+        self.live = LiveTimetable(live.service_day, connections, connections_by_mode, base,
+                                  version, live.start_version, changes)
+        return len(patches)
+
+    def _start(self, window: ServiceWindow, day: int) -> Optional[LiveTimetable]:
+        #Ausgangsstand = Sollfahrplan; Verbindungen pro Trip und Index-Positionen einmal pro Graph vorberechnen
+        base, connections_by_mode = window.connections, window.connections_by_mode
+        if base is None:
+            return None #Noch kein Verbindungsgraph
+        #Verbindungen eines Trips: erst die des Trip-Tages (day_offset 0), dann die Kopien nach 24:00 (day_offset -1)
+        #jeweils in Haltestellenfolge (processor.connections ist nach Trip und stop_sequence sortiert)
+        keys = base.trip.astype(np.int64) * 2 + (base.day_offset < 0)
+        self._trip_rows = np.argsort(keys, kind='stable')
+        self._trip_start = np.searchsorted(keys[self._trip_rows], np.arange(len(base.trip_ids) * 2 + 1))
+        self._trip_index = {trip_id: i for i, trip_id in enumerate(base.trip_ids)}
+        self._positions = {}
+        for mode, index in connections_by_mode.items():
+            positions = np.full(len(base), -1, dtype=np.int64)
+            positions[index.rows] = np.arange(len(index.rows))
+            self._positions[mode] = positions
+        version = next(_versions)
+        return LiveTimetable(day, base, connections_by_mode, base, version, version,
+                             ((version, np.array([], dtype=np.int64)),))
+
+    def _trip_patch(self, base: ConnectionArrays, day: int, key: Tuple[str, date], update: Optional[TripUpdate]):
+        #Neue Werte für die Verbindungen eines Trips: (rows, dep, arr, service_mask, to_stop, to_seq)
+        #oder None (Trip nicht im Graphen)
+        #Ohne Meldung (update = None) gelten wieder die Sollzeiten
+        trip_id, start_date = key
+        overnight = (self.service_date - start_date).days #0 = Trip fährt am Tag des Overlays, 1 = am Vortag
+        trip = self._trip_index.get(trip_id)
+        if trip is None or overnight not in (0, 1):
+            return None
+        k = trip * 2 + overnight
+        rows = self._trip_rows[self._trip_start[k]:self._trip_start[k + 1]]
+        if len(rows) == 0:
+            return None
+        masks = base.service_mask[rows]
+        if update is None:
+            return rows, base.dep[rows], base.arr[rows], masks, base.to_stop[rows], base.to_seq[rows]
+
+        day_bit = np.uint64(1 << day)
+        if update.canceled:
+            return rows, base.dep[rows], base.arr[rows], masks & ~day_bit, base.to_stop[rows], base.to_seq[rows]
+        dep, arr, skipped = self._delayed_times(base, rows, update, start_date, overnight)
+        to_stop, to_seq = base.to_stop[rows], base.to_seq[rows]
+        if skipped.any():
+            arr, masks, to_stop, to_seq = self._skip_stops(base, rows, arr, masks, to_stop, to_seq, skipped, day_bit)
+        return rows, dep, arr, masks, to_stop, to_seq
+
+    @staticmethod
+    def _skip_stops(base: ConnectionArrays, rows: np.ndarray, arr: np.ndarray, masks: np.ndarray,
+                    to_stop: np.ndarray, to_seq: np.ndarray, skipped: np.ndarray, day_bit: np.uint64):
+        #Entfallene Halte (SKIPPED): Das Fahrzeug fährt durch, dort ist aber weder Ein- noch Ausstieg möglich
+        #-> Die Verbindung vor dem Halt wird bis zum nächsten bedienten Halt verlängert (A->B wird A->C mit der
+        #Ankunft in C), die Verbindungen ab entfallenen Halten fahren an diesem Tag nicht mehr
+        #Die Anzahl der Verbindungen bleibt gleich, es ändern sich nur Ziel, Ankunft und Betriebstage
+        #skipped: pro Ereignis (Abfahrt an Halt 0, Ankunft an Halt 1, Abfahrt an Halt 1, ...) aus _delayed_times
+        arr, masks, to_stop, to_seq = arr.copy(), masks.copy(), to_stop.copy(), to_seq.copy()
+        from_skipped, to_skipped = skipped[0::2], skipped[1::2]
+        #Folgeverbindung schließt an (gleiche Haltestelle, keine Lücke durch eine entfernte Verbindung)
+        chained = np.append(base.from_seq[rows[1:]] == base.to_seq[rows[:-1]], False)
+        for i in range(len(rows)):
+            if from_skipped[i]:
+                masks[i] &= ~day_bit
+            elif to_skipped[i]:
+                j = i
+                while to_skipped[j] and chained[j]:
+                    j += 1 #Verbindungen ab dem entfallenen Halt bis zum nächsten bedienten Halt
+                if to_skipped[j]:
+                    masks[i] &= ~day_bit #Kein bedienter Halt mehr (z.B. Endhalt entfällt)
+                else:
+                    arr[i], to_stop[i], to_seq[i] = arr[j], base.to_stop[rows[j]], base.to_seq[rows[j]]
+        return arr, masks, to_stop, to_seq
+
+    @staticmethod
+    def _delayed_times(base: ConnectionArrays, rows: np.ndarray, update: TripUpdate, start_date: date,
+                       overnight: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        #Ereignisse des Trips in Fahrtrichtung: Abfahrt an Halt 0, Ankunft an Halt 1, Abfahrt an Halt 1, ...
+        #Eine Verspätung gilt ab ihrem Halt für alle folgenden Halte bis zur nächsten Meldung (GTFS-Realtime)
+        #Halte vor der ersten Meldung behalten die Verspätung des ganzen Trips (update.delay, sonst 0)
+        n = len(rows) * 2
+        times = np.empty(n, dtype=np.int64)
+        times[0::2], times[1::2] = base.dep[rows], base.arr[rows]
+        sequences = np.empty(n, dtype=np.int64)
+        sequences[0::2], sequences[1::2] = base.from_seq[rows], base.to_seq[rows]
+        #Zeiten des Trips relativ zu Mitternacht seines Betriebstags (Kopien nach 24:00 liegen 24h früher)
+        schedule = times + overnight * 86400
+        midnight = _midnight(start_date)
+
+        by_sequence = {}
+        for stu in update.stop_time_updates:
+            sequence = stu.stop_sequence
+            if sequence is None and stu.stop_id is not None:
+                #Nur stop_id angegeben -> erster Halt des Trips mit dieser Haltestelle
+                stop = base.stop_index.get(stu.stop_id, -1)
+                matches = np.nonzero(np.concatenate([base.from_stop[rows[:1]], base.to_stop[rows]]) == stop)[0]
+                if len(matches):
+                    sequence = int(base.from_seq[rows[0]]) if matches[0] == 0 else int(base.to_seq[rows[matches[0] - 1]])
+            if sequence is not None:
+                by_sequence[sequence] = stu
+
+        def event_delay(stu: StopTimeUpdate, arrival: bool, e: int) -> Optional[int]:
+            first = (stu.arrival_time, stu.arrival_delay) if arrival else (stu.departure_time, stu.departure_delay)
+            second = (stu.departure_time, stu.departure_delay) if arrival else (stu.arrival_time, stu.arrival_delay)
+            for absolute, delay in (first, second): #Fehlt die Abfahrt, gilt die Verspätung der Ankunft (und umgekehrt)
+                if absolute is not None:
+                    return int(absolute - midnight - schedule[e])
+                if delay is not None:
+                    return delay
+            return None
+
+        delays = np.zeros(n, dtype=np.int64)
+        skipped_stop = np.zeros(n, dtype=bool)
+        carry = update.delay or 0
+        for e in range(n):
+            stu = by_sequence.get(int(sequences[e]))
+            if stu is not None:
+                if stu.schedule_relationship in ('NO_DATA', '2'):
+                    carry = 0 #Keine Prognose -> Sollzeit, auch für die folgenden Halte
+                elif stu.schedule_relationship in ('SKIPPED', '1'):
+                    skipped_stop[e] = True #Halt entfällt: dort weder Ein- noch Ausstieg (siehe _skip_stops)
+                else:
+                    delay = event_delay(stu, e % 2 == 1, e)
+                    if delay is not None:
+                        carry = delay
+            delays[e] = carry
+
+        #Ein Fahrzeug kann einen Halt nicht vor dem vorherigen erreichen (z.B. Abfahrt pünktlich, Ankunft früher)
+        times = np.maximum.accumulate(times + delays)
+        return times[0::2].astype(np.int32), times[1::2].astype(np.int32), skipped_stop
+
+    @staticmethod
+    def _patch_index(positions: np.ndarray, index: ModeIndex, connections: ConnectionArrays,
+                     rows: np.ndarray) -> Tuple[ModeIndex, np.ndarray]:
+        #Neue Abfahrtszeiten in den Index übernehmen: nur die geänderten Abfahrten werden sortiert und an ihrer
+        #neuen Stelle zwischen die unveränderten (bereits sortierten) Abfahrten eingefügt
+        #positions: Position jeder Verbindung im Index (-1 = nicht enthalten); Rückgabe mit den neuen Positionen
+        changed_rows = rows[positions[rows] >= 0] #Verbindungen anderer Verkehrsmittel fehlen im Index dieses Modus
+        keep = np.ones(len(index.rows), dtype=bool)
+        keep[positions[changed_rows]] = False
+        kept_rows = index.rows[keep]
+        kept_dep = index.departure_seconds[keep]
+        new_dep = connections.dep[changed_rows]
+
+        #Sortierschlüssel wie beim Aufbau (_build_mode_indexes): Haltestelle in den oberen 32 Bit, dann Abfahrt,
+        #bei Gleichstand die Position in connections
+        dep_min = min(int(kept_dep.min()) if len(kept_dep) else 0, int(new_dep.min()) if len(new_dep) else 0)
+        kept_keys = (connections.from_stop[kept_rows].astype(np.int64) << 32) | (kept_dep.astype(np.int64) - dep_min)
+        new_keys = (connections.from_stop[changed_rows].astype(np.int64) << 32) | (new_dep.astype(np.int64) - dep_min)
+        order = np.lexsort((changed_rows, new_keys))
+        changed_rows, new_keys = changed_rows[order], new_keys[order]
+        insert = np.searchsorted(kept_keys, new_keys, side='left')
+        ties = np.nonzero(np.searchsorted(kept_keys, new_keys, side='right') > insert)[0]
+        for i in ties.tolist(): #Gleiche Haltestelle und Abfahrt (selten) -> nach Position in connections einordnen
+            end = int(np.searchsorted(kept_keys, new_keys[i], side='right'))
+            insert[i] += int(np.searchsorted(kept_rows[insert[i]:end], changed_rows[i]))
+
+        #Zusammenführen: geänderte Abfahrt j landet hinter insert[j] unveränderten und j geänderten Abfahrten
+        target = insert + np.arange(len(insert))
+        placed = np.zeros(len(index.rows), dtype=bool)
+        placed[target] = True
+        index_rows = np.empty_like(index.rows)
+        departure_seconds = np.empty_like(index.departure_seconds)
+        service_masks = np.empty_like(index.service_masks)
+        index_rows[target], index_rows[~placed] = changed_rows, kept_rows
+        departure_seconds[target], departure_seconds[~placed] = connections.dep[changed_rows], kept_dep
+        service_masks[target], service_masks[~placed] = connections.service_mask[changed_rows], \
+            index.service_masks[keep]
+        positions = positions.copy()
+        positions[index_rows] = np.arange(len(index_rows))
+        return ModeIndex(index.stop_start, departure_seconds, index_rows, service_masks, connections), positions
@@ -1,13 +1,22 @@
 import heapq
-import itertools
-from datetime import datetime, timedelta, time
-from typing import List, Dict, Optional, Tuple, Set
+import numpy as np
+import pandas as pd
+from datetime import date, datetime, timedelta, time
+from typing import List, Dict, Optional, Tuple
 from dataclasses import dataclass
-from gtfs_processing import GTFSProcessor
 from gtfs_loader import GTFSLoader
 from address_processor import AddressProcessor
+from gtfs_processing import GTFSProcessor, ModeIndex, ServiceWindow
+from connection_arrays import ConnectionArrays
+from csa_routing import ConnectionScanRouter
+from raptor_routing import RaptorRouter
+from mcraptor_routing import McRaptorRouter
+from metrics import metrics
+from service_calendar import active_on_day
 from config import config
-counter = itertools.count()
+
+NO_ROUTE = -1   #Dijkstra: noch keine Linie benutzt (Start)
+WALK_ROUTE = -2 #Dijkstra: Fußweg (früher route_id 'WALK')
 
 @dataclass
 class RouteSegment:
@@ -35,18 +44,52 @@ class Journey:
     arrival_time: timedelta
     transfers: int
 
+@dataclass
+class Isochrone:
+    #Erreichbarkeit von einem Start aus (One-to-all), Zeiten in Sekunden nach Mitternacht, -1 = nicht erreichbar
+    departure_time: timedelta
+    stop_ids: List[str]
+    stop_arrivals: np.ndarray #Früheste Ankunft je Haltestelle (gleiche Reihenfolge wie stop_ids)
+    address_arrivals: Optional[np.ndarray] = None #Je Zeile der Adress-CSV (nur mit include_addresses=True)
+
+    def reachable_stops(self, max_duration: timedelta) -> List[str]:
+        #Alle Haltestellen, die innerhalb von max_duration erreicht werden
+        limit = (self.departure_time + max_duration).total_seconds()
+        return [self.stop_ids[i] for i in np.nonzero((self.stop_arrivals >= 0) & (self.stop_arrivals <= limit))[0]]
+
 class PublicTransportRouter:
+    ENGINES = ('dijkstra', 'csa', 'raptor') #Verfügbare Routing-Engines für find_routes
+
     def __init__(self, gtfs_loader: GTFSLoader, gtfs_processor: GTFSProcessor, address_processor: AddressProcessor):
         self.gtfs_loader = gtfs_loader
         self.gtfs_processor = gtfs_processor
         self.address_processor = address_processor
-
-    def find_routes(self, start_input: str, end_input: str, departure_time: timedelta, transport_mode: int = 2, max_routes: int = 1) -> List[Journey]:
-        print(f"Starte Routing von {start_input} nach {end_input} um {departure_time}")
+        self.csa = ConnectionScanRouter(gtfs_processor) #Fahrpläne werden erst bei der ersten CSA-Anfrage erstellt
+        self.raptor = RaptorRouter(gtfs_processor) #Linienmuster werden erst bei der ersten RAPTOR-Anfrage erstellt
+        self.mcraptor = McRaptorRouter(self.raptor) #Mehrkriterien-Suche auf denselben Linienmustern
+        self._address_links = None #(Adresse, Haltestellen-Zeile, Gehzeit) aller Paare im Fußweg-Radius, für Isochronen
+
+    def find_routes(self, start_input: str, end_input: str, departure_time: timedelta, transport_mode: int = 2, max_routes: int = 1,
+                    engine: Optional[str] = None, service_date: Optional[date] = None) -> List[Journey]:
+        #engine: 'dijkstra', 'csa' oder 'raptor' (Standard aus config.ROUTING_ENGINE)
+        #service_date: Betriebstag der Anfrage (Standard: heute), muss im Fahrplan-Zeitfenster liegen
+        engine = engine or config.ROUTING_ENGINE
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unbekannte Routing-Engine: {engine}")
+        service_date = service_date or date.today()
+        if config.DEBUG_OUTPUT:
+            print(f"Starte Routing von {start_input} nach {end_input} am {service_date} um {departure_time} (Engine: {engine})")
+        metrics.inc('routing_queries_total', engine=engine)
+        #Trips werden erst hier nach Betriebstag gefiltert (ein Aufbau für alle Tage im Zeitfenster)
+        #Tagesnummer und Verbindungen aus demselben Stand des Graphen (ein Tageswechsel kann parallel laufen)
+        graph = self.gtfs_processor.window
+        service_day = self.gtfs_processor.service_day(service_date, graph)
         
         start_stops, start_walking = self._resolve_location(start_input)
         end_stops, end_walking = self._resolve_location(end_input)
-        filtered_connections = self._filter_connections_by_mode(transport_mode)
+        #Vorab erstellter Index für den Modus (nur Dijkstra), CSA und RAPTOR haben eigene Fahrpläne pro Modus
+        connection_index = self.gtfs_processor.get_connection_index(transport_mode, service_day, graph) \
+            if engine == 'dijkstra' else None
         
         if not start_stops or not end_stops:
             return []
@@ -55,36 +98,207 @@ class PublicTransportRouter:
         if "marktplatz" in end_input.lower():
             end_stops.sort(key=lambda stop: 0 if "kaiserstraße" in stop['stop_name'].lower() else 1)
         
-        for start_stop in start_stops:
-            for end_stop in end_stops:                
-                journeys = self._dijkstra_routing(
-                    start_stop,
-                    end_stop,
-                    departure_time,
-                    filtered_connections,
-                    start_walking,
-                    end_walking
-                )
-                
-                if journeys:
-                    return journeys[:max_routes] # Nur die beste Route
-                #Fall bakc: versuche lockerere Zeitbeding.
-                for time_offset in [timedelta(minutes=-15), timedelta(minutes=15), timedelta(minutes=30)]:
-                    adjusted_time = departure_time + time_offset
-                    if adjusted_time.total_seconds() >= 0: #Keine neg Zeiten
-                        journeys = self._dijkstra_routing(
-                            start_stop, end_stop, adjusted_time, 
-                            filtered_connections, start_walking, end_walking
-                        )
-                        if journeys:
-                            return journeys[:max_routes]
-                #if journeys: # wenn kombi erfolgreich war, beende suche
-                #    break
-            #if journeys: # Wenn Start halte erfolgreich, beende suche
-            #    break
-                continue
-        return []   #Keine Route gefunden
+        #EINE Suche für alle Kombinationen: jede Start-Haltestelle startet zur Abfahrtszeit + Fußweg dorthin,
+        #jede Ziel-Haltestelle zählt mit ihrem Fußweg zum eigentlichen Ziel
+        #(ersetzt die Schleife über alle Start/Ziel-Paare mit zusätzlichen Versuchen -15/+15/+30 Minuten)
+        sources = {stop_id: departure_time + walk for stop_id, walk in self._access_times(start_stops).items()}
+        targets = self._access_times(end_stops)
+
+        with metrics.timer('routing_search_seconds', engine=engine):
+            journeys = self._route_pair(
+                engine,
+                sources,
+                targets,
+                departure_time,
+                transport_mode,
+                service_day,
+                graph,
+                connection_index,
+                start_walking,
+                end_walking
+            )
+        if not journeys:
+            metrics.inc('routing_queries_without_route_total', engine=engine)
+        return journeys[:max_routes]   #Leere Liste -> Keine Route gefunden
+
+    def find_profile(self, start_input: str, end_input: str, departure_time: timedelta, window: Optional[timedelta] = None,
+                     transport_mode: int = 2, service_date: Optional[date] = None) -> List[Journey]:
+        #Profil-Anfrage: alle sinnvollen Verbindungen mit Abfahrt zwischen departure_time und departure_time + window
+        #Sinnvoll = keine andere Verbindung fährt später ab, kommt früher an und braucht nicht mehr Fahrten
+        #Ein rRAPTOR-Lauf über das ganze Fenster statt einer Anfrage pro Abfahrtszeit (siehe raptor_routing.py)
+        window = window or timedelta(minutes=config.PROFILE_WINDOW_MINUTES)
+        service_date = service_date or date.today()
+        if config.DEBUG_OUTPUT:
+            print(f"Starte Profil-Anfrage von {start_input} nach {end_input} am {service_date} "
+                  f"zwischen {departure_time} und {departure_time + window}")
+        metrics.inc('routing_queries_total', engine='profile')
+        graph = self.gtfs_processor.window
+        service_day = self.gtfs_processor.service_day(service_date, graph)
+
+        start_stops, start_walking = self._resolve_location(start_input)
+        end_stops, end_walking = self._resolve_location(end_input)
+        if not start_stops or not end_stops:
+            return []
+
+        with metrics.timer('routing_search_seconds', engine='profile'):
+            results = self.raptor.profile(
+                self._access_times(start_stops), self._access_times(end_stops),
+                departure_time, departure_time + window, transport_mode, service_day=service_day, window=graph
+            )
+        journeys = []
+        for path, journey_departure, arrival_time, _ in results:
+            journey = self._build_journey(path, start_walking, end_walking, journey_departure, arrival_time)
+            if journey:
+                journeys.append(journey)
+        return journeys
+
+    def find_pareto_routes(self, start_input: str, end_input: str, departure_time: timedelta, transport_mode: int = 2,
+                           use_priority: bool = False, service_date: Optional[date] = None) -> List[Journey]:
+        #Alle Pareto-optimalen Routen über Ankunftszeit, Umstiege und Fußweg in Metern
+        #(use_priority: zusätzlich die Verkehrsmittel-Priorität, z.B. "nur Bahn" gegen "mit Bus")
+        #Keine Route ist in allen Kriterien schlechter als eine andere, früheste Ankunft zuerst
+        service_date = service_date or date.today()
+        if config.DEBUG_OUTPUT:
+            print(f"Starte Pareto-Suche von {start_input} nach {end_input} am {service_date} um {departure_time}")
+        metrics.inc('routing_queries_total', engine='pareto')
+        graph = self.gtfs_processor.window
+        service_day = self.gtfs_processor.service_day(service_date, graph)
 
+        start_stops, start_walking = self._resolve_location(start_input)
+        end_stops, end_walking = self._resolve_location(end_input)
+        if not start_stops or not end_stops:
+            return []
+
+        sources = {stop_id: (departure_time + walk, distance)
+                   for stop_id, (walk, distance) in self._access_walks(start_stops).items()}
+        with metrics.timer('routing_search_seconds', engine='pareto'):
+            results = self.mcraptor.route_many(
+                sources, self._access_walks(end_stops), transport_mode, use_priority=use_priority,
+                service_day=service_day, window=graph
+            )
+        journeys = []
+        for path, arrival_time, _, walking_distance, _ in results:
+            journey = self._build_journey(path, start_walking, end_walking, departure_time, arrival_time)
+            if journey:
+                #Inklusive der Fußwege zwischen Haltestellen (Kriterium der Suche)
+                journey.total_walking_distance = float(walking_distance)
+                journeys.append(journey)
+        return journeys
+
+    def find_reachable(self, start_input: str, departure_time: timedelta, max_duration: Optional[timedelta] = None,
+                       transport_mode: int = 2, include_addresses: bool = False,
+                       service_date: Optional[date] = None) -> Isochrone:
+        #Isochrone: früheste Ankunft an ALLEN Haltestellen (und optional allen Adressen) in EINER Suche
+        #z.B. "alles, was ab Marktplatz um 08:00 in 30 Minuten erreichbar ist"
+        #max_duration: spätere Ankünfte werden nicht weiter verfolgt und gelten als nicht erreichbar
+        service_date = service_date or date.today()
+        if config.DEBUG_OUTPUT:
+            print(f"Starte Erreichbarkeits-Suche ab {start_input} am {service_date} um {departure_time}")
+        metrics.inc('routing_queries_total', engine='isochrone')
+        graph = self.gtfs_processor.window
+        service_day = self.gtfs_processor.service_day(service_date, graph)
+        tt = self.raptor.get_timetable(transport_mode, service_day, graph)
+
+        start_stops, _ = self._resolve_location(start_input)
+        sources = {stop_id: departure_time + walk for stop_id, walk in self._access_times(start_stops).items()}
+        max_arrival = departure_time + max_duration if max_duration is not None else None
+        with metrics.timer('routing_search_seconds', engine='isochrone'):
+            arrival, _ = self.raptor.one_to_all(sources, transport_mode, service_day=service_day, max_arrival=max_arrival,
+                                                window=graph)
+        isochrone = Isochrone(departure_time, list(tt.stop_ids), arrival.astype(np.int32))
+
+        if include_addresses:
+            isochrone.address_arrivals = self._address_arrivals(tt.stop_index, arrival, max_arrival)
+        return isochrone
+
+    def _address_arrivals(self, stop_index: Dict[str, int], stop_arrivals: np.ndarray,
+                          max_arrival: Optional[timedelta]) -> np.ndarray:
+        #Adresse erreichbar = Haltestelle im Fußweg-Radius (MAX_WALKING_DISTANCE_M) erreicht + Gehzeit
+        #Die Paare Adresse/Haltestelle werden einmalig über den räumlichen Index bestimmt
+        addresses = self.address_processor.addresses_df
+        if addresses is None:
+            return np.array([], dtype=np.int32)
+        if self._address_links is None:
+            addresses_idx, stop_rows, distances = self.gtfs_loader.stop_index.query_radius_batch(
+                pd.to_numeric(addresses['lat'], errors='coerce').to_numpy(),
+                pd.to_numeric(addresses['lon'], errors='coerce').to_numpy(),
+                config.MAX_WALKING_DISTANCE_M
+            )
+            walk_seconds = np.round(distances / config.WALKING_SPEED_MS).astype(np.int64)
+            self._address_links = (addresses_idx, stop_rows, walk_seconds)
+        addresses_idx, stop_rows, walk_seconds = self._address_links
+
+        #Ankunft je Zeile in stops (Haltestellen ohne Fahrten im Fahrplan bleiben unerreichbar)
+        positions = np.array([stop_index.get(stop_id, -1) for stop_id in self.gtfs_loader.stops['stop_id'].tolist()],
+                             dtype=np.int64)
+        row_arrivals = np.where(positions >= 0, stop_arrivals[positions], -1)
+
+        link_arrivals = row_arrivals[stop_rows]
+        reached = link_arrivals >= 0
+        totals = link_arrivals[reached] + walk_seconds[reached]
+        if max_arrival is not None:
+            within = totals <= max_arrival.total_seconds()
+            totals, linked = totals[within], addresses_idx[reached][within]
+        else:
+            linked = addresses_idx[reached]
+        never = np.iinfo(np.int64).max
+        result = np.full(len(addresses), never, dtype=np.int64)
+        np.minimum.at(result, linked, totals)
+        result[result == never] = -1
+        return result.astype(np.int32)
+
+    def _access_times(self, stops: List[Dict]) -> Dict[str, timedelta]:
+        #Fußweg zwischen Adresse und Haltestelle (aus get_nearest_stops), 0 bei Haltestellen-Eingabe
+        #Die Reihenfolge der Haltestellen bleibt erhalten (entscheidet bei Gleichstand)
+        return {stop_id: walk for stop_id, (walk, _) in self._access_walks(stops).items()}
+
+    def _access_walks(self, stops: List[Dict]) -> Dict[str, Tuple[timedelta, float]]:
+        #Wie _access_times, zusätzlich mit der Fußwegdistanz in Metern
+        walks = {}
+        for stop in stops:
+            walk = timedelta(seconds=round(stop.get('walking_time', 0) or 0))
+            if stop['stop_id'] not in walks or walk < walks[stop['stop_id']][0]:
+                walks[stop['stop_id']] = (walk, float(stop.get('walking_distance', 0) or 0))
+        return walks
+
+    def _route_pair(self, engine: str, sources: Dict[str, timedelta], targets: Dict[str, timedelta], departure_time: timedelta,
+                    transport_mode: int, service_day: int, window: ServiceWindow, connection_index: Optional[ModeIndex],
+                    start_walking: Optional[Dict], end_walking: Optional[Dict]) -> List[Journey]:
+        #Sucht Routen zwischen allen Start- und Zielhaltestellen mit der gewählten Engine (eine Suche)
+        #sources: stop_id -> früheste Abfahrt dort, targets: stop_id -> Fußweg zum Ziel
+        #window: Stand des Graphen, aus dem service_day berechnet wurde
+        if engine == 'csa':
+            return self._csa_routing(sources, targets, departure_time, transport_mode, service_day, window,
+                                     start_walking, end_walking)
+        if engine == 'raptor':
+            return self._raptor_routing(sources, targets, departure_time, transport_mode, service_day, window,
+                                        start_walking, end_walking)
+        return self._dijkstra_routing(sources, targets, departure_time, service_day,
+                                      connection_index, start_walking, end_walking)
+
+    def _csa_routing(self, sources: Dict[str, timedelta], targets: Dict[str, timedelta], departure_time: timedelta, transport_mode: int,
+                     service_day: int, window: ServiceWindow, start_walking: Optional[Dict],
+                     end_walking: Optional[Dict]) -> List[Journey]:
+        #Connection Scan Algorithm: exakte früheste Ankunft ohne Iterationslimit (siehe csa_routing.py)
+        result = self.csa.route_many(sources, targets, transport_mode, service_day=service_day, window=window)
+        if result is None:
+            return []
+        path, _, arrival_time = result
+        journey = self._build_journey(path, start_walking, end_walking, departure_time, arrival_time)
+        return [journey] if journey else []
+
+    def _raptor_routing(self, sources: Dict[str, timedelta], targets: Dict[str, timedelta], departure_time: timedelta, transport_mode: int,
+                        service_day: int, window: ServiceWindow, start_walking: Optional[Dict],
+                        end_walking: Optional[Dict]) -> List[Journey]:
+        #RAPTOR: eine Route pro Umstiegsanzahl, die schneller ist als alle Routen mit weniger Umstiegen
+        #(siehe raptor_routing.py); früheste Ankunft zuerst
+        journeys = []
+        for path, _, _, arrival_time in self.raptor.route_many(sources, targets, transport_mode,
+                                                                service_day=service_day, window=window):
+            journey = self._build_journey(path, start_walking, end_walking, departure_time, arrival_time)
+            if journey:
+                journeys.append(journey)
+        return journeys
 
     def _format_time(self, td: timedelta) -> str:
         """Hilfsfunktion für Zeitformatierung"""
@@ -95,41 +309,51 @@ class PublicTransportRouter:
 
 
     def _resolve_location(self, location_input: str) -> Tuple[List[Dict], Optional[Dict]]:
-        #Löst Eingabe zu Haltestellen oder Adressen auf
-        if __debug__:
+        #Löst Eingabe zu Haltestellen oder Adressen auf (Laufzeit und Ergebnisart als Metrik, siehe metrics.py)
+        with metrics.timer('routing_resolve_seconds'):
+            stops, walking_info = self._lookup_location(location_input)
+        metrics.inc('routing_resolve_total', kind='address' if walking_info else ('stop' if stops else 'none'))
+        return stops, walking_info
+
+    def _lookup_location(self, location_input: str) -> Tuple[List[Dict], Optional[Dict]]:
+        if config.DEBUG_OUTPUT:
             #DEBUGGING
             print(f"Löse auf: '{location_input}'")
         
         #Versuche zuerst als Haltestelle       
         stops = self.gtfs_loader.get_stops_by_name(location_input)
-        print(f"Gefundene Haltestellen für '{location_input}': {[s['stop_name'] for s in stops[:3]]}")
+        if config.DEBUG_OUTPUT:
+            print(f"Gefundene Haltestellen für '{location_input}': {[s['stop_name'] for s in stops[:3]]}")
         
         if stops:
             # Sammelt alle relevanten Haltestellen IDs (inkl CHild Stops)
+            # Begrenzt wird nur die Anzahl der Stationen, nicht die Anzahl der Gleise/Bahnsteige einer Station
+            # (die Suche behandelt eine Station mit allen Gleisen als einen Start bzw. ein Ziel)
             all_stops = []
             seen = set()
-            def _add(s):
-                if s['stop_id'] not in seen and len(all_stops) < 5: #Maximal 5 stops
-                    seen.add(s['stop_id'])
-                    all_stops.append(s)
-            for stop in stops[:3]: #Nur erste 3 gef. stops
-                _add(stop)
-                child_ids = self.gtfs_loader.get_all_child_stop_ids(stop['stop_id'])
-                for child_id in child_ids[:3]: # auch hier nur die ersten 3
-                    if child_id != stop['stop_id']:
-                        child_stop = self.gtfs_loader.stops[self.gtfs_loader.stops['stop_id'] == child_id]
-                        if not child_stop.empty:
-                            _add(child_stop.iloc[0].to_dict())
+            stations = set()
+            for stop in stops:
+                station = self.gtfs_loader.get_station_key(stop['stop_id'])
+                if station not in stations:
+                    if len(stations) >= config.MAX_STATIONS_PER_LOCATION:
+                        continue
+                    stations.add(station)
+                for station_stop_id in self.gtfs_loader.get_station_stop_ids(stop['stop_id']):
+                    if station_stop_id not in seen:
+                        station_stop = self.gtfs_loader.get_stop(station_stop_id)
+                        if station_stop is not None:
+                            seen.add(station_stop_id)
+                            all_stops.append(station_stop)
 
             # Filtert nur Stops, die im Verbindungsindex vorkommen
-            valid_stops = [s for s in all_stops if s['stop_id'] in self.gtfs_processor.connections_by_stop]
+            valid_stops = [s for s in all_stops if self.gtfs_processor.has_connections(s['stop_id'])]
             if not valid_stops:
                 valid_stops = all_stops[:1]  # Fallback, falls kein gültiger gefunden wurde
             return valid_stops, None
 
 
         #Versuche als Adresse
-        addresses = self.address_processor.find_address(location_input)
+        addresses = self.address_processor.find_address(location_input, limit=1) #Nur die beste Adresse wird verwendet
         if not addresses:
             return [], None
         
@@ -142,72 +366,92 @@ class PublicTransportRouter:
         }
         return nearby_stops, walking_info
     
-    def _filter_connections_by_mode(self, transport_mode: int) -> List[Dict]:
-        #Filtert Verbindungen nach Verkehrsmittel-Modus
-        #DEBUGGING: Zeige Route-Typen im System
-        route_types = set()
-        for conn in self.gtfs_processor.connections:
-            route_types.add(conn['route_type'])
-        print(f"Gefundene Route-Typen im System: {sorted(route_types)}")
-
-        if transport_mode == 1: #Nur Bahn
-            allowed_types = ['rail', 'subway', 'tram']
-            filtered = [conn for conn in self.gtfs_processor.connections 
-                if config.GTFS_ROUTE_TYPES.get(conn['route_type'], 'bus') in allowed_types]    
-            print(f"Nach Bahn-Filter: {len(filtered)} von {len(self.gtfs_processor.connections)}")
-            return filtered
-        else: #Bus und Bahn
-            return self.gtfs_processor.connections
-        
-    def _dijkstra_routing(self, start_stop: Dict, end_stop: Dict, departure_time: timedelta,
-                        connections: List[Dict], start_walking: Optional[Dict], 
+    def _dijkstra_routing(self, sources: Dict[str, timedelta], targets: Dict[str, timedelta], departure_time: timedelta, service_day: int,
+                        mode_index: ModeIndex, start_walking: Optional[Dict], 
                         end_walking: Optional[Dict]) -> List[Journey]:
         # Konzept -> Dikstra - Algorithmus für öffentliche Verkerhsmittel
         #Statt Entfernung minimieren wird in diesem Algorithmus Zeit + Anzahl Umstiege minimiert
         # Dieser Algorithmus findet die besten Routen zwischen Start und Ziel
 
-        import itertools
-        counter = itertools.count() # Eindeutige IDs für Heap-Einträge
-
-        #Verbindungen nach Haltestelle indexieren
-        connections_by_stop = {}
-    
-        for conn in connections:
-            stop_id = conn['from_stop_id']
-            connections_by_stop.setdefault(stop_id, []).append(conn)                
+        #mode_index: vorab erstellter Index des Modus (GTFSProcessor.get_connection_index)
+        #Pro Haltestelle sind die Abfahrten nach Zeit sortiert -> Binärsuche findet die erste nutzbare Abfahrt,
+        #danach wird nur ein begrenztes Zeitfenster (config.MAX_WAIT_SECONDS) durchsucht
+        #Gerechnet wird auf den Arrays in mode_index.connections: Haltestellen und Linien als Integer,
+        #Zeiten in Sekunden; Dictionaries entstehen nur für die Verbindungen gefundener Routen
+        #(Index und Verbindungen gehören zum selben Stand, auch wenn währenddessen Echtzeitdaten eintreffen)
+        conns = mode_index.connections
+        max_wait = config.MAX_WAIT_SECONDS
+        transfer_time = config.TRANSFER_TIME_SECONDS
+        day = np.uint64(service_day) #Nur Abfahrten, deren Betriebstage-Maske dieses Bit enthält
+        departure = int(departure_time.total_seconds())
+        stop_start, index_dep, index_rows, index_masks = (
+            mode_index.stop_start, mode_index.departure_seconds, mode_index.rows, mode_index.service_masks
+        )
+        fp_start, fp_to, fp_time = conns.footpath_start, conns.footpath_to, conns.footpath_time
+        conn_arr, conn_to, conn_route = conns.arr, conns.to_stop, conns.route
+        target_walks = {conns.stop_index[stop_id]: int(walk.total_seconds())
+                        for stop_id, walk in targets.items() if stop_id in conns.stop_index}
 
         max_iterations = 10000 #Iterationen begrenzen, für besser Performance auch auf langsameren Geräten
         # max_iterations wurde auf 10.000 gestellt vorher 5000
         iteration_count = 0
 
-        #Priority Queue: (Ankunftszeit, Transfers, Counter, Haltestelle, Route, Pfad)
-        pq = [(departure_time, 0, next(counter), start_stop['stop_id'], None, [])]
-        visited = {start_stop['stop_id']: departure_time}  # Speichert beste Ankunftszeit pro Haltestelle
+        #Labels statt Pfad-Kopien: jedes Label speichert nur (Vorgänger-Label, Verbindung, Abfahrt)
+        #Verbindung >= 0: Position in conns, < 0: Fußweg -(k + 1)
+        #Der Pfad wird erst für gefundene Routen rückwärts über die Vorgänger aufgebaut (_reconstruct_path)
+        #-> Ein Heap-Push kostet konstant viel Speicher statt der Länge des bisherigen Pfades
+        labels = [(-1, 0, 0)] #Label 0 = Start ohne Verbindung
+
+        #Priority Queue: (Priorität, Transfers, Label-Index, Ankunftszeit, Haltestelle, Linie) - Zeiten in Sekunden
+        #Priorität = Reisezeit + Umstiegspenalty, die Ankunftszeit wird getrennt davon mitgeführt
+        #Der Label-Index ist eindeutig und aufsteigend und ersetzt den Counter für Gleichstände
+        #Alle Starthaltestellen starten mit demselben Start-Label, jeweils zur Abfahrtszeit + Fußweg dorthin
+        pq = []
+        for stop_id, start_time in sources.items():
+            stop = conns.stop_index.get(stop_id)
+            if stop is not None:
+                start_seconds = int(start_time.total_seconds())
+                pq.append((start_seconds - departure, 0, 0, start_seconds, stop, NO_ROUTE))
+        heapq.heapify(pq)
+        visited = {}  # Speichert beste Ankunftszeit pro Haltestelle
         best_routes = [] #Gefundene komplette Route
+        best_arrival = None #Früheste Ankunft am Ziel inkl. Fußweg
+        #Die Priorität ist höchstens um die maximale Umstiegspenalty größer als die Reisezeit
+        #-> sobald Priorität - Penalty die beste Reisezeit erreicht, kann kein Label das Ziel früher erreichen
+        max_penalty = config.MAX_TRANSFERS * 60
 
-        if __debug__:
-            print(f"Starte Umstiegs-Suche von {start_stop['stop_id']} nach {end_stop['stop_id']}")
-            print(f"Verfügbar ab {start_stop['stop_id']}: {len(connections_by_stop.get(start_stop['stop_id'], []))} Verbindungen")
+        if config.DEBUG_OUTPUT:
+            print(f"Starte Umstiegs-Suche von {list(sources)} nach {list(targets)}")
+            print(f"Verfügbar ab Start: {sum(mode_index.departures_of(entry[4]) for entry in pq)} Verbindungen")
 
         # Suche bis zu 3 beste Routen unter der Bedingung, dass der itertaions count kleiner als die maximalen iterationen bleiben
         while pq and len(best_routes) < 3 and iteration_count < max_iterations:
             iteration_count += 1 # Iteration zählt hoch bis max_iteration
             
             # Holt Element mit frühester Ankunftszeit und wenigsten Umstiegen
-            current_time, transfers, _, current_stop, last_route, path = heapq.heappop(pq)
+            priority, transfers, label, current_time, current_stop, last_route = heapq.heappop(pq)
+            if best_arrival is not None and priority - max_penalty >= best_arrival - departure:
+                break #Das beste Ziel kann nicht mehr verbessert werden
             
             #Ziel erreicht? -> Route wird sofort gespeichert
             # INFORMATION für mich: Kritischer Fehler hier gefunden:
             # Journey wurde im else-Block nicht im if Block gebaut --> heißt die Journey wurde dann erstellt wenn das Ziel NICHT erreicht wurde
             # Ziel prüfungsblock wurde geändert!
-            if current_stop == end_stop['stop_id']:
-                print(f" Ziel erreicht nach {transfers} Umstiegen um {current_time}")
-
-                journey = self._build_journey(path, start_walking, end_walking, departure_time, current_time)
+            if current_stop in target_walks:
+                arrival_time = current_time + target_walks[current_stop] #inkl. Fußweg zum eigentlichen Ziel
+                if config.DEBUG_OUTPUT:
+                    print(f" Ziel erreicht nach {transfers} Umstiegen um {timedelta(seconds=arrival_time)}")
+
+                path = self._reconstruct_path(conns, labels, label)
+                journey = self._build_journey(path, start_walking, end_walking, departure_time,
+                                              timedelta(seconds=arrival_time))
                 if journey:
                     best_routes.append(journey)
-                    print(f"Route {len(best_routes)} gespeichert")
-                continue
+                    if best_arrival is None or arrival_time < best_arrival:
+                        best_arrival = arrival_time
+                    if config.DEBUG_OUTPUT:
+                        print(f"Route {len(best_routes)} gespeichert")
+                #Kein continue: von hier aus kann noch eine andere Zielhaltestelle (mit kürzerem Fußweg) erreicht werden
 
             #Prüfe ob bereits bessere Zeit für diese Haltestelle existiert
             if current_stop in visited and visited[current_stop] <= current_time:
@@ -215,85 +459,117 @@ class PublicTransportRouter:
             visited[current_stop] = current_time
             
             #Zu viele Umstiege vermeiden
-            if transfers >= 3:
-                continue #Überspringe Routen mit mehr als 3 Umstiegen (Änderbar)
+            if transfers >= config.MAX_TRANSFERS:
+                continue #Überspringe Routen mit mehr als 3 Umstiegen (Änderbar in config.py)
             
-            #Verbindungen von aktueller Haltestelle
-            if current_stop in connections_by_stop:
-                valid_connections = []
-                for connection in connections_by_stop[current_stop]:
-                    #Nur Verbindungen nach aktueller Zeit
-                    if connection['route_id'] == 'WALK':
-                        # Fußwege: arrival_time ist die Gehzeit, departure_time wird auf current_time gesetzt
-                        connection = dict(connection)  # Kopie erstellen
-                        walking_time = connection['arrival_time']  # Gehzeit in timedelta
-                        connection['departure_time'] = current_time
-                        connection['arrival_time'] = current_time + walking_time
-                    elif connection['departure_time'] < current_time:
+            #Verbindungen von aktueller Haltestelle: (Verbindung, Abfahrt, Ankunft, Ziel-Haltestelle, Linie)
+            #Fußwege: Abfahrt = aktuelle Zeit, Ankunft = aktuelle Zeit + Gehzeit
+            #Kein Fußweg direkt nach einem Fußweg (wie CSA und RAPTOR, die Fußwege decken den Radius schon ab)
+            fp_lo, fp_hi = int(fp_start[current_stop]), int(fp_start[current_stop + 1])
+            if labels[label][1] < 0:
+                fp_hi = fp_lo
+            valid_connections = [
+                (-(k + 1), current_time, current_time + walk, to_stop, WALK_ROUTE)
+                for k, to_stop, walk in zip(range(fp_lo, fp_hi), fp_to[fp_lo:fp_hi].tolist(), fp_time[fp_lo:fp_hi].tolist())
+            ]
+
+            #Nur Verbindungen nach aktueller Zeit: erste nutzbare Abfahrt per Binärsuche, dann begrenztes Fenster
+            lo, hi = int(stop_start[current_stop]), int(stop_start[current_stop + 1])
+            if lo < hi:
+                first = lo + int(np.searchsorted(index_dep[lo:hi], current_time, side='left'))
+                last = first + int(np.searchsorted(index_dep[first:hi], current_time + max_wait, side='right'))
+                active = active_on_day(index_masks[first:last], day)
+                rows = index_rows[first:last][active]
+                valid_connections.extend(zip(
+                    rows.tolist(), index_dep[first:last][active].tolist(),
+                    conn_arr[rows].tolist(), conn_to[rows].tolist(), conn_route[rows].tolist()
+                ))
+
+            candidates = []
+            for connection in valid_connections:
+                route = connection[4]
+                if route == WALK_ROUTE:
+                    #Fußweg ist kein Umstieg: weder Puffer noch Zählung (erst das nächste Einsteigen zählt)
+                    #Fußweg ab Start -> weiterhin NO_ROUTE, das erste Einsteigen ist dann kein Umstieg
+                    new_route = NO_ROUTE if last_route == NO_ROUTE else WALK_ROUTE
+                    new_transfers = transfers
+                elif last_route == WALK_ROUTE:
+                    #Einsteigen nach Fußweg: Umstieg, der Fußweg ersetzt den Puffer (wie bei CSA und RAPTOR)
+                    new_route = route
+                    new_transfers = transfers + 1
+                elif last_route != NO_ROUTE and last_route != route:
+                    # Umstieg -> 2 Minuten Puffer
+                    wait_time = connection[1] - current_time
+                    if wait_time < transfer_time:  # aus config (variable)
                         continue
-                    
-                    #Umstiegszeit prüfen
-                    if last_route and last_route != connection['route_id']:                      
-                        # Umstieg -> 2 Minuten Puffer
-                        wait_time = connection['departure_time'] - current_time
-                        if wait_time < timedelta(seconds=config.TRANSFER_TIME_SECONDS):  # aus config (variable)
-                            continue
-                        new_transfers = transfers + 1 # Umstiege zählen
-                    else:
-                        new_transfers = transfers
-
-                    valid_connections.append((connection, new_transfers))
-                if __debug__ and iteration_count % 1000 == 0:
-                    #DEBUGGING: für verfügbare Verbindungen
-                    print(f"Iteration {iteration_count}: {current_stop}")
-                
-                for connection, new_transfers in valid_connections:
-                    new_time = connection['arrival_time']
-                    dep_time = connection['departure_time']
-
-                    '''#Zeitvalidierung
-                    if transfers == 0:
-                        # Erstes Segment: Abfahrt nach gewünschter Startzeit
-                        if dep_time < departure_time:
-                            continue
-                    else:
-                        # Umstieg: Abfahrt nach Ankunft am Umsteigepunkt + Mindestumstiegszeit
-                        if dep_time < current_time + timedelta(seconds=config.TRANSFER_TIME_SECONDS):
-                            continue'''
-
-                    if connection['route_id'] == 'WALK':
-                        #Fußwege -> nur prüfen dass ankunft nach abfahrt liegt
-                        if new_time <= current_time:
-                            continue
-                    else:
-                        # Segment muss in sich valide sein
-                        if new_time <= dep_time:
-                            continue
-
-                    # Neue Route zum Heap hinzufügen
-                    new_path = path + [connection]
-
-                    # Nur hinzufügen wenn Ziel noch nicht erreicht oder bessere Route
-                    if (connection['to_stop_id'] not in visited or
-                        visited.get(connection['to_stop_id'], timedelta.max) > new_time):
-
-                        # Prioritätsberechnung
-                        total_travel_time = new_time - departure_time
-                        if total_travel_time.total_seconds() <= 0:
-                            continue    #Zeitreisen verhindern
-
-                        priority = total_travel_time + timedelta(minutes=new_transfers * 1)
-
-                        heapq.heappush(pq, (
-                            priority, new_transfers, next(counter),
-                            connection['to_stop_id'], connection['route_id'], new_path
-                        ))
-                    #if __debug__:
-                    #    print(f"Iteration {iteration_count}, PQ-Länge: {len(pq)}")
+                    new_route = route
+                    new_transfers = transfers + 1 # Umstiege zählen
+                else:
+                    new_route = route
+                    new_transfers = transfers
+
+                candidates.append((connection, new_transfers, new_route))
+            if config.DEBUG_OUTPUT and iteration_count % 1000 == 0:
+                #DEBUGGING: für verfügbare Verbindungen
+                print(f"Iteration {iteration_count}: {conns.stop_ids[current_stop]}")
+            
+            for (ref, dep_time, new_time, to_stop, route), new_transfers, new_route in candidates:
+                if route == WALK_ROUTE:
+                    #Fußwege -> nur prüfen dass ankunft nach abfahrt liegt
+                    if new_time <= current_time:
+                        continue
+                else:
+                    # Segment muss in sich valide sein
+                    if new_time <= dep_time:
+                        continue
+
+                # Neue Route zum Heap hinzufügen
+                # Nur hinzufügen wenn Ziel noch nicht erreicht oder bessere Route
+                if to_stop not in visited or visited[to_stop] > new_time:
+
+                    # Prioritätsberechnung
+                    total_travel_time = new_time - departure
+                    if total_travel_time <= 0:
+                        continue    #Zeitreisen verhindern
 
+                    priority = total_travel_time + new_transfers * 60
+
+                    labels.append((label, ref, dep_time))
+                    heapq.heappush(pq, (
+                        priority, new_transfers, len(labels) - 1, new_time, to_stop, new_route
+                    ))
+
+        metrics.inc('dijkstra_iterations_total', iteration_count)
+        if iteration_count >= max_iterations:
+            metrics.inc('dijkstra_iteration_limit_total')
+        if config.DEBUG_OUTPUT:
             print(f"Suche beendet nach {iteration_count} Iterationen")
             print(f"Gefundene Routen: {len(best_routes)}")
-            return best_routes
+        best_routes.sort(key=lambda journey: journey.arrival_time) #Früheste Ankunft am Ziel zuerst
+        return best_routes
+
+    def _reconstruct_path(self, conns: ConnectionArrays, labels: List[Tuple[int, int, int]], label: int) -> List[Dict]:
+        #Folgt den Vorgänger-Zeigern vom Ziel-Label bis zum Start und liefert die Verbindungen in Fahrtrichtung
+        #Erst hier werden aus den Array-Positionen Verbindungs-Dictionaries (mit Text-IDs und timedelta)
+        path = []
+        while label > 0:
+            label, ref, departure = labels[label]
+            if ref >= 0:
+                path.append(conns.record(ref))
+                continue
+            #Fußweg k: Start-Haltestelle ist die, in deren Bereich [footpath_start[s], footpath_start[s+1]) k liegt
+            k = -ref - 1
+            from_stop = int(np.searchsorted(conns.footpath_start, k, side='right')) - 1
+            walk_time = int(conns.footpath_time[k])
+            walk = self.gtfs_processor._walking_connection(
+                conns.stop_ids[from_stop], conns.stop_ids[conns.footpath_to[k]],
+                float(conns.footpath_distance[k]), walk_time
+            )
+            walk['departure_time'] = timedelta(seconds=departure)
+            walk['arrival_time'] = timedelta(seconds=departure + walk_time)
+            path.append(walk)
+        path.reverse()
+        return path
 
     def _build_journey(self, connections: List[Dict], start_walking: Optional[Dict], 
                         end_walking: Optional[Dict], departure_time: timedelta, 
@@ -349,34 +625,18 @@ class PublicTransportRouter:
                 current_route = None
                 route_connections = []
                 
-                for i, connection in enumerate(connections_sorted):
-                    if (connection['route_id'] != current_route or i == len(connections_sorted) - 1):
-                        if current_route is not None and route_connections:
-                            # Vorherige Route abschließen
-                            first_conn = route_connections[0]
-                            last_conn = route_connections[-1]
-                            from_stop = self._get_stop_info(first_conn['from_stop_id'])
-                            to_stop = self._get_stop_info(last_conn['to_stop_id'])
-                            
-                            segments.append(RouteSegment(
-                                mode='transit',
-                                from_stop=from_stop['stop_id'],
-                                to_stop=to_stop['stop_id'],
-                                from_stop_name=from_stop['stop_name'],
-                                to_stop_name=to_stop['stop_name'],
-                                departure_time=first_conn['departure_time'],
-                                arrival_time=last_conn['arrival_time'],
-                                route_name=first_conn['route_short_name'] or first_conn['route_long_name'],
-                                route_direction=first_conn['headsign'],
-                                priority=first_conn['priority']
-                            ))
-                        
-                        # Neue Route starten
-                        current_route = connection['route_id']
-                        route_connections = [connection]
-                    else:
-                        # Füge Verbindung zur aktuellen Route hinzu
-                        route_connections.append(connection)
+                for connection in connections_sorted:
+                    if connection['route_id'] != current_route and route_connections:
+                        # Vorherige Route abschließen
+                        segments.append(self._build_transit_segment(route_connections))
+                        route_connections = []
+                    # Neue Route starten bzw. Verbindung zur aktuellen Route hinzufügen
+                    current_route = connection['route_id']
+                    route_connections.append(connection)
+
+                # Letzte Route abschließen (wurde vorher nicht mehr als Segment übernommen)
+                if route_connections:
+                    segments.append(self._build_transit_segment(route_connections))
 
             # End-Fußweg hinzufügen
             if end_walking:
@@ -411,11 +671,31 @@ class PublicTransportRouter:
                 transfers=max(0, transfers)
             )    
 
+    def _build_transit_segment(self, route_connections: List[Dict]) -> RouteSegment:
+        """Fasst aufeinanderfolgende Verbindungen derselben Linie zu einem Segment zusammen"""
+        first_conn = route_connections[0]
+        last_conn = route_connections[-1]
+        from_stop = self._get_stop_info(first_conn['from_stop_id'])
+        to_stop = self._get_stop_info(last_conn['to_stop_id'])
+
+        return RouteSegment(
+            mode='transit',
+            from_stop=from_stop['stop_id'],
+            to_stop=to_stop['stop_id'],
+            from_stop_name=from_stop['stop_name'],
+            to_stop_name=to_stop['stop_name'],
+            departure_time=first_conn['departure_time'],
+            arrival_time=last_conn['arrival_time'],
+            route_name=first_conn['route_short_name'] or first_conn['route_long_name'],
+            route_direction=first_conn['headsign'],
+            priority=first_conn['priority']
+        )
+
     def _get_stop_info(self, stop_id: str) -> Dict:
         """Holt Stop-Informationen aus dem GTFS-Loader"""
-        stop_data = self.gtfs_loader.stops[self.gtfs_loader.stops['stop_id'] == stop_id]
-        if not stop_data.empty:
-            return stop_data.iloc[0].to_dict()
+        stop_data = self.gtfs_loader.get_stop(stop_id)
+        if stop_data is not None:
+            return stop_data
         return {
             'stop_id': stop_id,
             'stop_name': self.gtfs_loader.get_stop_name(stop_id),
@@ -0,0 +1,281 @@
+import asyncio
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+from routing import PublicTransportRouter, Journey
+from metrics import metrics
+from realtime import RealtimeOverlay
+from config import config
+
+#Lang laufender HTTP/JSON-Dienst: der Fahrplan wird EINMAL geladen und von allen Anfragen geteilt
+#(bisher brauchte jeder Nutzer einen eigenen Prozess mit der input()-Schleife aus main.py)
+#Nur Standardbibliothek: asyncio-Server mit minimalem HTTP/1.1 (eine Anfrage pro Verbindung)
+#
+#Endpunkte (GET mit Query-Parametern oder POST mit JSON-Body):
+#  /route      from, to, time (HH:MM[:SS], Standard: jetzt), mode (1/2), engine, date (YYYY-MM-DD), max_routes
+#  /stops      name
+#  /addresses  q, limit
+#  /health
+#  /metrics    Messwerte als Text (nur mit config.METRICS_ENABLED, siehe metrics.py)
+#
+#Mit config.REALTIME_FEED_PATH werden Verspätungen aus einer lokalen GTFS-Realtime-Datei übernommen (realtime.py):
+#die Datei wird alle config.REALTIME_POLL_SECONDS geprüft, neue Zeiten gelten ab der nächsten Anfrage
+
+
+def _parse_time(value: Optional[str]) -> timedelta:
+    #HH:MM oder HH:MM:SS -> timedelta (wie die Eingabe in main.py), leer = aktuelle Uhrzeit
+    if not value:
+        now = datetime.now()
+        return timedelta(hours=now.hour, minutes=now.minute, seconds=now.second)
+    parts = value.split(':')
+    if len(parts) not in (2, 3):
+        raise ValueError(f"Ungültiges Zeitformat: {value}")
+    hours, minutes, seconds = (int(part) for part in parts + ['0'] * (3 - len(parts)))
+    if not (0 <= hours <= 23 and 0 <= minutes <= 59 and 0 <= seconds <= 59):
+        raise ValueError(f"Ungültige Zeit: {value}")
+    return timedelta(hours=hours, minutes=minutes, seconds=seconds)
+
+
+def _format_time(td: timedelta) -> str:
+    total_seconds = int(td.total_seconds())
+    return f"{total_seconds // 3600:02d}:{(total_seconds % 3600) // 60:02d}:{total_seconds % 60:02d}"
+
+
+def _to_json(value: Any) -> Any:
+    #timedelta -> "HH:MM:SS", NaN -> None, NumPy-Zahlen -> Python-Zahlen
+    if isinstance(value, timedelta):
+        return _format_time(value)
+    if isinstance(value, dict):
+        return {str(key): _to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(item) for item in value]
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if hasattr(value, 'item') and not isinstance(value, (str, bytes)):
+        return _to_json(value.item())
+    return value
+
+
+def journey_to_dict(journey: Journey) -> Dict:
+    #Journey (inkl. Segmente) als JSON-taugliches Dictionary
+    return _to_json(asdict(journey))
+
+
+class RoutingService:
+    #Verteilt Anfragen auf einen Thread-Pool, damit die Event-Loop nie durch Routing blockiert wird
+    #Gleiche Anfragen, die gleichzeitig laufen, werden zu EINER Berechnung zusammengefasst
+    #(alle Wartenden bekommen dasselbe Ergebnis)
+
+    def __init__(self, router: PublicTransportRouter, workers: Optional[int] = None):
+        self.router = router
+        self.executor = ThreadPoolExecutor(max_workers=workers or config.SERVICE_WORKERS)
+        self._in_flight: Dict[Tuple, asyncio.Future] = {} #Anfrage-Schlüssel -> laufende Berechnung
+        self.stats = {'requests': 0, 'computations': 0, 'coalesced': 0}
+        self.realtime = RealtimeOverlay(router.gtfs_processor) if config.REALTIME_FEED_PATH else None
+        self.handlers: Dict[str, Callable[[Dict[str, str]], Any]] = {
+            '/route': self._route,
+            '/stops': self._stops,
+            '/addresses': self._addresses,
+        }
+
+    async def handle(self, path: str, params: Dict[str, str]) -> Tuple[int, Any]:
+        #Beantwortet eine Anfrage: (HTTP-Status, JSON-Daten)
+        self.stats['requests'] += 1
+        if path == '/health':
+            return 200, {'status': 'ok', **self.stats}
+        if path == '/metrics':
+            return 200, metrics.snapshot() #Text statt JSON
+        handler = self.handlers.get(path)
+        if handler is None:
+            return 404, {'error': f"Unbekannter Pfad: {path}"}
+
+        key = (path, tuple(sorted(params.items())))
+        future = self._in_flight.get(key)
+        if future is None:
+            self.stats['computations'] += 1
+            future = asyncio.get_running_loop().run_in_executor(self.executor, handler, params)
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.stats['coalesced'] += 1
+            metrics.inc('service_coalesced_total', path=path)
+        try:
+            #shield: bricht ein Client ab, läuft die gemeinsame Berechnung für die anderen weiter
+            with metrics.timer('service_request_seconds', path=path):
+                return 200, await asyncio.shield(future)
+        except (ValueError, KeyError) as e:
+            return 400, {'error': str(e)}
+        except Exception as e:
+            return 500, {'error': f"Interner Fehler: {e}"}
+
+    def _route(self, params: Dict[str, str]) -> Dict:
+        for name in ('from', 'to'):
+            if not params.get(name):
+                raise ValueError(f"Parameter '{name}' fehlt")
+        service_date = date.fromisoformat(params['date']) if params.get('date') else None
+        journeys = self.router.find_routes(
+            params['from'],
+            params['to'],
+            _parse_time(params.get('time')),
+            int(params.get('mode', 2)),
+            max_routes=int(params.get('max_routes', 1)),
+            engine=params.get('engine') or None,
+            service_date=service_date
+        )
+        return {'journeys': [journey_to_dict(journey) for journey in journeys]}
+
+    def _stops(self, params: Dict[str, str]) -> Dict:
+        if not params.get('name'):
+            raise ValueError("Parameter 'name' fehlt")
+        return {'stops': _to_json(self.router.gtfs_loader.get_stops_by_name(params['name']))}
+
+    def _addresses(self, params: Dict[str, str]) -> Dict:
+        if not params.get('q'):
+            raise ValueError("Parameter 'q' fehlt")
+        limit = int(params['limit']) if params.get('limit') else 10
+        return {'addresses': _to_json(self.router.address_processor.find_address(params['q'], limit))}
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        #Minimales HTTP/1.1: Anfragezeile, Header, optionaler JSON-Body; Antwort mit Connection: close
+        try:
+            try:
+                request_line = (await reader.readline()).decode('latin-1').strip()
+                if not request_line:
+                    return
+                method, target, _ = request_line.split(' ', 2)
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode('latin-1').strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                url = urlsplit(target)
+                params = dict(parse_qsl(url.query))
+                if method == 'POST' and int(headers.get('content-length', 0)):
+                    body = await reader.readexactly(int(headers['content-length']))
+                    body_params = json.loads(body or b'{}')
+                    if not isinstance(body_params, dict):
+                        raise ValueError("JSON-Body muss ein Objekt sein")
+                    params.update({key: str(value) for key, value in body_params.items()})
+                    status, data = await self.handle(url.path, params)
+                elif method in ('GET', 'POST'):
+                    status, data = await self.handle(url.path, params)
+                else:
+                    status, data = 405, {'error': f"Methode nicht erlaubt: {method}"}
+            except (ValueError, json.JSONDecodeError, asyncio.IncompleteReadError) as e:
+                status, data = 400, {'error': f"Ungültige Anfrage: {e}"}
+
+            if isinstance(data, str):
+                payload, content_type = data.encode('utf-8'), 'text/plain'
+            else:
+                payload, content_type = json.dumps(data, ensure_ascii=False).encode('utf-8'), 'application/json'
+            reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}.get(status, 'Error')
+            writer.write(
+                f"HTTP/1.1 {status} {reason}\r\n"
+                f"Content-Type: {content_type}; charset=utf-8\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1') + payload
+            )
+            await writer.drain()
+        finally:
+            #Verbindung wird immer geschlossen, auch bei leerer Anfrage oder unerwarteten Fehlern
+            writer.close()
+
+    async def start(self, host: Optional[str] = None, port: Optional[int] = None) -> asyncio.AbstractServer:
+        #Startet den Server (port=0 -> freier Port, siehe server.sockets[0].getsockname())
+        host = host or config.SERVICE_HOST
+        port = config.SERVICE_PORT if port is None else port
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+    async def roll_over_daily(self):
+        #Verschiebt das Fahrplan-Zeitfenster jede Nacht auf den neuen Tag (nur geänderte Trips, siehe
+        #GTFSProcessor.update_service_date); Anfragen laufen währenddessen auf dem bisherigen Graphen weiter
+        loop = asyncio.get_running_loop()
+        while True:
+            now = datetime.now()
+            midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+            await asyncio.sleep((midnight - now).total_seconds() + 1)
+            await loop.run_in_executor(self.executor, self.router.gtfs_processor.update_service_date, datetime.now())
+            if self.realtime is not None:
+                #Verspätungen auf den neuen Graphen übertragen (bis dahin gilt der Sollfahrplan)
+                await loop.run_in_executor(self.executor, self.realtime.rebase, date.today())
+
+    async def poll_realtime(self, path: str):
+        #Übernimmt die Echtzeit-Datei, sobald sie sich ändert (Änderungszeit); die Berechnung läuft im Thread-Pool
+        #-> Anfragen sehen neue Zeiten spätestens nach config.REALTIME_POLL_SECONDS + Dauer von apply()
+        loop = asyncio.get_running_loop()
+        last_modified = None
+        while True:
+            try:
+                modified = os.path.getmtime(path)
+            except OSError:
+                modified = None #Datei (noch) nicht vorhanden
+            if modified is not None and modified != last_modified:
+                last_modified = modified
+                await loop.run_in_executor(self.executor, self.realtime.load_file, path)
+            await asyncio.sleep(config.REALTIME_POLL_SECONDS)
+
+    async def serve_forever(self, host: Optional[str] = None, port: Optional[int] = None):
+        server = await self.start(host, port)
+        address = server.sockets[0].getsockname()
+        print(f"✓ Routing-Dienst läuft auf http://{address[0]}:{address[1]}")
+        tasks = [asyncio.create_task(self.roll_over_daily())]
+        if self.realtime is not None:
+            tasks.append(asyncio.create_task(self.poll_realtime(config.REALTIME_FEED_PATH)))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class ServiceClient:
+    #Einfacher Client für lokale Tests und Skripte (gleiches HTTP wie jeder andere Client)
+
+    def __init__(self, host: str = '127.0.0.1', port: Optional[int] = None):
+        self.host = host
+        self.port = config.SERVICE_PORT if port is None else port
+
+    async def get(self, path: str, **params) -> Tuple[int, Any]:
+        query = f"?{urlencode(params)}" if params else ''
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        writer.write(f"GET {path}{query} HTTP/1.1\r\nHost: {self.host}\r\nConnection: close\r\n\r\n".encode('utf-8'))
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        head, _, body = response.partition(b'\r\n\r\n')
+        status = int(head.split(b' ', 2)[1])
+        if b'text/plain' in head:
+            return status, body.decode('utf-8')
+        return status, json.loads(body.decode('utf-8'))
+
+    async def route(self, start: str, end: str, **params) -> Tuple[int, Any]:
+        return await self.get('/route', **{'from': start, 'to': end, **params})
+
+
+def main():
+    #Lädt GTFS-Daten, Adressen und Verbindungsgraph wie main.py und startet dann den Dienst
+    from main import KarlsruheTransitRouter
+    system = KarlsruheTransitRouter()
+    service = RoutingService(system.router)
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        print("\nRouting-Dienst beendet.")
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
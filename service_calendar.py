@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+from datetime import date, datetime, timedelta
+from typing import Optional, Union
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+MAX_WINDOW_DAYS = 63 #Ein Bit pro Tag in einer uint64-Maske
+ALL_DAYS_BIT = 63 #Reserviertes Bit: "ohne Tagesfilter" (wird von GTFSProcessor gesetzt)
+
+
+def _date_numbers(values: pd.Series) -> np.ndarray:
+    #GTFS-Datum (YYYYMMDD als Zahl oder Text) -> int64, ungültige Werte = -1
+    return pd.to_numeric(values.astype(str).str.strip(), errors='coerce').fillna(-1).to_numpy(dtype=np.int64)
+
+
+class ServiceCalendar:
+    #Betriebstage aller Services als Bitmaske über ein Zeitfenster von mehreren Tagen
+    #Bit d der Maske eines Services ist gesetzt, wenn der Service am Tag window_start + d fährt
+    #PROBLEM: Bisher wurden calendar und calendar_dates für jedes Datum Zeile für Zeile durchlaufen
+    #Lösung: Die Masken werden einmalig spaltenweise berechnet, danach kostet die Abfrage eines Tages nur
+    #noch einen Bit-Test (auch für ganze Arrays von Trips oder Verbindungen)
+
+    def __init__(self, calendar: Optional[pd.DataFrame], calendar_dates: Optional[pd.DataFrame],
+                 window_start: Union[date, datetime], days: int):
+        if isinstance(window_start, datetime):
+            window_start = window_start.date()
+        self.window_start = window_start
+        self.days = max(1, min(int(days), MAX_WINDOW_DAYS))
+
+        dates = [window_start + timedelta(days=d) for d in range(self.days)]
+        date_numbers = np.array([int(day.strftime('%Y%m%d')) for day in dates], dtype=np.int64)
+        weekdays = np.array([day.weekday() for day in dates])
+
+        #Alle bekannten Services (aus calendar und calendar_dates)
+        service_ids = []
+        if calendar is not None:
+            service_ids.append(calendar['service_id'].to_numpy(dtype=object))
+        if calendar_dates is not None:
+            service_ids.append(calendar_dates['service_id'].to_numpy(dtype=object))
+        self.service_lookup = pd.Index(pd.unique(np.concatenate(service_ids)) if service_ids else [])
+
+        #active[s, d] = Service s fährt am Tag d
+        active = np.zeros((len(self.service_lookup), self.days), dtype=bool)
+        if calendar is not None and len(calendar):
+            rows = self.service_lookup.get_indexer(calendar['service_id'])
+            weekday_flags = np.column_stack([
+                pd.to_numeric(calendar[col], errors='coerce').fillna(0).to_numpy() == 1 if col in calendar.columns
+                else np.zeros(len(calendar), dtype=bool)
+                for col in WEEKDAYS
+            ])
+            start = _date_numbers(calendar['start_date'])
+            end = _date_numbers(calendar['end_date'])
+            in_range = (start[:, None] <= date_numbers[None, :]) & (date_numbers[None, :] <= end[:, None])
+            #Mehrere Zeilen pro Service -> ODER-Verknüpfung
+            np.logical_or.at(active, rows, weekday_flags[:, weekdays] & in_range)
+
+        #Ausnahmen aus calendar_dates: erst hinzufügen (Typ 1), dann entfernen (Typ 2)
+        if calendar_dates is not None and len(calendar_dates):
+            if 'date' not in calendar_dates.columns:
+                raise ValueError("Spalte 'date' fehlt in calendar_dates")
+            day = pd.Index(date_numbers).get_indexer(_date_numbers(calendar_dates['date']))
+            rows = self.service_lookup.get_indexer(calendar_dates['service_id'])
+            exception_type = pd.to_numeric(calendar_dates['exception_type'], errors='coerce').to_numpy()
+            in_window = day >= 0
+            added = in_window & (exception_type == 1)
+            removed = in_window & (exception_type == 2)
+            active[rows[added], day[added]] = True
+            active[rows[removed], day[removed]] = False
+
+        self.active = active
+        bits = np.left_shift(np.uint64(1), np.arange(self.days, dtype=np.uint64))
+        self.service_masks = np.bitwise_or.reduce(
+            np.where(active, bits[None, :], np.uint64(0)), axis=1
+        ) if self.days else np.zeros(len(self.service_lookup), dtype=np.uint64)
+
+    def day_index(self, day: Union[date, datetime]) -> Optional[int]:
+        #Position eines Datums im Zeitfenster (None = außerhalb)
+        if isinstance(day, datetime):
+            day = day.date()
+        offset = (day - self.window_start).days
+        return offset if 0 <= offset < self.days else None
+
+    def masks_for(self, service_ids: pd.Series) -> np.ndarray:
+        #Bitmaske pro Eintrag (z.B. pro Trip), unbekannte Services = 0
+        rows = self.service_lookup.get_indexer(service_ids)
+        masks = np.zeros(len(rows), dtype=np.uint64)
+        known = rows >= 0
+        masks[known] = self.service_masks[rows[known]]
+        return masks
+
+
+def active_on_day(masks: np.ndarray, day: int) -> np.ndarray:
+    #Vektorisierter Bit-Test: welche Masken enthalten den Tag?
+    return ((masks >> np.uint64(day)) & np.uint64(1)) == np.uint64(1)
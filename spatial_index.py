@@ -0,0 +1,208 @@
+import math
+import numpy as np
+from typing import Tuple
+
+EARTH_RADIUS_M = 6371000 #Erdradius in Metern (wie in AddressProcessor._haversine_distance)
+METERS_PER_DEGREE = EARTH_RADIUS_M * math.pi / 180 #Meter pro Breitengrad
+
+def haversine_distances(lat1, lon1, lat2, lon2) -> np.ndarray:
+    #Vektorisierte Luftlinienentfernung in Metern (gleiche Formel wie AddressProcessor._haversine_distance)
+    #Alle Argumente dürfen Zahlen oder NumPy-Arrays sein (Broadcasting)
+    lat1_rad = np.radians(lat1)
+    lat2_rad = np.radians(lat2)
+    delta_lat = np.radians(np.subtract(lat2, lat1))
+    delta_lon = np.radians(np.subtract(lon2, lon1))
+
+    a = (np.sin(delta_lat / 2) ** 2 +
+         np.cos(lat1_rad) * np.cos(lat2_rad) *
+         np.sin(delta_lon / 2) ** 2)
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return EARTH_RADIUS_M * c
+
+
+class GridIndex:
+    #Räumlicher Index: gleichmäßiges Gitter über Breiten-/Längengrad
+    #PROBLEM: Jede Haltestelle mit jeder anderen zu vergleichen ist O(n²)
+    #Lösung: Punkte werden in Gitterzellen mit Kantenlänge >= Suchradius einsortiert
+    #Zwei Punkte im Abstand <= Radius liegen dann immer in derselben oder einer Nachbarzelle
+    #-> Es müssen nur die Punkte der 3x3 Nachbarzellen geprüft werden
+    #Punkte ohne gültige Koordinaten (NaN) werden ignoriert, alle Rückgabe-Indizes beziehen sich
+    #aber immer auf die Position im ursprünglich übergebenen Array
+
+    def __init__(self, lats: np.ndarray, lons: np.ndarray, cell_size_m: float):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.cell_size_m = float(cell_size_m)
+        valid = np.nonzero(np.isfinite(self.lats) & np.isfinite(self.lons))[0]
+
+        #Zellgröße in Grad; für die Länge wird der Breitengrad mit den kürzesten Längengraden verwendet
+        #damit eine Zelle überall mindestens cell_size_m breit ist
+        self.cell_lat = self.cell_size_m / METERS_PER_DEGREE
+        max_abs_lat = float(np.max(np.abs(self.lats[valid]))) + self.cell_lat if len(valid) else 0.0
+        self.cell_lon = self.cell_lat / max(math.cos(math.radians(min(max_abs_lat, 89.0))), 1e-6)
+
+        rows, cols = self._cells_of(self.lats[valid], self.lons[valid])
+        self.row_min = int(rows.min()) - 1 if len(rows) else 0
+        self.col_min = int(cols.min()) - 1 if len(cols) else 0
+        #Zellschlüssel = Zeile * Breite + Spalte (Breite mit Rand, damit Nachbarzellen eindeutig bleiben)
+        self.width = (int(cols.max()) - self.col_min + 2) if len(cols) else 1
+        keys = self._cell_keys(rows, cols)
+
+        #Punkte nach Zelle sortieren -> jede Zelle ist ein zusammenhängender Block in self.order
+        self.order = valid[np.argsort(keys, kind='stable')]
+        sorted_keys = keys[self.order]
+        self.cell_keys, self.cell_starts, self.cell_counts = np.unique(
+            sorted_keys, return_index=True, return_counts=True
+        )
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def _cells_of(self, lats: np.ndarray, lons: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        rows = np.floor(np.asarray(lats, dtype=np.float64) / self.cell_lat).astype(np.int64)
+        cols = np.floor(np.asarray(lons, dtype=np.float64) / self.cell_lon).astype(np.int64)
+        return rows, cols
+
+    def _cell_keys(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        return (rows - self.row_min) * self.width + (cols - self.col_min)
+
+    def _lookup_cells(self, rows: np.ndarray, cols: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        #Sucht die Zellen (Zeile, Spalte) im Index -> (gefunden?, Position in cell_keys)
+        #Spalten außerhalb des Gitters würden sonst in die Nachbarzeile "umbrechen"
+        inside = (cols - self.col_min >= 0) & (cols - self.col_min < self.width)
+        keys = self._cell_keys(rows, cols)
+        pos = np.minimum(np.searchsorted(self.cell_keys, keys), max(len(self.cell_keys) - 1, 0))
+        found = inside & (self.cell_keys[pos] == keys) if len(self.cell_keys) else np.zeros(len(keys), dtype=bool)
+        return found, pos
+
+    def _cell_pairs(self, offset: int) -> Tuple[np.ndarray, np.ndarray]:
+        #Liefert die Indizes aller (Zelle, Nachbarzelle)-Paare für einen Schlüssel-Versatz
+        neighbor_keys = self.cell_keys + offset
+        pos = np.searchsorted(self.cell_keys, neighbor_keys)
+        pos = np.minimum(pos, len(self.cell_keys) - 1)
+        found = self.cell_keys[pos] == neighbor_keys
+        return np.nonzero(found)[0], pos[found]
+
+    def pairs_within(self, radius_m: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        #Findet alle Punktpaare (i < j) mit Abstand <= radius_m
+        #Rückgabe: (i, j, Entfernung), sortiert nach (i, j)
+        if radius_m > self.cell_size_m:
+            raise ValueError("Suchradius darf nicht größer als die Zellgröße sein")
+
+        empty = np.array([], dtype=np.int64)
+        if len(self.cell_keys) == 0:
+            return empty, empty, np.array([], dtype=np.float64)
+
+        pairs_i, pairs_j = [], []
+        #Nur die "halbe" Nachbarschaft durchsuchen, damit jedes Zellpaar genau einmal vorkommt
+        #(0,0) = eigene Zelle, dazu rechts, oben-links, oben, oben-rechts
+        for d_row, d_col in [(0, 0), (0, 1), (1, -1), (1, 0), (1, 1)]:
+            cells_a, cells_b = self._cell_pairs(d_row * self.width + d_col)
+            if len(cells_a) == 0:
+                continue
+            count_a = self.cell_counts[cells_a]
+            count_b = self.cell_counts[cells_b]
+            sizes = count_a * count_b
+
+            #Alle Kombinationen (Punkt aus Zelle a, Punkt aus Zelle b) ohne Python-Schleife erzeugen
+            pair_cell = np.repeat(np.arange(len(cells_a)), sizes)
+            first_of_cell = np.repeat(np.cumsum(sizes) - sizes, sizes)
+            local = np.arange(len(pair_cell)) - first_of_cell
+            local_a = local // count_b[pair_cell]
+            local_b = local % count_b[pair_cell]
+            if d_row == 0 and d_col == 0:
+                keep = local_a < local_b
+                pair_cell, local_a, local_b = pair_cell[keep], local_a[keep], local_b[keep]
+
+            pairs_i.append(self.order[self.cell_starts[cells_a][pair_cell] + local_a])
+            pairs_j.append(self.order[self.cell_starts[cells_b][pair_cell] + local_b])
+
+        if not pairs_i:
+            return empty, empty, np.array([], dtype=np.float64)
+        i = np.concatenate(pairs_i)
+        j = np.concatenate(pairs_j)
+        i, j = np.minimum(i, j), np.maximum(i, j)
+
+        distances = haversine_distances(self.lats[i], self.lons[i], self.lats[j], self.lons[j])
+        within = distances <= radius_m
+        i, j, distances = i[within], j[within], distances[within]
+
+        order = np.lexsort((j, i))
+        return i[order], j[order], distances[order]
+
+    def _candidates(self, lats: np.ndarray, lons: np.ndarray, radius_m: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        #Alle (Anfrage, Punkt)-Paare mit Abstand <= radius_m für viele Anfragepunkte gleichzeitig
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        valid = np.isfinite(lats) & np.isfinite(lons)
+        if not valid.all():
+            #Anfragen ohne gültige Koordinaten (NaN) haben keine Treffer, Indizes bleiben die ursprünglichen
+            valid = np.nonzero(valid)[0]
+            queries, points, distances = self._candidates(lats[valid], lons[valid], radius_m)
+            return valid[queries], points, distances
+        query_rows, query_cols = self._cells_of(lats, lons)
+        #Bei Radius > Zellgröße müssen mehrere Ringe von Nachbarzellen durchsucht werden
+        #(für die Länge mit dem Breitengrad der Anfrage, falls dieser weiter vom Äquator entfernt ist)
+        max_abs_lat = float(np.max(np.abs(lats))) + radius_m / METERS_PER_DEGREE if len(lats) else 0.0
+        cell_width_ratio = min(self.cell_lon * math.cos(math.radians(min(max_abs_lat, 89.0))) / self.cell_lat, 1.0)
+        ring_rows = int(math.ceil(radius_m / self.cell_size_m))
+        ring_cols = int(math.ceil(radius_m / (self.cell_size_m * cell_width_ratio)))
+
+        queries, points = [], []
+        for d_row in range(-ring_rows, ring_rows + 1):
+            for d_col in range(-ring_cols, ring_cols + 1):
+                found, pos = self._lookup_cells(query_rows + d_row, query_cols + d_col)
+                query_idx = np.nonzero(found)[0]
+                if len(query_idx) == 0:
+                    continue
+                cells = pos[found]
+                counts = self.cell_counts[cells]
+                pair_query = np.repeat(np.arange(len(query_idx)), counts)
+                local = np.arange(len(pair_query)) - np.repeat(np.cumsum(counts) - counts, counts)
+                queries.append(query_idx[pair_query])
+                points.append(self.order[self.cell_starts[cells][pair_query] + local])
+
+        if not queries:
+            empty = np.array([], dtype=np.int64)
+            return empty, empty, np.array([], dtype=np.float64)
+        q = np.concatenate(queries)
+        p = np.concatenate(points)
+        distances = haversine_distances(lats[q], lons[q], self.lats[p], self.lons[p])
+        within = distances <= radius_m
+        return q[within], p[within], distances[within]
+
+    def query_radius(self, lat: float, lon: float, radius_m: float) -> Tuple[np.ndarray, np.ndarray]:
+        #Alle Punkte im Umkreis, sortiert nach Entfernung (bei Gleichstand nach Position)
+        _, points, distances = self._candidates(np.array([lat]), np.array([lon]), radius_m)
+        order = np.lexsort((points, distances))
+        return points[order], distances[order]
+
+    def query_radius_batch(self, lats: np.ndarray, lons: np.ndarray, radius_m: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        #Alle (Anfrage, Punkt, Entfernung)-Tripel im Umkreis für viele Koordinaten gleichzeitig (unsortiert)
+        return self._candidates(lats, lons, radius_m)
+
+    def nearest(self, lat: float, lon: float, k: int, max_distance_m: float) -> Tuple[np.ndarray, np.ndarray]:
+        #Die k nächsten Punkte im Umkreis max_distance_m
+        points, distances = self.query_radius(lat, lon, max_distance_m)
+        return points[:k], distances[:k]
+
+    def nearest_batch(self, lats: np.ndarray, lons: np.ndarray, k: int, max_distance_m: float) -> Tuple[np.ndarray, np.ndarray]:
+        #k nächste Punkte für viele Koordinaten gleichzeitig
+        #Rückgabe: Arrays der Form (Anzahl Anfragen, k); fehlende Treffer = Index -1 / Entfernung inf
+        n = len(lats)
+        indices = np.full((n, k), -1, dtype=np.int64)
+        distances = np.full((n, k), np.inf)
+        q, p, d = self._candidates(lats, lons, max_distance_m)
+        if len(q) == 0 or k <= 0:
+            return indices, distances
+
+        order = np.lexsort((p, d, q))
+        q, p, d = q[order], p[order], d[order]
+        #Rang innerhalb der eigenen Anfrage (0 = nächster Punkt)
+        first = np.searchsorted(q, q, side='left')
+        rank = np.arange(len(q)) - first
+        keep = rank < k
+        indices[q[keep], rank[keep]] = p[keep]
+        distances[q[keep], rank[keep]] = d[keep]
+        return indices, distances
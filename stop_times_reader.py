@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from typing import Iterator, List, Optional
+from config import config
+from gtfs_cache import GTFSCache
+from metrics import metrics
+
+#Gefiltertes, spaltensparsames Einlesen von stop_times.txt
+#PROBLEM: stop_times.txt ist die mit Abstand größte GTFS-Datei. Mit pd.read_csv vollständig geladen liegen alle
+#Spalten jeder Zeile als Python-Objekte im Speicher (Zeiten als Text "08:15:00"), obwohl der Verbindungsgraph
+#nur fünf Spalten und nur die Trips des Zeitfensters braucht -> der Rest wurde erst nach dem Laden verworfen
+#Lösung:
+# - nur die benötigten Spalten, blockweise (config.STOP_TIMES_CHUNK_ROWS Zeilen) mit festen Datentypen
+# - Zeilen von Trips außerhalb der gesuchten Trip-Menge werden schon im Block verworfen
+# - Zeiten werden im Block in Sekunden (int32) umgerechnet, Haltestellen-IDs als Kategorie gespeichert
+#Mit Cache (gtfs_cache.py) liegt stop_times bereits in dieser kompakten Form vor und wird per mmap blockweise gefiltert
+
+STOP_TIMES_COLUMNS = ['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence']
+
+
+def parse_gtfs_times(times: pd.Series) -> np.ndarray:
+    #GTFS-Zeiten (HH:MM[:SS], Stunden >= 24 erlaubt) -> Sekunden nach Mitternacht (int32)
+    #Fehlende Minuten oder Sekunden zählen als 0, ungültige oder fehlende Zeiten ergeben 0
+    #Jede Uhrzeit kommt in einem Fahrplan tausendfach vor -> nur die eindeutigen Werte werden zerlegt
+    codes, uniques = pd.factorize(times)
+    if len(uniques) == 0:
+        return np.zeros(len(codes), dtype=np.int32)
+    parts = pd.Series(np.asarray(uniques, dtype=object)).astype(str).str.split(':', expand=True)
+    for i in range(parts.shape[1], 3):
+        parts[i] = None
+    numbers = [pd.to_numeric(parts[i].fillna('0').str.strip(), errors='coerce') for i in range(3)]
+    seconds = (numbers[0] * 3600 + numbers[1] * 60 + numbers[2]).fillna(0).to_numpy(dtype=np.int64)
+    #Code -1 (fehlender Wert) zeigt auf die angehängte 0
+    return np.append(seconds, 0).astype(np.int32)[codes]
+
+
+def _id_dtype(reference: pd.Series):
+    #IDs in stop_times mit demselben Typ lesen wie in der Bezugstabelle (trips bzw. stops),
+    #damit z.B. rein numerische IDs weiterhin zusammenpassen
+    return reference.dtype if pd.api.types.is_numeric_dtype(reference.dtype) else str
+
+
+class StopTimesReader:
+    #Liest stop_times.txt gefiltert auf eine Menge von Trips (z.B. die aktiven Trips des Zeitfensters)
+    #Ergebnis von read(): eine Zeile pro Halt in Dateireihenfolge mit den Spalten
+    # trip (Position in trip_ids, int32), stop_id (Kategorie), stop_sequence (int32),
+    # arrival_time und departure_time (Sekunden nach Mitternacht, int32)
+
+    def __init__(self, source_path: str, trip_ids: pd.Series, stop_ids: pd.Series,
+                 cache: Optional[GTFSCache] = None, chunk_rows: Optional[int] = None):
+        self.source_path = source_path
+        self.cache = cache
+        self.chunk_rows = chunk_rows or config.STOP_TIMES_CHUNK_ROWS
+        self.dtypes = {
+            'trip_id': _id_dtype(trip_ids),
+            'stop_id': _id_dtype(stop_ids),
+            'arrival_time': str,
+            'departure_time': str,
+            'stop_sequence': np.int32
+        }
+
+    def _csv_chunks(self) -> Iterator[pd.DataFrame]:
+        #Nur die benötigten Spalten, höchstens chunk_rows Zeilen gleichzeitig als Text im Speicher
+        with pd.read_csv(self.source_path, usecols=STOP_TIMES_COLUMNS, dtype=self.dtypes,
+                         chunksize=self.chunk_rows) as reader:
+            yield from reader
+
+    @staticmethod
+    def _compact(chunk: pd.DataFrame, trip: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame({
+            'trip': trip.astype(np.int32),
+            'stop_id': pd.Categorical(chunk['stop_id']),
+            'stop_sequence': chunk['stop_sequence'].to_numpy(dtype=np.int32),
+            'arrival_time': parse_gtfs_times(chunk['arrival_time']),
+            'departure_time': parse_gtfs_times(chunk['departure_time'])
+        })
+
+    @staticmethod
+    def _concat(parts: List[pd.DataFrame]) -> pd.DataFrame:
+        #Blöcke zusammenfügen; die Haltestellen-Kategorien der Blöcke werden vereinigt (bleibt eine Kategorie)
+        if not parts:
+            return pd.DataFrame({
+                'trip': np.array([], dtype=np.int32),
+                'stop_id': pd.Categorical([]),
+                'stop_sequence': np.array([], dtype=np.int32),
+                'arrival_time': np.array([], dtype=np.int32),
+                'departure_time': np.array([], dtype=np.int32)
+            })
+        stop_ids = union_categoricals([part['stop_id'] for part in parts])
+        table = pd.concat([part.drop(columns='stop_id') for part in parts], ignore_index=True)
+        table.insert(1, 'stop_id', stop_ids)
+        return table
+
+    def read(self, trip_ids) -> pd.DataFrame:
+        #trip_ids: gesuchte Trips (eindeutig); Zeilen anderer Trips werden beim Lesen verworfen
+        trip_lookup = pd.Index(trip_ids)
+        with metrics.timer('gtfs_load_table_seconds', table='stop_times'):
+            if self.cache is not None:
+                parts = list(self._filtered_cache_chunks(trip_lookup))
+            else:
+                parts = list(self._filtered_csv_chunks(trip_lookup))
+            table = self._concat(parts)
+        metrics.set_gauge('gtfs_rows', len(table), table='stop_times')
+        return table
+
+    def _filtered_csv_chunks(self, trip_lookup: pd.Index) -> Iterator[pd.DataFrame]:
+        for chunk in self._csv_chunks():
+            trip = trip_lookup.get_indexer(chunk['trip_id'])
+            keep = trip >= 0
+            if keep.any():
+                #Zeiten nur für die behaltenen Zeilen umrechnen
+                yield self._compact(chunk[keep], trip[keep])
+
+    def prepare_cache(self) -> bool:
+        #Legt stop_times in kompakter Form (alle Trips) im Cache ab, falls er fehlt oder veraltet ist
+        #Rückgabe: True, wenn der Cache bereits gültig war
+        if self.cache is None:
+            return False
+        if self.cache.is_valid('stop_times', self.source_path):
+            metrics.inc('gtfs_cache_total', result='hit')
+            return True
+        metrics.inc('gtfs_cache_total', result='miss')
+        try:
+            #Blockweise in den Cache schreiben -> auch beim ersten Start liegt höchstens ein Block im Speicher
+            self.cache.store_chunks('stop_times', self.source_path, self._cache_chunks())
+        except OSError as e:
+            #Cache ist nur eine Beschleunigung -> ohne Cache wird direkt aus der CSV-Datei gefiltert
+            print(f"Warnung: Cache für stop_times konnte nicht geschrieben werden: {e}")
+            self.cache = None
+        return False
+
+    def _cache_chunks(self) -> Iterator[pd.DataFrame]:
+        #Alle Zeilen in kompakter Form; gleiche Spaltennamen wie in stop_times.txt (Zeiten jedoch in Sekunden)
+        for chunk in self._csv_chunks():
+            codes, trip_ids = pd.factorize(chunk['trip_id'])
+            compact = self._compact(chunk, codes).drop(columns='trip')
+            compact.insert(0, 'trip_id', pd.Categorical.from_codes(codes, trip_ids))
+            yield compact
+
+    def _filtered_cache_chunks(self, trip_lookup: pd.Index) -> Iterator[pd.DataFrame]:
+        if not self.cache.is_valid('stop_times', self.source_path):
+            self.prepare_cache()
+            if self.cache is None:
+                yield from self._filtered_csv_chunks(trip_lookup)
+                return
+        columns = self.cache.open_columns('stop_times')
+        trip_codes, trip_values = columns['trip_id']
+        stop_codes, stop_values = columns['stop_id']
+        #Trip-Code im Cache -> Position in trip_lookup (-1 = nicht gesucht, auch für fehlende trip_id)
+        trip_position = np.append(trip_lookup.get_indexer(trip_values), -1).astype(np.int32)
+
+        for start in range(0, len(trip_codes), self.chunk_rows):
+            trip = trip_position[trip_codes[start:start + self.chunk_rows]]
+            keep = np.nonzero(trip >= 0)[0]
+            if len(keep) == 0:
+                continue
+            rows = keep + start
+            yield pd.DataFrame({
+                'trip': trip[keep],
+                'stop_id': pd.Categorical.from_codes(stop_codes[rows], stop_values),
+                'stop_sequence': columns['stop_sequence'][rows],
+                'arrival_time': columns['arrival_time'][rows],
+                'departure_time': columns['departure_time'][rows]
+            })
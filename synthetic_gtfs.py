@@ -0,0 +1,213 @@
+import csv
+import json
+import math
+import os
+import random
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, List, Tuple
+from spatial_index import METERS_PER_DEGREE
+
+#Deterministischer Generator für künstliche GTFS-Feeds rund um Karlsruhe
+#Zweck: Benchmarks und Tests ohne den echten KVV-Feed (gleicher seed -> identische Dateien)
+#Erzeugt stops (Stationen mit Gleisen), routes, trips, stop_times (auch Fahrten nach 24:00),
+#calendar mit Werktag/Wochenende/täglich, calendar_dates mit Feiertagen und optional eine Adress-CSV
+#Dazu passende Echtzeit-Meldungen (GTFS-Realtime TripUpdates als JSON) als Ersatz für einen echten Echtzeit-Feed
+
+
+@dataclass
+class SyntheticFeedConfig:
+    stations: int = 400 #Stationen (Parent-Stations), jede mit 1..max_platforms Gleisen
+    max_platforms: int = 3
+    routes: int = 40
+    trips_per_route: int = 120 #Fahrten pro Linie und Betriebstag-Typ (abwechselnd Hin- und Rückrichtung)
+    min_route_stops: int = 8
+    max_route_stops: int = 25
+    first_departure: int = 5 * 3600 #Sekunden nach Mitternacht
+    last_departure: int = 24 * 3600 + 30 * 60 #Letzte Abfahrt nach Mitternacht (GTFS-Zeiten > 24:00)
+    center_lat: float = 49.0094 #Karlsruhe Marktplatz
+    center_lon: float = 8.4044
+    radius_km: float = 8.0
+    start_date: date = date(2026, 1, 1)
+    end_date: date = date(2027, 12, 31)
+    holidays: List[date] = field(default_factory=lambda: [date(2026, 10, 3), date(2026, 12, 25), date(2026, 12, 26)])
+    addresses: int = 2000 #0 = keine Adress-CSV
+    seed: int = 1
+
+
+#Vorgaben für Benchmark-Größen (large entspricht grob dem KVV-Netz)
+SIZES: Dict[str, SyntheticFeedConfig] = {
+    'small': SyntheticFeedConfig(stations=60, routes=8, trips_per_route=40, addresses=500),
+    'medium': SyntheticFeedConfig(),
+    'large': SyntheticFeedConfig(stations=4000, routes=300, trips_per_route=150, radius_km=30.0, addresses=50000),
+}
+
+#(GTFS route_type, Geschwindigkeit in m/s, Haltezeit in Sekunden) - Anteil entspricht grob dem KVV
+_ROUTE_TYPES = [(3, 6.0, 20), (3, 6.0, 20), (700, 6.5, 20), (0, 6.0, 30), (900, 6.5, 30), (109, 13.0, 60), (100, 12.0, 60)]
+
+
+def _format_time(seconds: int) -> str:
+    return f"{seconds // 3600:02d}:{(seconds % 3600) // 60:02d}:{seconds % 60:02d}"
+
+
+def _random_point(rnd: random.Random, feed: SyntheticFeedConfig) -> Tuple[float, float]:
+    #Gleichverteilt in einem Kreis um das Zentrum
+    distance = feed.radius_km * 1000 * math.sqrt(rnd.random())
+    angle = rnd.uniform(0, 2 * math.pi)
+    lat = feed.center_lat + distance * math.cos(angle) / METERS_PER_DEGREE
+    lon = feed.center_lon + distance * math.sin(angle) / (METERS_PER_DEGREE * math.cos(math.radians(feed.center_lat)))
+    return lat, lon
+
+
+def _distance_m(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    #Näherung für kurze Distanzen (reicht für Fahrzeiten)
+    d_lat = (a[0] - b[0]) * METERS_PER_DEGREE
+    d_lon = (a[1] - b[1]) * METERS_PER_DEGREE * math.cos(math.radians(a[0]))
+    return math.hypot(d_lat, d_lon)
+
+
+def generate_feed(path: str, feed: SyntheticFeedConfig = None) -> Dict[str, int]:
+    #Schreibt den Feed nach path (GTFS-Ordner) und gibt die Anzahl Zeilen pro Datei zurück
+    #Die Adress-CSV (falls feed.addresses > 0) liegt als addresses.csv im selben Ordner
+    feed = feed or SyntheticFeedConfig()
+    rnd = random.Random(feed.seed)
+    os.makedirs(path, exist_ok=True)
+    counts = {}
+
+    def write(filename: str, header: List[str], rows: List[Tuple]):
+        with open(os.path.join(path, filename), 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+        counts[filename] = len(rows)
+
+    #Stationen mit Gleisen (Kinder mit parent_station, leicht versetzte Koordinaten)
+    stations = []
+    platforms = []
+    stop_rows = []
+    for i in range(feed.stations):
+        prefix = 'de:08212' if i < feed.stations * 0.6 else 'de:08215' #Stadt- und Landkreis wie im KVV
+        station_id = f"{prefix}:{1000 + i}"
+        lat, lon = _random_point(rnd, feed)
+        stations.append((lat, lon))
+        name = f"Haltestelle {i}"
+        stop_rows.append((station_id, name, f"{lat:.6f}", f"{lon:.6f}", 1, ''))
+        station_platforms = []
+        for p in range(1, rnd.randint(1, feed.max_platforms) + 1):
+            platform_id = f"{station_id}:{p}:{p}"
+            stop_rows.append((platform_id, name, f"{lat + rnd.uniform(-3e-4, 3e-4):.6f}",
+                              f"{lon + rnd.uniform(-3e-4, 3e-4):.6f}", 0, station_id))
+            station_platforms.append(platform_id)
+        platforms.append(station_platforms)
+    write('stops.txt', ['stop_id', 'stop_name', 'stop_lat', 'stop_lon', 'location_type', 'parent_station'], stop_rows)
+
+    #Linien: ab einer zufälligen Station immer zur nächsten noch nicht besuchten Nachbarstation
+    #-> räumlich zusammenhängende Linienverläufe statt Sprüngen quer durch das Gebiet
+    route_rows = []
+    lines = []
+    for r in range(feed.routes):
+        route_type, speed, dwell = _ROUTE_TYPES[r % len(_ROUTE_TYPES)]
+        length = min(rnd.randint(feed.min_route_stops, feed.max_route_stops), feed.stations)
+        current = rnd.randrange(feed.stations)
+        sequence = [current]
+        while len(sequence) < length:
+            candidates = rnd.sample(range(feed.stations), min(feed.stations, 40))
+            candidates = [c for c in candidates if c not in sequence] or \
+                [c for c in range(feed.stations) if c not in sequence]
+            current = min(candidates, key=lambda c: _distance_m(stations[sequence[-1]], stations[c]))
+            sequence.append(current)
+        route_rows.append((f"R{r}", f"{'S' if route_type in (100, 109) else ''}{r + 1}", f"Linie {r + 1}", route_type))
+        lines.append((sequence, speed, dwell))
+    write('routes.txt', ['route_id', 'route_short_name', 'route_long_name', 'route_type'], route_rows)
+
+    #Betriebstage: Werktag, Wochenende, täglich; Feiertage: Werktags-Service fällt aus, Wochenend-Service fährt
+    start, end = feed.start_date.strftime('%Y%m%d'), feed.end_date.strftime('%Y%m%d')
+    write('calendar.txt', ['service_id', 'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday',
+                           'sunday', 'start_date', 'end_date'], [
+        ('WD', 1, 1, 1, 1, 1, 0, 0, start, end),
+        ('WE', 0, 0, 0, 0, 0, 1, 1, start, end),
+        ('ALL', 1, 1, 1, 1, 1, 1, 1, start, end),
+    ])
+    exceptions = []
+    for holiday in feed.holidays:
+        if holiday.weekday() < 5:
+            exceptions.append(('WD', holiday.strftime('%Y%m%d'), 2))
+            exceptions.append(('WE', holiday.strftime('%Y%m%d'), 1))
+    write('calendar_dates.txt', ['service_id', 'date', 'exception_type'], exceptions)
+
+    #Fahrten im gleichmäßigen Takt über den Tag, Fahrzeit aus Distanz und Geschwindigkeit
+    trip_rows = []
+    stop_time_rows = []
+    services = ['WD', 'WE', 'ALL']
+    span = feed.last_departure - feed.first_departure
+    for r, (sequence, speed, dwell) in enumerate(lines):
+        legs = [max(60, int(_distance_m(stations[a], stations[b]) / speed)) for a, b in zip(sequence, sequence[1:])]
+        stop_platforms = [rnd.choice(platforms[s]) for s in sequence]
+        for t in range(feed.trips_per_route):
+            forward = t % 2 == 0
+            service = services[(t // 2) % len(services)]
+            trip_id = f"T{r}_{t}"
+            order = list(range(len(sequence))) if forward else list(range(len(sequence) - 1, -1, -1))
+            trip_rows.append((f"R{r}", service, trip_id, f"Richtung Haltestelle {sequence[order[-1]]}"))
+            time = feed.first_departure + (span * t) // max(1, feed.trips_per_route - 1) + rnd.randint(0, 120)
+            for k, position in enumerate(order):
+                arrival = time
+                departure = time + (dwell if 0 < k < len(order) - 1 else 0)
+                stop_time_rows.append((trip_id, _format_time(arrival), _format_time(departure),
+                                       stop_platforms[position], k + 1))
+                if k < len(order) - 1:
+                    leg = legs[min(position, order[k + 1])]
+                    time = departure + leg + rnd.randint(0, 30)
+    write('trips.txt', ['route_id', 'service_id', 'trip_id', 'trip_headsign'], trip_rows)
+    write('stop_times.txt', ['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence'], stop_time_rows)
+
+    #Adressen im selben Gebiet (Format wie karlsruhe_addresses.csv)
+    if feed.addresses > 0:
+        streets = max(1, feed.addresses // 25)
+        address_rows = []
+        for a in range(feed.addresses):
+            lat, lon = _random_point(rnd, feed)
+            street = f"Teststraße {a % streets + 1}"
+            address_rows.append((f"{street} {a // streets + 1}, 761{a % 90 + 10:02d} Karlsruhe", lat, lon))
+        write('addresses.csv', ['full_address', 'lat', 'lon'], address_rows)
+
+    return counts
+
+
+def generate_trip_updates(path: str, output: str, service_date: date, share: float = 0.1,
+                          max_delay: int = 600, seed: int = 1) -> int:
+    #Schreibt für einen Anteil share der Trips aus path einen TripUpdate (JSON wie MessageToDict) nach output
+    #Jeder 20. Trip fällt aus, die übrigen haben ab einem zufälligen Halt eine Verspätung von bis zu max_delay Sekunden
+    #Rückgabe: Anzahl Meldungen
+    rnd = random.Random(seed)
+    with open(os.path.join(path, 'trips.txt'), newline='', encoding='utf-8') as f:
+        trip_ids = [row['trip_id'] for row in csv.DictReader(f)]
+    chosen = set(rnd.sample(trip_ids, int(len(trip_ids) * share)))
+    sequences = {}
+    with open(os.path.join(path, 'stop_times.txt'), newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            if row['trip_id'] in chosen:
+                sequences.setdefault(row['trip_id'], []).append(int(row['stop_sequence']))
+
+    entities = []
+    for i, trip_id in enumerate(sorted(chosen)):
+        trip = {'tripId': trip_id, 'startDate': service_date.strftime('%Y%m%d')}
+        if i % 20 == 0:
+            entities.append({'id': trip_id, 'tripUpdate': {'trip': {**trip, 'scheduleRelationship': 'CANCELED'}}})
+            continue
+        stop_sequence = rnd.choice(sequences.get(trip_id, [1]))
+        delay = rnd.randint(60, max_delay)
+        entities.append({'id': trip_id, 'tripUpdate': {'trip': trip, 'stopTimeUpdate': [
+            {'stopSequence': stop_sequence, 'arrival': {'delay': delay}, 'departure': {'delay': delay}}
+        ]}})
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'header': {'gtfsRealtimeVersion': '2.0', 'incrementality': 'FULL_DATASET'}, 'entity': entities}, f)
+    return len(entities)
+
+
+if __name__ == "__main__":
+    import sys
+    target = sys.argv[1] if len(sys.argv) > 1 else 'synthetic_gtfs'
+    size = sys.argv[2] if len(sys.argv) > 2 else 'medium'
+    for filename, rows in generate_feed(target, SIZES[size]).items():
+        print(f"{filename}: {rows} Zeilen")
@@ -0,0 +1,76 @@
+import contextlib
+import io
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config
+from synthetic_gtfs import SIZES, generate_feed
+
+#Gemeinsame Grundlage der Tests: ein kleiner künstlicher Feed (synthetic_gtfs.py, fester seed)
+#Ohne Binär-Cache, Feed und Adress-CSV liegen in tmp_path
+
+FEED = SIZES['small']
+BUILD_DATE = datetime(2026, 10, 20) #Dienstag, Werktags-Fahrten sind aktiv
+
+
+@pytest.fixture(scope='session')
+def feed_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('gtfs'))
+    generate_feed(path, FEED)
+    return path
+
+
+@pytest.fixture
+def gtfs_config(feed_path):
+    #Setzt config auf den Test-Feed und stellt die bisherigen Werte danach wieder her
+    names = ('GTFS_PATH', 'ADDRESSES_CSV_PATH', 'USE_GTFS_CACHE', 'DEBUG_OUTPUT', 'MIN_ACTIVE_ROUTE_SHARE')
+    saved = {name: getattr(config, name) for name in names}
+    config.GTFS_PATH, config.ADDRESSES_CSV_PATH = feed_path, os.path.join(feed_path, 'addresses.csv')
+    config.USE_GTFS_CACHE, config.DEBUG_OUTPUT = False, False
+    yield config
+    for name, value in saved.items():
+        setattr(config, name, value)
+
+
+def build_processor(build_date: datetime = BUILD_DATE):
+    #Lädt den Feed und baut den Verbindungsgraph (Konsolenausgaben werden verworfen)
+    from gtfs_loader import GTFSLoader
+    from gtfs_processing import GTFSProcessor
+    with contextlib.redirect_stdout(io.StringIO()):
+        loader = GTFSLoader()
+        loader.load_gtfs_data()
+        processor = GTFSProcessor(loader)
+        processor.build_connection_graph(build_date)
+    return loader, processor
+
+
+@pytest.fixture
+def processor(gtfs_config):
+    return build_processor()[1]
+
+
+@pytest.fixture
+def router(gtfs_config):
+    from address_processor import AddressProcessor
+    from routing import PublicTransportRouter
+    loader, processor = build_processor()
+    with contextlib.redirect_stdout(io.StringIO()):
+        return PublicTransportRouter(loader, processor, AddressProcessor())
+
+
+def find_journeys(router, from_name: str, to_name: str, departure: timedelta, engine: str, service_date,
+                  max_routes: int = 1):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return router.find_routes(from_name, to_name, departure, 2, max_routes=max_routes, engine=engine,
+                                  service_date=service_date)
+
+
+def find_arrival(router, from_name: str, to_name: str, departure: timedelta, engine: str, service_date):
+    #Ankunft der besten Verbindung (None = keine Verbindung gefunden)
+    journeys = find_journeys(router, from_name, to_name, departure, engine, service_date)
+    return journeys[0].arrival_time if journeys else None
@@ -0,0 +1,32 @@
+import glob
+import os
+
+import pandas as pd
+import pytest
+
+from gtfs_cache import GTFSCache
+
+
+def test_cold_and_warm_start_return_the_same_tables(feed_path, tmp_path):
+    cache_path = str(tmp_path / 'cache')
+    for source_path in sorted(glob.glob(os.path.join(feed_path, '*.txt'))):
+        name = os.path.splitext(os.path.basename(source_path))[0]
+        cold = GTFSCache(cache_path).read_table(name, source_path)
+        warm = GTFSCache(cache_path).read_table(name, source_path)
+        pd.testing.assert_frame_equal(cold, warm, obj=name)
+
+
+@pytest.mark.filterwarnings('ignore::pandas.errors.DtypeWarning')
+def test_mixed_text_column_is_str_on_cold_start(tmp_path):
+    #pd.read_csv liest große Dateien blockweise: Zahlen in den ersten Blöcken, Text danach -> gemischte Spalte
+    source_path = str(tmp_path / 'routes.txt')
+    rows = 300000
+    pd.DataFrame({
+        'route_id': range(rows),
+        'route_short_name': [str(i) for i in range(rows - 1)] + ['S1']
+    }).to_csv(source_path, index=False)
+    cache_path = str(tmp_path / 'cache')
+    cold = GTFSCache(cache_path).read_table('routes', source_path)
+    warm = GTFSCache(cache_path).read_table('routes', source_path)
+    assert isinstance(cold['route_short_name'].iloc[0], str)
+    pd.testing.assert_frame_equal(cold, warm)
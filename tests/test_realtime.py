@@ -0,0 +1,179 @@
+import random
+from datetime import date, timedelta
+
+import numpy as np
+
+from conftest import find_arrival, find_journeys
+from csa_routing import ConnectionScanRouter, CSATimetable
+from raptor_routing import RaptorRouter, RaptorTimetable
+from realtime import RealtimeOverlay, StopTimeUpdate, TripUpdate
+
+SERVICE_DATE = date(2026, 10, 20)
+ENGINES = ('dijkstra', 'csa', 'raptor')
+MODES = (0, 1, 2)
+
+
+def _stop_name(router, stop: int) -> str:
+    connections = router.gtfs_processor.connections
+    return router._get_stop_info(connections.stop_ids[stop])['stop_name']
+
+
+def test_skipped_stop_keeps_ride_through_but_blocks_boarding_and_alighting(router):
+    #Halt B eines Trips A -> B -> C entfällt: A -> C bleibt mit demselben Fahrzeug so schnell wie geplant,
+    #aber keine Fahrt steigt an B in diesen Trip ein oder aus ihm aus
+    processor = router.gtfs_processor
+    connections = processor.connections
+    day_bit = np.uint64(1 << processor.service_day(SERVICE_DATE))
+    overlay = RealtimeOverlay(processor, SERVICE_DATE)
+
+    checked = 0
+    for trip, trip_id in enumerate(connections.trip_ids):
+        rows = np.nonzero((connections.trip == trip) & (connections.day_offset == 0))[0]
+        if len(rows) < 4 or not connections.service_mask[rows[0]] & day_bit:
+            continue
+        i = len(rows) // 2
+        stop_b = connections.stop_ids[connections.from_stop[rows[i]]]
+        a, b, c = (_stop_name(router, stop) for stop in
+                   (connections.from_stop[rows[i - 1]], connections.from_stop[rows[i]], connections.to_stop[rows[i]]))
+        if len({a, b, c}) < 3:
+            continue
+        at_a = timedelta(seconds=int(connections.dep[rows[i - 1]]))
+        at_b = timedelta(seconds=int(connections.dep[rows[i]]))
+        arrival_b = timedelta(seconds=int(connections.arr[rows[i - 1]]))
+
+        overlay.apply([])
+        scheduled = {engine: find_arrival(router, a, c, at_a, engine, SERVICE_DATE) for engine in ENGINES}
+        overlay.apply([TripUpdate(trip_id, canceled=True)])
+        if find_arrival(router, a, c, at_a, 'csa', SERVICE_DATE) == scheduled['csa']:
+            continue #Der Trip ist nicht die beste Verbindung von A nach C
+
+        overlay.apply([TripUpdate(trip_id, stop_time_updates=[
+            StopTimeUpdate(stop_sequence=int(connections.from_seq[rows[i]]), schedule_relationship='SKIPPED')])])
+        for engine in ENGINES:
+            assert find_arrival(router, a, c, at_a, engine, SERVICE_DATE) == scheduled[engine], engine
+            journeys = find_journeys(router, b, c, at_b, engine, SERVICE_DATE, max_routes=3) + \
+                find_journeys(router, a, b, at_a, engine, SERVICE_DATE, max_routes=3)
+            rides = [s for journey in journeys for s in journey.segments
+                     if s.mode == 'transit' and s.route_name != 'Fußweg']
+            for segment in rides:
+                assert (segment.from_stop, segment.departure_time) != (stop_b, at_b), engine
+                assert (segment.to_stop, segment.arrival_time) != (stop_b, arrival_b), engine
+        checked += 1
+        if checked == 3:
+            break
+    assert checked == 3
+
+
+def _trip_rows(processor, min_rows: int = 3):
+    #Erster Trip, der am Betriebstag fährt: (trip_id, Verbindungen in Fahrtrichtung)
+    connections = processor.connections
+    day_bit = np.uint64(1 << processor.service_day(SERVICE_DATE))
+    for trip, trip_id in enumerate(connections.trip_ids):
+        rows = np.nonzero((connections.trip == trip) & (connections.day_offset == 0))[0]
+        if len(rows) >= min_rows and connections.service_mask[rows[0]] & day_bit:
+            return trip_id, rows
+    raise AssertionError('Kein Trip am Betriebstag')
+
+
+def test_delay_cancel_skip_and_clear_patch_the_expected_times(processor):
+    base = processor.connections
+    day_bit = np.uint64(1 << processor.service_day(SERVICE_DATE))
+    trip_id, rows = _trip_rows(processor)
+    others = np.setdiff1d(np.arange(len(base)), rows)
+    overlay = RealtimeOverlay(processor, SERVICE_DATE)
+
+    def live():
+        return overlay.live.connections
+
+    #Verspätung des ganzen Trips
+    assert overlay.apply([TripUpdate(trip_id, delay=300)]) == 1
+    assert np.array_equal(live().dep[rows], base.dep[rows] + 300)
+    assert np.array_equal(live().arr[rows], base.arr[rows] + 300)
+    for name in ('dep', 'arr', 'service_mask'):
+        assert np.array_equal(getattr(live(), name)[others], getattr(base, name)[others]), name
+
+    #Verspätung ab der Ankunft am zweiten Halt, davor gilt der Fahrplan
+    overlay.apply([TripUpdate(trip_id, stop_time_updates=[
+        StopTimeUpdate(stop_sequence=int(base.to_seq[rows[1]]), arrival_delay=600)])])
+    assert live().dep[rows[1]] == base.dep[rows[1]] and live().arr[rows[0]] == base.arr[rows[0]]
+    assert live().arr[rows[1]] == base.arr[rows[1]] + 600
+    assert np.array_equal(live().dep[rows[2:]], base.dep[rows[2:]] + 600)
+
+    #Ausfall: Zeiten bleiben, der Trip fährt am Betriebstag nicht
+    overlay.apply([TripUpdate(trip_id, canceled=True)])
+    assert not (live().service_mask[rows] & day_bit).any()
+    assert np.array_equal(live().service_mask[rows] | day_bit, base.service_mask[rows])
+    assert np.array_equal(live().dep, base.dep)
+
+    #Entfallener zweiter Halt: erste Verbindung fährt bis zum dritten Halt durch, ab dem zweiten Halt keine
+    overlay.apply([TripUpdate(trip_id, stop_time_updates=[
+        StopTimeUpdate(stop_sequence=int(base.to_seq[rows[0]]), schedule_relationship='SKIPPED')])])
+    assert (live().to_stop[rows[0]], live().to_seq[rows[0]]) == (base.to_stop[rows[1]], base.to_seq[rows[1]])
+    assert live().arr[rows[0]] == base.arr[rows[1]]
+    assert not live().service_mask[rows[1]] & day_bit
+    assert np.array_equal(live().service_mask[rows[2:]], base.service_mask[rows[2:]])
+
+    #Ergänzung ohne full_dataset behält die bisherigen Meldungen, leerer Gesamtstand -> wieder Sollfahrplan
+    other_id, other_rows = trip_id, rows
+    for trip, candidate in enumerate(base.trip_ids):
+        if candidate != trip_id:
+            other_id, other_rows = candidate, np.nonzero((base.trip == trip) & (base.day_offset == 0))[0]
+            break
+    overlay.apply([TripUpdate(other_id, delay=120)], full_dataset=False)
+    assert live().arr[rows[0]] == base.arr[rows[1]]
+    assert np.array_equal(live().dep[other_rows], base.dep[other_rows] + 120)
+    overlay.apply([])
+    for name in ('dep', 'arr', 'service_mask', 'to_stop', 'to_seq'):
+        assert np.array_equal(getattr(live(), name), getattr(base, name)), name
+
+
+def _trip_partition(trips):
+    #Fahrtnummern unabhängig von ihrer Vergabe vergleichen (Nummer der ersten Verbindung jeder Fahrt)
+    first = {}
+    return [first.setdefault(trip, position) for position, trip in enumerate(trips)]
+
+
+def test_patched_timetables_match_a_rebuild(processor, monkeypatch):
+    #CSA und RAPTOR führen ihre Fahrpläne für neue Echtzeit-Stände nach (patched) statt sie neu zu erstellen
+    #Ergebnis muss dem Neuaufbau aus denselben Verbindungen entsprechen
+    patches = []
+    for timetable_class in (CSATimetable, RaptorTimetable):
+        original = timetable_class.patched
+        monkeypatch.setattr(timetable_class, 'patched',
+                            lambda self, *args, original=original: patches.append(1) or original(self, *args))
+    day = processor.service_day(SERVICE_DATE)
+    csa, raptor = ConnectionScanRouter(processor), RaptorRouter(processor)
+    for mode in MODES:
+        csa.get_timetable(mode, day)
+        raptor.get_timetable(mode, day)
+
+    overlay = RealtimeOverlay(processor, SERVICE_DATE)
+    trip_ids = processor.connections.trip_ids
+    rnd = random.Random(5)
+    current = {}
+    for _ in range(6):
+        for _ in range(rnd.randint(1, 30)):
+            trip_id, kind = rnd.choice(trip_ids), rnd.random()
+            if kind < 0.15:
+                current[trip_id] = TripUpdate(trip_id, canceled=True)
+            elif kind < 0.3:
+                current.pop(trip_id, None)
+            elif kind < 0.45:
+                current[trip_id] = TripUpdate(trip_id, stop_time_updates=[
+                    StopTimeUpdate(stop_sequence=2, schedule_relationship='SKIPPED')])
+            else:
+                current[trip_id] = TripUpdate(trip_id, delay=rnd.choice([-120, 60, 300, 900, 3600]))
+        overlay.apply(list(current.values()))
+
+        for mode in MODES:
+            patched, rebuilt = csa.get_timetable(mode, day), CSATimetable(processor, mode, day)
+            assert patched.connections is rebuilt.connections
+            for name in ('row', 'dep', 'arr', 'from_stop', 'to_stop'):
+                assert getattr(patched, name) == getattr(rebuilt, name), ('csa', mode, name)
+            assert _trip_partition(patched.trip) == _trip_partition(rebuilt.trip)
+
+            patched, rebuilt = raptor.get_timetable(mode, day), RaptorTimetable(processor, mode, day)
+            for name in ('pattern_stops', 'pattern_dep', 'pattern_arr', 'pattern_rows', 'pattern_priority',
+                         'stop_patterns'):
+                assert getattr(patched, name) == getattr(rebuilt, name), ('raptor', mode, name)
+    assert patches
@@ -0,0 +1,28 @@
+import random
+from datetime import date, timedelta
+
+from conftest import find_journeys
+
+SERVICE_DATE = date(2026, 10, 20)
+
+
+def _legs(journey) -> str:
+    #R = Fahrt, W = Fußweg zwischen Haltestellen
+    return ''.join('W' if s.route_name == 'Fußweg' else 'R' for s in journey.segments if s.mode == 'transit')
+
+
+def test_dijkstra_walks_between_rides_like_csa(router):
+    #Fußweg nach einer Fahrt ist kein Umstieg mit Wartezeit: Dijkstra findet Fahrt -> Fußweg -> Fahrt,
+    #kommt aber nie früher an als CSA (keine Fußweg-Ketten, gleiche Umstiegsregeln)
+    names = sorted(router.gtfs_loader.stops.stop_name.unique())
+    rnd = random.Random(7)
+    walked = 0
+    for _ in range(40):
+        start, end = rnd.sample(names, 2)
+        departure = timedelta(seconds=rnd.randint(6 * 3600, 20 * 3600))
+        dijkstra = find_journeys(router, start, end, departure, 'dijkstra', SERVICE_DATE, max_routes=3)
+        csa = find_journeys(router, start, end, departure, 'csa', SERVICE_DATE)
+        if dijkstra and csa:
+            assert dijkstra[0].arrival_time >= csa[0].arrival_time, (start, end, departure)
+        walked += sum('RWR' in _legs(journey) for journey in dijkstra)
+    assert walked > 0
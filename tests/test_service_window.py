@@ -0,0 +1,71 @@
+import contextlib
+import io
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from conftest import find_journeys
+from connection_arrays import CONNECTION_FIELDS
+
+START_DATE = datetime(2026, 10, 14)
+LIST_FIELDS = ('stop_ids', 'trip_ids', 'route_ids', 'trip_headsigns', 'route_short_names', 'route_long_names',
+               'route_types', 'route_kinds')
+ARRAY_FIELDS = CONNECTION_FIELDS + ('route_priorities', 'footpath_start', 'footpath_to', 'footpath_time',
+                                    'has_connections')
+INDEX_FIELDS = ('stop_start', 'departure_seconds', 'rows', 'service_masks')
+
+
+def _processor(loader, target_date: datetime):
+    from gtfs_processing import GTFSProcessor
+    processor = GTFSProcessor(loader)
+    with contextlib.redirect_stdout(io.StringIO()):
+        processor.build_connection_graph(target_date)
+    return processor
+
+
+def _assert_same_graph(full, rolled):
+    for name in ARRAY_FIELDS:
+        assert np.array_equal(getattr(full.connections, name), getattr(rolled.connections, name)), name
+    for name in LIST_FIELDS:
+        assert list(getattr(full.connections, name)) == list(getattr(rolled.connections, name)), name
+    assert full.connections_by_mode.keys() == rolled.connections_by_mode.keys()
+    for mode, index in full.connections_by_mode.items():
+        for name in INDEX_FIELDS:
+            assert np.array_equal(getattr(index, name), getattr(rolled.connections_by_mode[mode], name)), (mode, name)
+    assert full.day_route_counts == rolled.day_route_counts
+
+
+def test_update_service_date_matches_full_build(gtfs_config):
+    #Tageswechsel über ein Wochenende: das nachgeführte Zeitfenster muss einem Neuaufbau für den Tag entsprechen,
+    #auch für CSA und RAPTOR (deren Fahrpläne aus dem Zeitfenster entstehen)
+    from address_processor import AddressProcessor
+    from gtfs_loader import GTFSLoader
+    from routing import PublicTransportRouter
+    gtfs_config.MIN_ACTIVE_ROUTE_SHARE = 0.0 #Tagesfilter erzwingen (sonst baut update_service_date komplett neu)
+    with contextlib.redirect_stdout(io.StringIO()):
+        loader = GTFSLoader()
+        loader.load_gtfs_data()
+        address_processor = AddressProcessor()
+    rolled = _processor(loader, START_DATE)
+    assert not rolled.uses_all_trips
+    names = sorted(loader.stops.stop_name.unique())
+    rnd = random.Random(11)
+
+    for days in range(1, 6):
+        target_date = START_DATE + timedelta(days=days)
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert rolled.update_service_date(target_date)
+        full = _processor(loader, target_date)
+        _assert_same_graph(full, rolled)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            routers = [PublicTransportRouter(loader, processor, address_processor) for processor in (full, rolled)]
+        for _ in range(8):
+            start, end = rnd.sample(names, 2)
+            departure = timedelta(seconds=rnd.randint(6 * 3600, 20 * 3600))
+            for engine in ('csa', 'raptor'):
+                results = [[(j.departure_time, j.arrival_time, j.transfers, j.segments) for j in
+                            find_journeys(router, start, end, departure, engine, target_date.date(), max_routes=3)]
+                           for router in routers]
+                assert results[0] == results[1], (engine, target_date, start, end, departure)
@@ -0,0 +1,19 @@
+import numpy as np
+
+from spatial_index import GridIndex
+
+
+def test_queries_without_coordinates_have_no_match():
+    index = GridIndex(np.array([49.0, 49.001, np.nan]), np.array([8.4, 8.4, 8.4]), 500)
+    queries, points, _ = index.query_radius_batch(np.array([np.nan, 49.0, 49.001]), np.array([8.4, 8.4, np.nan]), 300)
+    assert queries.tolist() == [1, 1]
+    assert sorted(points.tolist()) == [0, 1]
+
+    #Größerer Radius als die Zellgröße (mehrere Ringe) und nur ungültige Anfragen
+    queries, _, _ = index.query_radius_batch(np.array([np.nan, 49.0]), np.array([8.4, 8.4]), 1500)
+    assert queries.tolist() == [1, 1]
+    assert len(index.query_radius_batch(np.array([np.nan]), np.array([np.nan]), 300)[0]) == 0
+
+    indices, distances = index.nearest_batch(np.array([np.nan, 49.0]), np.array([8.4, 8.4]), 1, 300)
+    assert indices[:, 0].tolist() == [-1, 0]
+    assert np.isinf(distances[0, 0])